@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Time FastTree on trimmed alignments against the untrimmed alignment.
+
+A family is scaled up by repeating the sequences of a FASTA file under
+new IDs, with a fraction of the residues of each copy substituted at
+random (so that the tree builder does not collapse the copies as
+duplicates), and aligned once by hmmalign.  The alignment is trimmed
+at each maximum gap fraction given, as trees of FastTree-trimmed are
+built, and FastTree is run on the untrimmed alignment and on each
+trimmed one.  The columns and sequences kept, the time to trim, the
+wall time of FastTree, and its speedup over the untrimmed run are
+printed.  Trim times leave out writing the matrix of the alignment,
+which workers do as alignments are finished.
+
+Example, with the test data scaled to 2,000 sequences:
+
+    python benchmarks/alignment_trimming.py --copies 100
+"""
+#
+# standard library imports
+#
+import argparse
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax import app  # noqa: E402
+from lorax.matrix import load_alignment_matrix  # noqa: E402
+from lorax.stockholm import stockholm_to_fasta  # noqa: E402
+from lorax.trimming import trim_alignment  # noqa: E402
+#
+# Non-configurable global constants.
+#
+TEST_DIR = Path(__file__).resolve().parent.parent / 'lorax' / 'test'
+RESIDUES = 'ACDEFGHIKLMNPQRSTVWY'
+#
+# Helper function defs start here.
+#
+
+
+def scale_fasta(in_path, out_path, copies, substitution_rate, seed=1):
+    """Write mutated copies of the records of a FASTA file.
+
+    :param in_path: Path to FASTA file.
+    :param out_path: Path to FASTA file to be written.
+    :param copies: Number of copies.
+    :param substitution_rate: Fraction of residues of each copy after
+                              the first replaced by random residues.
+    :param seed: Seed of random substitutions.
+    :return: Number of sequences written.
+    """
+    rng = random.Random(seed)
+    records = []
+    for record in in_path.read_text().split('>')[1:]:
+        title, _newline, sequence = record.partition('\n')
+        records.append((title, ''.join(sequence.split())))
+    with out_path.open('wt') as out_fh:
+        for copy in range(copies):
+            for title, sequence in records:
+                if copy:
+                    sequence = ''.join(
+                        rng.choice(RESIDUES)
+                        if rng.random() < substitution_rate else residue
+                        for residue in sequence)
+                out_fh.write('>%d_%s\n%s\n' % (copy, title, sequence))
+    return copies * len(records)
+
+
+def run_fasttree(fasttree, fasta_path):
+    """Build a tree and return the wall time.
+
+    :param fasttree: FastTree executable.
+    :param fasta_path: Path to aligned FASTA file.
+    :return: Wall time in seconds.
+    """
+    start = time.monotonic()
+    subprocess.run([fasttree] +
+                   app.config['TREEBUILDERS']['FastTree']['peptide'] +
+                   [fasta_path.name],
+                   cwd=str(fasta_path.parent), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - start
+
+
+def main(argv=None):
+    """Trim an alignment at each gap fraction and print a table of times.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--hmm', default=str(TEST_DIR / '59026816.hmm'))
+    parser.add_argument('--fasta',
+                        default=str(TEST_DIR / 'aspartic_peptidases.faa'))
+    parser.add_argument('--copies', type=int, default=20,
+                        help='times sequences are repeated')
+    parser.add_argument('--substitution-rate', type=float, default=0.1)
+    parser.add_argument('--gap-fractions', default='0.9,0.5,0.2',
+                        help='comma-separated maximum gap fractions')
+    parser.add_argument('--min-coverage', type=float,
+                        default=app.config['ALIGNMENT_TRIMMING']
+                        ['min_coverage'])
+    parser.add_argument('--hmmalign', default=app.config['HMMALIGN_EXE'])
+    parser.add_argument('--fasttree', default=app.config['FASTTREE_EXE'])
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        sequences = scale_fasta(Path(args.fasta), work_dir / 'sequences.faa',
+                                args.copies, args.substitution_rate)
+        stockholm_path = work_dir / 'alignment.stockholm'
+        with stockholm_path.open('wb') as stockholm_fh:
+            subprocess.run([args.hmmalign] +
+                           app.config['ALIGNERS']['hmmalign'] +
+                           ['--amino', str(Path(args.hmm).resolve()),
+                            'sequences.faa'],
+                           cwd=str(work_dir), check=True,
+                           stdout=stockholm_fh)
+        fasta_path = work_dir / 'alignment.faa'
+        with fasta_path.open('wt') as fasta_fh:
+            stockholm_to_fasta(stockholm_path, fasta_fh)
+        width = load_alignment_matrix(fasta_path).shape[1]
+        untrimmed_time = run_fasttree(args.fasttree, fasta_path)
+        print('%d sequences, minimum coverage %g' % (sequences,
+                                                     args.min_coverage))
+        print('%12s %10s %10s %10s %12s %10s' % ('gap_fraction', 'columns',
+                                                 'sequences', 'trim_time',
+                                                 'tree_time', 'speedup'))
+        print('%12s %10d %10d %10s %12.2f %10.2f' % (
+            'untrimmed', width, sequences, '-', untrimmed_time, 1.))
+        for gap_fraction in [float(fraction) for fraction in
+                             args.gap_fractions.split(',')]:
+            trimmed_path = work_dir / ('trimmed-%g.faa' % gap_fraction)
+            start = time.monotonic()
+            column_map = trim_alignment(fasta_path, trimmed_path,
+                                        gap_fraction, args.min_coverage)
+            trim_time = time.monotonic() - start
+            tree_time = run_fasttree(args.fasttree, trimmed_path)
+            print('%12g %10d %10d %10.2f %12.2f %10.2f' % (
+                gap_fraction, column_map['kept_columns'],
+                column_map['kept_sequences'], trim_time, tree_time,
+                untrimmed_time / tree_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Time fused alignment and tree building against separate runs.
+
+Copies of the test family are loaded into a scratch data directory, and
+each is aligned by hmmalign and its tree built by FastTree, once as the
+two jobs of a queued calculation run them (Stockholm output written,
+converted to FASTA, and read back by the tree builder) and once as the
+fused job runs them (hmmalign piped through conversion into FastTree).
+The runs are made directly, without Redis, so the times printed leave
+out the wait of the tree job for a worker after the alignment, which the
+fused job also saves.  The alignments and trees are checked to be
+identical.
+
+Example, with 50 families:
+
+    python benchmarks/fused_pipeline.py --families 50
+"""
+#
+# standard library imports
+#
+import argparse
+import filecmp
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax import app  # noqa: E402
+from lorax.core import (plan_calculation, run_fused_pipeline,  # noqa: E402
+                        run_subprocess_with_status, HMM_FILENAME,
+                        HMMSTATS_NAME)
+from lorax.hmm import read_hmm_header  # noqa: E402
+#
+# Non-configurable global constants.
+#
+TEST_DIR = Path(__file__).resolve().parent.parent / 'lorax' / 'test'
+CALCULATION = 'hmmalign_FastTree'
+MODES = ['separate', 'fused']
+#
+# Helper function defs start here.
+#
+
+
+def load_families(client, mode, families, fasta_path, hmm_path):
+    """Create copies of a family in the data directory.
+
+    :param client: Flask test client.
+    :param mode: Prefix of family names.
+    :param families: Number of copies.
+    :param fasta_path: Path to FASTA file of sequences.
+    :param hmm_path: Path to HMM of family.
+    :return: List of family names.
+    """
+    with hmm_path.open() as hmm_fh:
+        hmm_length = read_hmm_header(hmm_fh)['M']
+    names = []
+    for family in range(families):
+        name = '%s%d' % (mode, family)
+        with fasta_path.open('rb') as fasta_fh:
+            response = client.post('/trees/%s/sequences' % name,
+                                   data={'peptide': fasta_fh})
+        if response.status_code != 200:
+            sys.exit('Unable to load family %s.' % name)
+        family_dir = Path(app.config['DATA']) / name
+        shutil.copy(str(hmm_path), str(family_dir / HMM_FILENAME))
+        (family_dir / HMMSTATS_NAME).write_text('{"M": %d}' % hmm_length)
+        names.append(name)
+    return names
+
+
+def run_family(mode, name):
+    """Align a family and build its tree.
+
+    :param mode: 'separate' or 'fused'.
+    :param name: Family name.
+    :return: Return code of tree builder.
+    """
+    plan = plan_calculation(name, CALCULATION)
+    if mode == 'fused':
+        return run_fused_pipeline(*plan['fused']['enqueue']['args'])
+    for stage in ['alignment', 'tree']:
+        returncode = run_subprocess_with_status(
+            *plan[stage]['enqueue']['args'],
+            **plan[stage]['enqueue']['kwargs'])
+        if returncode:
+            return returncode
+    return 0
+
+
+def main(argv=None):
+    """Run each family both ways and print a table of times.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--hmm', default=str(TEST_DIR / '59026816.hmm'))
+    parser.add_argument('--fasta',
+                        default=str(TEST_DIR / 'aspartic_peptidases.faa'))
+    parser.add_argument('--families', type=int, default=20)
+    parser.add_argument('--hmmalign', default=app.config['HMMALIGN_EXE'])
+    parser.add_argument('--fasttree', default=app.config['FASTTREE_EXE'])
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as data_dir:
+        app.config.update(DATA=data_dir,
+                          HMMALIGN_EXE=args.hmmalign,
+                          FASTTREE_EXE=args.fasttree,
+                          RESULT_CACHE_SIZE=0,
+                          FUSED_PIPELINE_MAX_CELLS=sys.maxsize)
+        client = app.test_client()
+        names = {}
+        for mode in MODES:
+            names[mode] = load_families(client, mode, args.families,
+                                        Path(args.fasta), Path(args.hmm))
+        print('%d families' % args.families)
+        print('%-10s %12s %14s' % ('mode', 'wall_time', 'per_family_ms'))
+        for mode in MODES:
+            start = time.monotonic()
+            for name in names[mode]:
+                if run_family(mode, name):
+                    sys.exit('%s run of %s failed.' % (mode, name))
+            wall_time = time.monotonic() - start
+            print('%-10s %12.2f %14.1f' % (mode, wall_time,
+                                           1000. * wall_time / args.families))
+        data_dir = Path(data_dir)
+        identical = all(
+            filecmp.cmp(str(data_dir / separate / path),
+                        str(data_dir / fused / path), shallow=False)
+            for separate, fused in zip(names['separate'], names['fused'])
+            for path in ['alignment.faa', 'FastTree/tree_raw.nwk'])
+        print('identical: %s' % identical)
+
+
+if __name__ == '__main__':
+    main()
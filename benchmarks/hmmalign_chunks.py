@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Time hmmalign on chunks in parallel against a single run.
+
+A family is scaled up by repeating the sequences of a FASTA file under
+new IDs.  It is aligned once by a single hmmalign run and then in 2, 4,
+... chunks up to the number of CPUs, and the wall time of each is
+printed with the speedup.  The sequence lines of each merged alignment
+are checked against those of the single run.
+
+Example, with the test data scaled to 20,000 sequences:
+
+    python benchmarks/hmmalign_chunks.py --copies 1000
+"""
+#
+# standard library imports
+#
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax import app  # noqa: E402
+from lorax.core import run_in_chunks  # noqa: E402
+#
+# Non-configurable global constants.
+#
+TEST_DIR = Path(__file__).resolve().parent.parent / 'lorax' / 'test'
+#
+# Helper function defs start here.
+#
+
+
+def scale_fasta(in_path, out_path, copies):
+    """Write copies of the records of a FASTA file, with unique IDs.
+
+    :param in_path: Path to FASTA file.
+    :param out_path: Path to FASTA file to be written.
+    :param copies: Number of copies.
+    :return: Number of sequences written.
+    """
+    records = in_path.read_text().split('>')[1:]
+    with out_path.open('wt') as out_fh:
+        for copy in range(copies):
+            for record in records:
+                out_fh.write('>%d_%s' % (copy, record))
+    return copies * len(records)
+
+
+def sequence_lines(stockholm_text):
+    """Return the sequence lines of a Stockholm alignment, joined by ID.
+
+    :param stockholm_text: Text of Stockholm file.
+    :return: Dictionary of aligned sequences by ID.
+    """
+    rows = {}
+    for line in stockholm_text.splitlines():
+        if line and not line.startswith('#') and line != '//':
+            name, row = line.split()
+            rows[name] = rows.get(name, '') + row
+    return rows
+
+
+def main(argv=None):
+    """Align in chunks and print a table of times.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--hmm', default=str(TEST_DIR / '59026816.hmm'))
+    parser.add_argument('--fasta',
+                        default=str(TEST_DIR / 'aspartic_peptidases.faa'))
+    parser.add_argument('--copies', type=int, default=200,
+                        help='times sequences are repeated')
+    parser.add_argument('--hmmalign', default=app.config['HMMALIGN_EXE'])
+    parser.add_argument('--max-chunks', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        sequences = scale_fasta(Path(args.fasta), work_dir / 'sequences.faa',
+                                args.copies)
+        cmdlist = [args.hmmalign] + app.config['ALIGNERS']['hmmalign'] + \
+            ['--amino', str(Path(args.hmm).resolve()), 'sequences.faa']
+        start = time.monotonic()
+        single = subprocess.run(cmdlist, cwd=str(work_dir), check=True,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        single_time = time.monotonic() - start
+        single_rows = sequence_lines(single)
+        print('%d sequences, %d CPUs' % (sequences, os.cpu_count()))
+        print('%8s %12s %10s %10s' % ('chunks', 'wall_time', 'speedup',
+                                      'identical'))
+        print('%8s %12.2f %10.2f %10s' % ('single', single_time, 1., True))
+        chunks = 2
+        while chunks <= max(args.max_chunks, 2):
+            out_path = work_dir / 'merged.stockholm'
+            start = time.monotonic()
+            status = run_in_chunks(cmdlist, work_dir, out_path,
+                                   io.StringIO(), chunks, None)
+            wall_time = time.monotonic() - start
+            if status.returncode:
+                sys.exit('hmmalign failed on chunks.')
+            identical = sequence_lines(out_path.read_text()) == single_rows
+            print('%8d %12.2f %10.2f %10s' % (chunks, wall_time,
+                                              single_time / wall_time,
+                                              identical))
+            chunks *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Compare scheduling policies by replaying a job mix.
+
+The job mix is read from the run times recorded in the catalog of a
+data directory (--data), from a JSON file of jobs (--jobs), or else is
+generated: mostly short jobs with a heavy tail of long ones, arriving
+at random.  Each policy is simulated on the same workers, and wait
+times, slowdowns (time in system over run time), makespan, and worker
+utilization are printed.
+
+Example, with four unlimited workers and two that take only jobs
+estimated to finish within ten minutes:
+
+    python benchmarks/scheduling.py --workers 4 --backfill 2:600
+"""
+#
+# standard library imports
+#
+import argparse
+import json
+import random
+import sys
+from datetime import datetime
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax import app, catalog, estimate  # noqa: E402
+from lorax.scheduler import simulate  # noqa: E402
+#
+# Non-configurable global constants.
+#
+POLICIES = ['fifo', 'sjf', 'sjf+aging']
+STAT_COLUMNS = ['mean_wait', 'median_wait', 'p95_wait', 'max_wait',
+                'mean_slowdown', 'makespan', 'utilization']
+#
+# Helper function defs start here.
+#
+
+
+def recorded_jobs(data_dir, limit):
+    """Return the jobs recorded in the catalog of a data directory.
+
+    Jobs arrive when their recorded runs started, and are predicted by
+    cost models fitted to the same records.
+
+    :param data_dir: Path to data directory.
+    :param limit: Maximum number of runs per tool.
+    :return: List of job dictionaries.
+    """
+    tools = [('alignment', tool) for tool in app.config['ALIGNERS']] + \
+            [('tree', tool) for tool in app.config['TREEBUILDERS']]
+    jobs = []
+    for tasktype, tool in tools:
+        records = catalog.recent_timings(data_dir, tool, limit)
+        coefficients = estimate.fit_cost_model(tasktype, records)
+        for record in records:
+            finished_at = datetime.strptime(record['finished_at'],
+                                            '%Y-%m-%dT%H:%M:%S.%f')
+            jobs.append({'arrival': finished_at.timestamp() -
+                         record['wall_time'],
+                         'predicted': estimate.predict_time(tasktype,
+                                                            coefficients,
+                                                            record),
+                         'actual': record['wall_time']})
+    if jobs:
+        start = min(job['arrival'] for job in jobs)
+        for job in jobs:
+            job['arrival'] -= start
+    return jobs
+
+
+def synthetic_jobs(count, workers, load, seed):
+    """Return a random job mix.
+
+    Run times are log-normal (median two minutes, with a tail of jobs
+    running for days), and predictions are off by a log-normal factor.
+    One job in five is a batch job.  Arrivals are Poisson, at a rate
+    that keeps the workers busy a given fraction of the time.
+
+    :param count: Number of jobs.
+    :param workers: Number of workers.
+    :param load: Fraction of worker time needed.
+    :param seed: Random seed.
+    :return: List of job dictionaries.
+    """
+    rng = random.Random(seed)
+    actual_times = [rng.lognormvariate(4.8, 1.8) for job in range(count)]
+    rate = load * workers / (sum(actual_times) / count)
+    arrival = 0.
+    jobs = []
+    for actual in actual_times:
+        arrival += rng.expovariate(rate)
+        jobs.append({'arrival': arrival,
+                     'predicted': actual * rng.lognormvariate(0., 0.5),
+                     'actual': actual,
+                     'priority_class': 'batch' if rng.random() < 0.2
+                     else 'interactive'})
+    return jobs
+
+
+def main(argv=None):
+    """Simulate each policy and print a table of results.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data', help='data directory with catalog')
+    parser.add_argument('--jobs', help='JSON file of jobs with arrival, '
+                                       'predicted, and actual times')
+    parser.add_argument('--limit', type=int, default=10000,
+                        help='most recent runs per tool from catalog')
+    parser.add_argument('--compress', type=float, default=1.,
+                        help='factor by which arrivals are sped up')
+    parser.add_argument('--count', type=int, default=5000,
+                        help='number of synthetic jobs')
+    parser.add_argument('--load', type=float, default=0.9,
+                        help='utilization of synthetic job mix')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of unlimited workers')
+    parser.add_argument('--backfill', default=None,
+                        help='NUMBER:MAX_JOB_TIME of limited workers')
+    parser.add_argument('--aging-rate', type=float,
+                        default=app.config['SCHEDULER_AGING_RATE'])
+    args = parser.parse_args(argv)
+    workers = [None] * args.workers
+    if args.backfill is not None:
+        number, max_job_time = args.backfill.split(':')
+        workers += [float(max_job_time)] * int(number)
+    if args.data is not None:
+        jobs = recorded_jobs(args.data, args.limit)
+    elif args.jobs is not None:
+        with open(args.jobs) as jobs_fh:
+            jobs = json.load(jobs_fh)
+    else:
+        jobs = synthetic_jobs(args.count, len(workers), args.load,
+                              args.seed)
+    if not jobs:
+        sys.exit('No jobs to replay.')
+    for job in jobs:
+        job['arrival'] /= args.compress
+    print('%d jobs, %d workers (%s)' % (len(jobs), len(workers),
+                                       args.backfill or 'no backfill'))
+    print('%-10s' % 'policy' + ''.join('%15s' % column
+                                       for column in STAT_COLUMNS))
+    for policy in POLICIES:
+        try:
+            stats = simulate(jobs,
+                             workers,
+                             aging_rate=args.aging_rate
+                             if policy == 'sjf+aging' else 0.,
+                             class_offsets=app.config['SCHEDULER_CLASSES'],
+                             order='fifo' if policy == 'fifo'
+                             else 'schedule')
+        except ValueError as exc:
+            sys.exit(str(exc))
+        print('%-10s' % policy + ''.join('%15.2f' % stats[column]
+                                         for column in STAT_COLUMNS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""Load-test sync and threaded web workers with slow downloads and polls.
+
+A scratch data directory is filled with families of synthetic results
+(a large aligned FASTA file with its index, a tree, run logs, and
+status files).  The app is served by gunicorn with the same number of
+worker processes twice: with sync workers, each of which handles one
+request at a time, and with threaded (gthread) workers as configured by
+gunicorn.conf.py.  While some clients download whole alignments slowly,
+others poll the read-heavy endpoints (family list, status, tree,
+alignment records, and run log) as fast as they can, and the number,
+rate, and latency of the polls answered are printed for each mode.
+
+Statuses and metrics are kept in Redis, which should be running at
+--redis-url; without it, statuses are read from their files and each
+request logs an error, which slows both modes.
+
+Example, with 2 workers, 4 slow downloads, and 8 pollers for 10 s:
+
+    python benchmarks/serving.py --workers 2 --slow-clients 4 --pollers 8
+"""
+#
+# standard library imports
+#
+import argparse
+import http.client
+import itertools
+import multiprocessing
+import random
+import runpy
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax.fasta import build_fasta_index  # noqa: E402
+#
+# Non-configurable global constants.
+#
+REPO_DIR = Path(__file__).resolve().parent.parent
+MODES = ['sync', 'gthread']
+ALPHABET = 'ACDEFGHIKLMNPQRSTVWY-'
+SEQUENCE_WIDTH = 1000  # alignment columns
+RECEIVE_BUFFER = 16 * 1024  # socket buffer of slow clients, in bytes
+READ_SIZE = 16 * 1024  # bytes read by slow clients between pauses
+REQUEST_TIMEOUT = 60.  # seconds
+STARTUP_TIMEOUT = 30.  # seconds to wait for the server to answer
+#
+# Helper function defs start here.
+#
+
+
+def write_families(data_dir, families, alignment_size, rng):
+    """Write families of synthetic results to a data directory.
+
+    :param data_dir: Path to data directory.
+    :param families: Number of families.
+    :param alignment_size: Size of each alignment in bytes.
+    :param rng: random.Random object.
+    :return: List of tuples of family name and number of sequences.
+    """
+    row = ''.join(rng.choice(ALPHABET) for unused in range(SEQUENCE_WIDTH))
+    sequences = max(alignment_size // (SEQUENCE_WIDTH + 12), 2)
+    written = []
+    for family in range(families):
+        name = 'family%d' % family
+        family_dir = data_dir / name
+        (family_dir / 'FastTree').mkdir(parents=True)
+        with (family_dir / 'alignment.faa').open('w') as alignment_fh:
+            for sequence in range(sequences):
+                alignment_fh.write('>seq%d\n%s\n' % (sequence, row))
+        build_fasta_index(family_dir / 'alignment.faa')
+        for run_dir in [family_dir, family_dir / 'FastTree']:
+            (run_dir / 'status.txt').write_text('0\n')
+            (run_dir / 'run_log.txt').write_text(
+                '0.01user 0.00system 0:00.01elapsed 100%CPU '
+                '(0avgtext+0avgdata 2304maxresident)k\n')
+        (family_dir / 'FastTree' / 'tree.nwk').write_text(
+            '(%s)%s:0.0;\n' % (','.join('seq%d:0.1' % sequence
+                                        for sequence in range(sequences)),
+                               name))
+        written.append((name, sequences))
+    return written
+
+
+def serve(options, data_dir, redis_url):
+    """Serve the app with gunicorn until terminated.
+
+    :param options: Dictionary of gunicorn settings.
+    :param data_dir: Path to data directory.
+    :param redis_url: URL of Redis server.
+    :return:
+    """
+    from gunicorn.app.base import BaseApplication
+    from lorax import app, rq
+    app.config['DATA'] = str(data_dir)
+    rq.redis_url = redis_url
+
+    class BenchmarkApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    BenchmarkApplication().run()
+
+
+def free_port():
+    """Return a TCP port that is free on localhost.
+
+    :return: Port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port):
+    """Wait until the server answers requests.
+
+    :param port: Port number.
+    :return: True if the server answered before the timeout.
+    """
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=1.)
+            connection.request('GET', '/status')
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(.1)
+    return False
+
+
+def slow_download(port, paths, pause, deadline, downloaded):
+    """Download files slowly, one after another, until a deadline.
+
+    :param port: Port number.
+    :param paths: Iterator of URL paths.
+    :param pause: Seconds between reads.
+    :param deadline: Time (of time.monotonic) at which to stop.
+    :param downloaded: List to which the number of bytes read is added.
+    :return:
+    """
+    total = 0
+    while time.monotonic() < deadline:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        sock.settimeout(REQUEST_TIMEOUT)
+        try:
+            sock.connect(('127.0.0.1', port))
+            sock.sendall(('GET %s HTTP/1.1\r\nHost: localhost\r\n'
+                          'Connection: close\r\n\r\n' %
+                          next(paths)).encode('ascii'))
+            while time.monotonic() < deadline:
+                data = sock.recv(READ_SIZE)
+                if not data:
+                    break
+                total += len(data)
+                time.sleep(pause)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+    downloaded.append(total)
+
+
+def poll(port, paths, deadline, latencies, errors):
+    """Request URLs as fast as they are answered until a deadline.
+
+    :param port: Port number.
+    :param paths: Iterator of URL paths.
+    :param deadline: Time (of time.monotonic) at which to stop.
+    :param latencies: List to which seconds per answered request are added.
+    :param errors: List to which the number of failed requests is added.
+    :return:
+    """
+    failed = 0
+    connection = None
+    while time.monotonic() < deadline:
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                '127.0.0.1', port,
+                timeout=max(deadline - time.monotonic(), .01))
+        start = time.monotonic()
+        try:
+            connection.request('GET', next(paths))
+            response = connection.getresponse()
+            response.read()
+        except OSError:  # including timeouts at the deadline
+            if time.monotonic() < deadline:
+                failed += 1
+            connection.close()
+            connection = None
+            continue
+        if response.status == 200 and time.monotonic() <= deadline:
+            latencies.append(time.monotonic() - start)
+        elif response.status != 200:
+            failed += 1
+        if response.will_close:
+            connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+    errors.append(failed)
+
+
+def run_load(port, families, args):
+    """Run slow downloads and polls against a server.
+
+    :param port: Port number.
+    :param families: List of (family name, number of sequences).
+    :param args: Parsed command-line arguments.
+    :return: Tuple of latencies of answered polls, failed polls, and
+             bytes downloaded.
+    """
+    rng = random.Random(args.seed)
+    downloads = itertools.cycle(['/trees/%s/alignment' % name
+                                 for name, unused in families])
+    polls = ['/trees/families.json']
+    for name, sequences in families:
+        polls += ['/trees/%s/FastTree/status' % name,
+                  '/trees/%s/FastTree/tree.nwk' % name,
+                  '/trees/%s/alignment?id=seq%d' % (
+                      name, rng.randrange(sequences)),
+                  '/trees/%s/hmmalign/run_log.txt' % name]
+    deadline = time.monotonic() + args.duration
+    latencies, errors, downloaded = [], [], []
+    threads = [threading.Thread(target=slow_download,
+                                args=(port, downloads, args.pause, deadline,
+                                      downloaded))
+               for unused in range(args.slow_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.pause)  # let the downloads take their workers first
+    threads += [threading.Thread(target=poll,
+                                 args=(port, itertools.cycle(
+                                     rng.sample(polls, len(polls))),
+                                       deadline, latencies, errors))
+                for unused in range(args.pollers)]
+    for thread in threads[args.slow_clients:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), sum(downloaded)
+
+
+def percentile(values, fraction):
+    """Return a percentile of values.
+
+    :param values: List of numbers.
+    :param fraction: Fraction of values at or below the percentile.
+    :return: Percentile, or NaN if there are no values.
+    """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def main(argv=None):
+    """Load-test each mode and print a table of poll rates and latencies.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    threads = runpy.run_path(str(REPO_DIR / 'gunicorn.conf.py'))['threads']
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=threads,
+                        help='threads per gthread worker')
+    parser.add_argument('--families', type=int, default=4)
+    parser.add_argument('--alignment-size', type=int,
+                        default=16 * 1024 * 1024,
+                        help='bytes per alignment')
+    parser.add_argument('--slow-clients', type=int, default=4)
+    parser.add_argument('--pause', type=float, default=.05,
+                        help='seconds between reads of slow clients')
+    parser.add_argument('--pollers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.,
+                        help='seconds of load per mode')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as data_dir:
+        data_dir = Path(data_dir)
+        families = write_families(data_dir, args.families,
+                                  args.alignment_size,
+                                  random.Random(args.seed))
+        print('%d workers, %d slow clients, %d pollers, %.0f s' % (
+            args.workers, args.slow_clients, args.pollers, args.duration))
+        print('%-8s %8s %10s %10s %10s %8s %14s' % (
+            'mode', 'polls', 'polls_per_s', 'p50_ms', 'p99_ms', 'errors',
+            'downloaded_mb'))
+        for mode in MODES:
+            port = free_port()
+            options = {'bind': '127.0.0.1:%d' % port,
+                       'workers': args.workers,
+                       'worker_class': mode,
+                       'threads': args.threads if mode == 'gthread' else 1,
+                       'graceful_timeout': 1,
+                       'loglevel': 'warning'}
+            server = multiprocessing.Process(target=serve,
+                                             args=(options, data_dir,
+                                                   args.redis_url))
+            server.start()
+            try:
+                if not wait_for_server(port):
+                    sys.exit('Server in %s mode did not start.' % mode)
+                latencies, errors, downloaded = run_load(port, families,
+                                                         args)
+            finally:
+                server.terminate()
+                server.join()
+            print('%-8s %8d %10.1f %10.1f %10.1f %8d %14.1f' % (
+                mode, len(latencies), len(latencies) / args.duration,
+                1000. * percentile(latencies, .5),
+                1000. * percentile(latencies, .99), errors,
+                downloaded / 1024. ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Time Stockholm-to-FASTA conversion against the Biopython path.
+
+A Stockholm alignment is written from the aligned test family, scaled
+up by repeating its sequences under new IDs, either interleaved in
+blocks (as Stockholm files from other tools often are) or in a single
+block (as hmmalign writes).  It is converted by reading and writing
+with Bio.AlignIO and by the streaming converter, each in a process of
+its own, and the wall time and peak resident memory of each are
+printed.  The two FASTA outputs are checked to be identical.
+
+Example, with the test data scaled to 100,000 sequences:
+
+    python benchmarks/stockholm_to_fasta.py --copies 5000
+"""
+#
+# standard library imports
+#
+import argparse
+import filecmp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax.stockholm import (END_OF_ALIGNMENT, STOCKHOLM_HEADER,  # noqa: E402
+                             stockholm_to_fasta)
+#
+# Non-configurable global constants.
+#
+TEST_DIR = Path(__file__).resolve().parent.parent / 'lorax' / 'test'
+CONVERTERS = ['biopython', 'streaming']
+#
+# Helper function defs start here.
+#
+
+
+def read_aligned_fasta(fasta_path):
+    """Return the records of an aligned FASTA file.
+
+    :param fasta_path: Path to FASTA file.
+    :return: List of tuples of ID, description, and aligned sequence.
+    """
+    records = []
+    for record in fasta_path.read_text().split('>')[1:]:
+        title, sequence = record.split('\n', 1)
+        fields = title.split(None, 1)
+        records.append((fields[0], fields[1] if len(fields) > 1 else '',
+                        sequence.replace('\n', '')))
+    return records
+
+
+def write_stockholm(records, out_path, copies, block_width):
+    """Write copies of aligned records as a Stockholm file.
+
+    :param records: List of tuples of ID, description, and sequence.
+    :param out_path: Path to Stockholm file to be written.
+    :param copies: Number of copies.
+    :param block_width: Columns per block, or 0 for a single block.
+    :return: Number of sequences written.
+    """
+    names = ['%d_%s' % (copy, record[0]) for copy in range(copies)
+             for record in records]
+    name_width = max(len(name) for name in names)
+    width = len(records[0][2])
+    block_width = block_width or width
+    with out_path.open('wt') as out_fh:
+        out_fh.write(STOCKHOLM_HEADER + '\n\n')
+        for index, name in enumerate(names):
+            out_fh.write('#=GS %-*s DE %s\n' % (name_width, name,
+                                                records[index %
+                                                        len(records)][1]))
+        for start in range(0, width, block_width):
+            out_fh.write('\n')
+            for index, name in enumerate(names):
+                out_fh.write('%-*s %s\n' % (
+                    name_width, name,
+                    records[index % len(records)][2][start:
+                                                     start + block_width]))
+        out_fh.write(END_OF_ALIGNMENT + '\n')
+    return len(names)
+
+
+def convert(converter, stockholm_path, fasta_path):
+    """Convert a Stockholm file to FASTA.
+
+    :param converter: 'biopython' or 'streaming'.
+    :param stockholm_path: Path to Stockholm file.
+    :param fasta_path: Path to FASTA file to be written.
+    :return:
+    """
+    with fasta_path.open('wt') as fasta_fh:
+        if converter == 'biopython':
+            from Bio import AlignIO
+            with stockholm_path.open() as stockholm_fh:
+                alignment = AlignIO.read(stockholm_fh, 'stockholm')
+            AlignIO.write(alignment, fasta_fh, 'fasta')
+        else:
+            stockholm_to_fasta(stockholm_path, fasta_fh,
+                               buffer_dir=fasta_path.parent)
+
+
+def run_converter(converter, stockholm_path, fasta_path):
+    """Convert in a child process and measure it.
+
+    :param converter: 'biopython' or 'streaming'.
+    :param stockholm_path: Path to Stockholm file.
+    :param fasta_path: Path to FASTA file to be written.
+    :return: Tuple of wall time in seconds and peak memory in MB.
+    """
+    start = time.monotonic()
+    child = subprocess.Popen([sys.executable, __file__, '--convert',
+                              converter, str(stockholm_path),
+                              str(fasta_path)])
+    pid, status, usage = os.wait4(child.pid, 0)
+    wall_time = time.monotonic() - start
+    if status:
+        sys.exit('%s conversion failed.' % converter)
+    return wall_time, usage.ru_maxrss / 1024.  # kB on Linux
+
+
+def main(argv=None):
+    """Convert by each path and print a table of times and memory.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--fasta',
+                        default=str(TEST_DIR /
+                                    'aspartic_peptidases_aligned.faa'))
+    parser.add_argument('--copies', type=int, default=500,
+                        help='times sequences are repeated')
+    parser.add_argument('--block-width', type=int, default=200,
+                        help='columns per block, 0 for a single block')
+    parser.add_argument('--convert', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.convert is not None:
+        convert(args.convert[0], Path(args.convert[1]),
+                Path(args.convert[2]))
+        return
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        stockholm_path = work_dir / 'alignment.stockholm'
+        sequences = write_stockholm(read_aligned_fasta(Path(args.fasta)),
+                                    stockholm_path, args.copies,
+                                    args.block_width)
+        print('%d sequences, %.1f MB of Stockholm' % (
+            sequences, stockholm_path.stat().st_size / 1024. ** 2))
+        print('%-10s %12s %12s' % ('converter', 'wall_time', 'max_rss_mb'))
+        for converter in CONVERTERS:
+            wall_time, max_rss = run_converter(
+                converter, stockholm_path, work_dir / (converter + '.faa'))
+            print('%-10s %12.2f %12.1f' % (converter, wall_time, max_rss))
+        print('identical: %s' % filecmp.cmp(str(work_dir / 'biopython.faa'),
+                                            str(work_dir / 'streaming.faa'),
+                                            shallow=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Time tree cleanup by arrays against Bio.Phylo on synthetic trees.
+
+Random trees of increasing numbers of leaves are written in Newick as
+FastTree writes them (unrooted, with a trifurcation at the top and
+support values on internal nodes).  Each is read, rooted at the
+midpoint, ladderized, and written as Newick and PhyloXML, once by
+Bio.Phylo (as cleanup_tree did) and once by lorax.trees, and the times
+are printed with whether the outputs are identical (to the release of
+Biopython pinned in requirements.txt; later releases format numbers
+differently).  Bio.Phylo is quadratic in the number of leaves, so it is
+skipped above a size.
+
+Example, up to 100,000 leaves with Bio.Phylo run up to 5,000:
+
+    python benchmarks/tree_cleanup.py --sizes 1000,5000,20000,100000
+"""
+#
+# standard library imports
+#
+import argparse
+import io
+import random
+import sys
+import time
+from pathlib import Path
+#
+# local imports
+#
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lorax.trees import ArrayTree  # noqa: E402
+#
+# Non-configurable global constants.
+#
+ROOT_NAME = 'family.FastTree'
+#
+# Helper function defs start here.
+#
+
+
+def random_newick(leaves, rng):
+    """Return a random unrooted tree as a Newick string.
+
+    Subtrees are joined at random, with exponential branch lengths.
+
+    :param leaves: Number of leaves, at least 3.
+    :param rng: random.Random object.
+    :return: Newick string.
+    """
+    subtrees = ['seq%d:%.5f' % (leaf, rng.expovariate(20.))
+                for leaf in range(leaves)]
+    while len(subtrees) > 3:
+        joined = []
+        for unused in range(2):
+            index = rng.randrange(len(subtrees))
+            subtrees[index], subtrees[-1] = subtrees[-1], subtrees[index]
+            joined.append(subtrees.pop())
+        subtrees.append('(%s,%s)%.3f:%.5f' % (joined[0], joined[1],
+                                             rng.random(),
+                                             rng.expovariate(20.)))
+    return '(%s);\n' % ','.join(subtrees)
+
+
+def biopython_cleanup(newick):
+    """Clean up a tree with Bio.Phylo.
+
+    :param newick: Newick string.
+    :return: Tuple of Newick and PhyloXML strings.
+    """
+    from Bio import Phylo
+    tree = Phylo.read(io.StringIO(newick), 'newick')
+    tree.root_at_midpoint()
+    tree.ladderize()
+    tree.root.name = ROOT_NAME
+    newick_fh = io.StringIO()
+    Phylo.write(tree, newick_fh, 'newick')
+    xml_fh = io.StringIO()
+    Phylo.write(tree, xml_fh, 'phyloxml')
+    return newick_fh.getvalue(), xml_fh.getvalue()
+
+
+def array_cleanup(newick):
+    """Clean up a tree with lorax.trees.
+
+    :param newick: Newick string.
+    :return: Tuple of Newick and PhyloXML strings.
+    """
+    tree = ArrayTree.from_newick(io.StringIO(newick))
+    tree.root_at_midpoint()
+    tree.ladderize()
+    tree.name[tree.root] = ROOT_NAME
+    newick_fh = io.StringIO()
+    tree.write_newick(newick_fh)
+    xml_fh = io.StringIO()
+    tree.write_phyloxml(xml_fh)
+    return newick_fh.getvalue(), xml_fh.getvalue()
+
+
+def timed(function, *args):
+    """Call a function and time it.
+
+    :param function: Function.
+    :return: Tuple of result and wall time in seconds.
+    """
+    start = time.monotonic()
+    result = function(*args)
+    return result, time.monotonic() - start
+
+
+def main(argv=None):
+    """Clean up trees of each size and print a table of times.
+
+    :param argv: Command-line arguments.
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='500,1000,2000,5000,20000,50000',
+                        help='comma-separated numbers of leaves')
+    parser.add_argument('--biopython-max', type=int, default=5000,
+                        help='largest tree to clean up with Bio.Phylo')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+    print('%8s %14s %14s %10s %10s' % ('leaves', 'biopython_s', 'arrays_s',
+                                       'speedup', 'identical'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        newick = random_newick(max(size, 3), rng)
+        array_output, array_time = timed(array_cleanup, newick)
+        if size > args.biopython_max:
+            print('%8d %14s %14.2f %10s %10s' % (size, '-', array_time,
+                                                 '-', '-'))
+            continue
+        biopython_output, biopython_time = timed(biopython_cleanup, newick)
+        print('%8d %14.2f %14.2f %10.1f %10s' % (
+            size, biopython_time, array_time, biopython_time / array_time,
+            biopython_output == array_output))
+
+
+if __name__ == '__main__':
+    main()
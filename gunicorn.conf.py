@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Configure gunicorn to serve lorax.
+
+gunicorn reads this file from its working directory.  Requests are
+handled by threads of each worker process (the gthread worker class), so
+a request blocked on file I/O, on Redis, on a slow client downloading a
+large alignment, or on a long-polled status change holds one thread
+rather than a whole worker, and the other threads keep serving status
+polls.  Idle keep-alive connections wait in the worker's event loop
+without holding a thread.  Settings may be changed by the environmental
+variables below, or overridden by GUNICORN_CMD_ARGS.
+"""
+#
+# standard library imports
+#
+import os
+#
+# Settings.
+#
+workers = int(os.environ.get('LORAX_WEB_WORKERS', 2))
+worker_class = os.environ.get('LORAX_WEB_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('LORAX_WEB_THREADS', 32))
+keepalive = int(os.environ.get('LORAX_WEB_KEEPALIVE', 5))  # seconds
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Account for the resources used by aligner and tree-builder runs.
+
+Each run is measured by the worker itself, from the resource usage that
+the kernel reports when the run is waited for (wait4, or getrusage of
+children for runs made of several processes).  Times and peak memory
+include those of the processes the run waited for, so wrapping commands
+in time and nice does not hide the tool.  Linux carries peak memory
+across exec, so it is at least the resident size of the worker when the
+run started.  I/O is counted as the blocks read from and written to
+storage, so reads served from the page cache are not included.
+
+A record of each run is written as JSON next to its status file.
+"""
+#
+# standard library imports
+#
+import json
+import resource
+from datetime import datetime
+#
+# Non-configurable global constants.
+#
+BLOCK_SIZE = 512  # bytes per block counted in ru_inblock and ru_oublock
+RSS_UNIT = 1024  # bytes per unit of ru_maxrss on Linux
+USAGE_FIELDS = ['user_time', 'system_time', 'max_rss', 'read_bytes',
+                'write_bytes']
+RECORD_FIELDS = ['tool', 'tasktype', 'returncode', 'wall_time'] + \
+    USAGE_FIELDS + ['finished_at']
+#
+# Helper function defs start here.
+#
+
+
+def rusage_usage(usage):
+    """Return resource usage as a dictionary.
+
+    :param usage: struct_rusage from wait4 or getrusage.
+    :return: Dictionary of CPU times in seconds and memory and I/O in
+             bytes.
+    """
+    return {'user_time': usage.ru_utime,
+            'system_time': usage.ru_stime,
+            'max_rss': usage.ru_maxrss * RSS_UNIT,
+            'read_bytes': usage.ru_inblock * BLOCK_SIZE,
+            'write_bytes': usage.ru_oublock * BLOCK_SIZE}
+
+
+def empty_usage():
+    """Return resource usage of a run that was not measured.
+
+    :return: Dictionary of usage fields, all zero.
+    """
+    return dict.fromkeys(USAGE_FIELDS, 0)
+
+
+def children_usage_since(start_usage):
+    """Return the resource usage of children waited for since a time.
+
+    Peak memory is that of the largest child of this process, which in
+    a worker that forks for each job is the largest child of the job.
+
+    :param start_usage: getrusage(RUSAGE_CHILDREN) at the start.
+    :return: Dictionary of usage fields.
+    """
+    end_usage = rusage_usage(resource.getrusage(resource.RUSAGE_CHILDREN))
+    start_usage = rusage_usage(start_usage)
+    return {field: end_usage[field] if field == 'max_rss'
+            else end_usage[field] - start_usage[field]
+            for field in USAGE_FIELDS}
+
+
+def cpu_time(usage):
+    """Return the user plus system time of a run.
+
+    :param usage: Dictionary of usage fields.
+    :return: Seconds.
+    """
+    return usage['user_time'] + usage['system_time']
+
+
+def usage_record(tool, tasktype, returncode, wall_time, usage):
+    """Return the record of a run.
+
+    :param tool: Name of aligner or tree builder.
+    :param tasktype: 'alignment' or 'tree', or None.
+    :param returncode: Return code of run.
+    :param wall_time: Elapsed time in seconds.
+    :param usage: Dictionary of usage fields.
+    :return: Dictionary of record fields.
+    """
+    return dict(usage,
+                tool=tool,
+                tasktype=tasktype,
+                returncode=returncode,
+                wall_time=wall_time,
+                finished_at=datetime.utcnow().isoformat())
+
+
+def write_usage(path, record):
+    """Write the record of a run.
+
+    :param path: Path to record file.
+    :param record: Dictionary of record fields.
+    :return:
+    """
+    with path.open(mode='wt') as usage_fh:
+        json.dump({field: record[field] for field in RECORD_FIELDS},
+                  usage_fh)
+
+
+def read_usage(path):
+    """Read the record of a run.
+
+    :param path: Path to record file.
+    :return: Dictionary of record fields, or None if missing or invalid.
+    """
+    try:
+        with path.open() as usage_fh:
+            record = json.load(usage_fh)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(record, dict) or \
+            any(field not in record for field in RECORD_FIELDS):
+        return None
+    return record
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed cache of calculation results.
+
+A cache key is a hash of the contents of the input files, the command
+line (with input file names replaced by their positions), and the
+contents of the tool binary.  Results are hard-linked into and out of
+the cache when possible, so the cache should be on the same file system
+as the data directory.  Writers must therefore replace result files
+rather than overwrite them in place.
+"""
+#
+# standard library imports
+#
+import functools
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path  # python 3.4
+#
+# Non-configurable global constants.
+#
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_CACHE_SIZE = 256  # number of file hashes kept per process
+#
+# Helper function defs start here.
+#
+
+
+@functools.lru_cache(maxsize=HASH_CACHE_SIZE)
+def _hash_file(path, mtime_ns, size):
+    del mtime_ns, size  # only used to key the cache
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's contents.
+
+    :param path: Path to file.
+    :return: Hex digest string.
+    """
+    file_stat = os.stat(str(path))
+    return _hash_file(str(path), file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def tool_identity(executable):
+    """Identify a tool by the contents of its binary.
+
+    :param executable: Name or path of executable.
+    :return: Hex digest string, or the name if the binary is not found.
+    """
+    tool_path = shutil.which(executable)
+    if tool_path is None:
+        return executable
+    return hash_file(os.path.realpath(tool_path))
+
+
+def cache_key(cmdlist, inputs, cwd, tool, extra=None):
+    """Return the cache key of a calculation.
+
+    :param cmdlist: Command-line argument list.
+    :param inputs: Dictionary of input file paths (relative to cwd) keyed
+                   by the argument through which the command reads them.
+    :param cwd: Working directory of the command.
+    :param tool: Name of executable in cmdlist.
+    :param extra: JSON-serializable data that also affects the outputs.
+    :return: Hex digest string.
+    """
+    args = [str(arg) for arg in inputs]
+    argv = ['{input%d}' % args.index(arg) if arg in args else arg
+            for arg in cmdlist]
+    key_data = {'argv': argv,
+                'inputs': [hash_file(Path(cwd) / path)
+                           for path in inputs.values()],
+                'tool': tool_identity(tool),
+                'extra': extra}
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True).encode('UTF-8')).hexdigest()
+
+
+def entry_path(cache_dir, key):
+    """Return the directory holding a cache entry.
+
+    :param cache_dir: Path to cache directory.
+    :param key: Cache key.
+    :return: Path to entry directory.
+    """
+    return Path(cache_dir) / key[:2] / key
+
+
+def _link_or_copy(src, dest):
+    tmp_path = dest.with_name('.%s.%s' % (dest.name, uuid.uuid4().hex))
+    try:
+        os.link(str(src), str(tmp_path))
+    except OSError:
+        shutil.copy2(str(src), str(tmp_path))
+    os.replace(str(tmp_path), str(dest))
+    if tmp_path.exists():  # dest was already a link to src
+        tmp_path.unlink()
+
+
+def restore(cache_dir, key, outputs):
+    """Restore cached outputs into place.
+
+    :param cache_dir: Path to cache directory.
+    :param key: Cache key.
+    :param outputs: Dictionary of destination paths keyed by output name.
+    :return: Dictionary of restored paths keyed by output name, or None on
+             a cache miss.
+    """
+    entry = entry_path(cache_dir, key)
+    try:
+        cached_names = {name: os.listdir(str(entry / name))
+                        for name in outputs}
+    except FileNotFoundError:
+        return None
+    if not all(len(names) == 1 for names in cached_names.values()):
+        return None
+    restored = {}
+    for name, dest_dir in outputs.items():
+        stored_name = cached_names[name][0]
+        restored[name] = Path(dest_dir) / stored_name
+        _link_or_copy(entry / name / stored_name, restored[name])
+    os.utime(str(entry))  # mark as recently used
+    return restored
+
+
+def store(cache_dir, key, outputs, max_size):
+    """Store outputs under a cache key, then evict to stay under max_size.
+
+    :param cache_dir: Path to cache directory.
+    :param key: Cache key.
+    :param outputs: Dictionary of stored paths keyed by output name.
+    :param max_size: Maximum total size of cache in bytes.
+    :return:
+    """
+    entry = entry_path(cache_dir, key)
+    tmp_entry = entry.with_name('.%s.%s' % (key, uuid.uuid4().hex))
+    tmp_entry.mkdir(parents=True)
+    try:
+        for name, path in outputs.items():
+            (tmp_entry / name).mkdir()
+            _link_or_copy(path, tmp_entry / name / Path(path).name)
+        os.rename(str(tmp_entry), str(entry))
+    except OSError:  # entry was stored concurrently, or disk trouble
+        shutil.rmtree(str(tmp_entry), ignore_errors=True)
+    evict(cache_dir, max_size)
+
+
+def _entry_size(entry):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(entry):
+        del dirnames
+        for filename in filenames:
+            size += os.stat(os.path.join(dirpath, filename)).st_size
+    return size
+
+
+def evict(cache_dir, max_size):
+    """Remove least-recently-used entries until the cache fits max_size.
+
+    :param cache_dir: Path to cache directory.
+    :param max_size: Maximum total size of cache in bytes.
+    :return: Number of entries removed.
+    """
+    entries = []
+    for prefix_dir in os.scandir(str(cache_dir)):
+        if not prefix_dir.is_dir():
+            continue
+        for entry in os.scandir(prefix_dir.path):
+            if entry.name.startswith('.'):
+                continue
+            entries.append((entry.stat().st_mtime, entry.path,
+                            _entry_size(entry.path)))
+    total = sum(size for mtime, path, size in entries)
+    removed = 0
+    for mtime, path, size in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
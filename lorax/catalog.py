@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""Persistent catalog of families, their results, run times, and usage.
+
+The catalog is an SQLite database at the top of the data directory,
+shared by the web service and the queue workers.  It is kept up to date
+as sequences, HMMs, and results are written, and can be rebuilt from
+the data directory at any time.
+"""
+#
+# standard library imports
+#
+import sqlite3
+from collections import OrderedDict  # python 3.1
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path  # python 3.4
+#
+# Non-configurable global constants.
+#
+CATALOG_NAME = '.catalog.sqlite'
+CATALOG_TIMEOUT = 30  # seconds to wait on a locked database
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS families (
+    name TEXT PRIMARY KEY,
+    family TEXT NOT NULL,
+    superfamily TEXT,
+    sequences INTEGER,
+    sub_sequences INTEGER,
+    max_length INTEGER,
+    min_length INTEGER,
+    total_length INTEGER,
+    hmm_name TEXT,
+    hmm_length INTEGER,
+    hmm_nseq INTEGER,
+    created_at TEXT NOT NULL,
+    modified_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    name TEXT NOT NULL,
+    method TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    modified_at TEXT NOT NULL,
+    PRIMARY KEY (name, method)
+);
+CREATE TABLE IF NOT EXISTS timings (
+    name TEXT NOT NULL,
+    method TEXT NOT NULL,
+    sequences INTEGER,
+    total_length INTEGER,
+    width INTEGER,
+    wall_time REAL NOT NULL,
+    cpu_time REAL NOT NULL,
+    finished_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_by_method ON timings (method, finished_at);
+CREATE TABLE IF NOT EXISTS usage (
+    name TEXT NOT NULL,
+    method TEXT NOT NULL,
+    returncode INTEGER NOT NULL,
+    wall_time REAL NOT NULL,
+    user_time REAL NOT NULL,
+    system_time REAL NOT NULL,
+    max_rss INTEGER NOT NULL,
+    read_bytes INTEGER NOT NULL,
+    write_bytes INTEGER NOT NULL,
+    finished_at TEXT NOT NULL,
+    PRIMARY KEY (name, method)
+);
+'''
+FAMILY_COLUMNS = ['name', 'family', 'superfamily', 'sequences',
+                  'sub_sequences', 'max_length', 'min_length', 'total_length',
+                  'hmm_name', 'hmm_length', 'hmm_nseq',
+                  'created_at', 'modified_at']
+TIMING_COLUMNS = ['name', 'method', 'sequences', 'total_length', 'width',
+                  'wall_time', 'cpu_time', 'finished_at']
+USAGE_COLUMNS = ['name', 'method', 'returncode', 'wall_time', 'user_time',
+                 'system_time', 'max_rss', 'read_bytes', 'write_bytes',
+                 'finished_at']
+USAGE_GROUPS = {'family': 'name',
+                'tool': 'method'}
+USAGE_TOTALS = OrderedDict([
+    ('runs', 'COUNT(*)'),
+    ('failures', 'SUM(returncode != 0)'),
+    ('wall_time', 'SUM(wall_time)'),
+    ('cpu_time', 'SUM(user_time + system_time)'),
+    ('user_time', 'SUM(user_time)'),
+    ('system_time', 'SUM(system_time)'),
+    ('max_rss', 'MAX(max_rss)'),
+    ('read_bytes', 'SUM(read_bytes)'),
+    ('write_bytes', 'SUM(write_bytes)')])
+#
+# Helper function defs start here.
+#
+
+
+def catalog_path(data_dir):
+    """Return the path of the catalog database.
+
+    :param data_dir: Path to data directory.
+    :return: Path to catalog.
+    """
+    return Path(data_dir) / CATALOG_NAME
+
+
+def connect(data_dir):
+    """Open the catalog, creating it if needed.
+
+    :param data_dir: Path to data directory.
+    :return: sqlite3 connection.
+    """
+    conn = sqlite3.connect(str(catalog_path(data_dir)),
+                           timeout=CATALOG_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def update_family(data_dir, name, family, superfamily=None, **fields):
+    """Create or update a catalog entry.
+
+    :param data_dir: Path to data directory.
+    :param name: Catalog name (family or family.superfamily).
+    :param family: Family name.
+    :param superfamily: Superfamily name, if any.
+    :param fields: Other columns to be set.
+    :return:
+    """
+    for key in fields:
+        if key not in FAMILY_COLUMNS:
+            raise ValueError('Unknown catalog column "%s".' % key)
+    now = _now()
+    columns = ['name', 'family', 'superfamily', 'created_at',
+               'modified_at'] + list(fields)
+    values = [name, family, superfamily, now, now] + list(fields.values())
+    updates = ['modified_at=excluded.modified_at'] + \
+        ['%s=excluded.%s' % (key, key) for key in fields]
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('INSERT INTO families (%s) VALUES (%s) '
+                     'ON CONFLICT(name) DO UPDATE SET %s' % (
+                         ', '.join(columns),
+                         ', '.join('?' * len(columns)),
+                         ', '.join(updates)),
+                     values)
+
+
+def set_result(data_dir, name, method, status):
+    """Record the status of an aligner or tree-builder run.
+
+    :param data_dir: Path to data directory.
+    :param name: Catalog name (family or family.superfamily).
+    :param method: Name of aligner or tree builder.
+    :param status: Exit code, or -1 if running.
+    :return:
+    """
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO results '
+                     '(name, method, status, modified_at) '
+                     'VALUES (?, ?, ?, ?)',
+                     (name, method, status, _now()))
+
+
+def add_timing(data_dir, name, method, wall_time, cpu_time, features):
+    """Record the run time of an aligner or tree-builder run.
+
+    :param data_dir: Path to data directory.
+    :param name: Catalog name (family or family.superfamily).
+    :param method: Name of aligner or tree builder.
+    :param wall_time: Elapsed time in seconds.
+    :param cpu_time: User plus system CPU time in seconds.
+    :param features: Dictionary of sequences, total_length, and width.
+    :return:
+    """
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('INSERT INTO timings (%s) VALUES (%s)' % (
+            ', '.join(TIMING_COLUMNS), ', '.join('?' * len(TIMING_COLUMNS))),
+                     (name, method, features.get('sequences'),
+                      features.get('total_length'), features.get('width'),
+                      wall_time, cpu_time, _now()))
+
+
+def recent_timings(data_dir, method, limit):
+    """Return the most recent run times of a method.
+
+    :param data_dir: Path to data directory.
+    :param method: Name of aligner or tree builder.
+    :param limit: Maximum number of records.
+    :return: List of dicts of timing columns, most recent first.
+    """
+    with closing(connect(data_dir)) as conn:
+        rows = conn.execute('SELECT %s FROM timings WHERE method = ? '
+                            'ORDER BY finished_at DESC LIMIT ?' %
+                            ', '.join(TIMING_COLUMNS),
+                            (method, limit)).fetchall()
+    return [dict(zip(TIMING_COLUMNS, row)) for row in rows]
+
+
+def set_usage(data_dir, name, method, record):
+    """Record the resource usage of the latest run of a method.
+
+    :param data_dir: Path to data directory.
+    :param name: Catalog name (family or family.superfamily).
+    :param method: Name of aligner or tree builder.
+    :param record: Dictionary of usage record fields (see usage module).
+    :return:
+    """
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO usage (%s) VALUES (%s)' % (
+            ', '.join(USAGE_COLUMNS), ', '.join('?' * len(USAGE_COLUMNS))),
+                     [name, method] + [record[key]
+                                       for key in USAGE_COLUMNS[2:]])
+
+
+def usage_totals(data_dir, group, sort='cpu_time', method=None, limit=None):
+    """Return resource usage summed by family or tool, largest first.
+
+    :param data_dir: Path to data directory.
+    :param group: 'family' or 'tool'.
+    :param sort: Name of total by which groups are sorted.
+    :param method: Only runs of this aligner or tree builder.
+    :param limit: Maximum number of groups (None for all).
+    :return: List of dicts of group name and totals.
+    """
+    if group not in USAGE_GROUPS:
+        raise ValueError('Unknown usage group "%s".' % group)
+    if sort not in USAGE_TOTALS:
+        raise ValueError('Unknown usage total "%s".' % sort)
+    where = '' if method is None else ' WHERE method = ?'
+    params = [] if method is None else [method]
+    with closing(connect(data_dir)) as conn:
+        rows = conn.execute('SELECT %s, %s FROM usage%s GROUP BY %s '
+                            'ORDER BY %s DESC, %s LIMIT ?' % (
+                                USAGE_GROUPS[group],
+                                ', '.join(USAGE_TOTALS.values()),
+                                where,
+                                USAGE_GROUPS[group],
+                                USAGE_TOTALS[sort],
+                                USAGE_GROUPS[group]),
+                            params + [-1 if limit is None else limit]
+                            ).fetchall()
+    return [OrderedDict([(group, row[0])] + list(zip(USAGE_TOTALS, row[1:])))
+            for row in rows]
+
+
+def delete_family(data_dir, name):
+    """Remove a catalog entry, its results, and their usage.
+
+    :param data_dir: Path to data directory.
+    :param name: Catalog name (family or family.superfamily).
+    :return:
+    """
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('DELETE FROM families WHERE name = ?', (name,))
+        conn.execute('DELETE FROM results WHERE name = ?', (name,))
+        conn.execute('DELETE FROM usage WHERE name = ?', (name,))
+
+
+def query(data_dir,
+          prefix=None,
+          superfamilies=False,
+          min_sequences=None,
+          max_sequences=None,
+          has_hmm=None,
+          finished=None,
+          offset=0,
+          limit=None):
+    """Return catalog entries matching filters, sorted by name.
+
+    :param data_dir: Path to data directory.
+    :param prefix: Only names starting with this string.
+    :param superfamilies: If True, include superfamily entries.
+    :param min_sequences: Minimum number of sequences.
+    :param max_sequences: Maximum number of sequences.
+    :param has_hmm: If not None, whether an HMM must (not) be present.
+    :param finished: Only entries with a successful run of this method.
+    :param offset: Number of matching entries to skip.
+    :param limit: Maximum number of entries to return (None for all).
+    :return: Tuple of total number of matches and list of entry dicts.
+    """
+    clauses = []
+    params = []
+    if prefix:
+        clauses.append("name >= ? AND name < ?")
+        params += [prefix, prefix + '\U0010ffff']
+    if not superfamilies:
+        clauses.append('superfamily IS NULL')
+    if min_sequences is not None:
+        clauses.append('sequences >= ?')
+        params.append(min_sequences)
+    if max_sequences is not None:
+        clauses.append('sequences <= ?')
+        params.append(max_sequences)
+    if has_hmm is not None:
+        clauses.append('hmm_name IS NOT NULL' if has_hmm
+                       else 'hmm_name IS NULL')
+    if finished is not None:
+        clauses.append('name IN (SELECT name FROM results '
+                       'WHERE method = ? AND status = 0)')
+        params.append(finished)
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    page = ' ORDER BY name LIMIT ? OFFSET ?'
+    page_params = params + [-1 if limit is None else limit, offset]
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('BEGIN')  # read all tables from one snapshot
+        total = conn.execute('SELECT COUNT(*) FROM families' + where,
+                             params).fetchone()[0]
+        rows = conn.execute('SELECT %s FROM families%s%s' % (
+            ', '.join(FAMILY_COLUMNS), where, page), page_params).fetchall()
+        results = conn.execute('SELECT name, method, status FROM results '
+                               'WHERE name IN (SELECT name FROM families%s%s)'
+                               % (where, page), page_params).fetchall()
+    entries = OrderedDict()
+    for row in rows:
+        entries[row[0]] = dict(zip(FAMILY_COLUMNS, row), results={})
+    for name, method, status in results:
+        entries[name]['results'][method] = status
+    return total, list(entries.values())
+
+
+def replace_all(data_dir, families, results, usages=()):
+    """Replace the whole catalog contents in a single transaction.
+
+    Run times are kept, since they are not recorded in the data
+    directory.
+
+    :param data_dir: Path to data directory.
+    :param families: Iterable of dicts of family columns.
+    :param results: Iterable of (name, method, status) tuples.
+    :param usages: Iterable of (name, method, usage record) tuples.
+    :return:
+    """
+    now = _now()
+    with closing(connect(data_dir)) as conn, conn:
+        conn.execute('DELETE FROM families')
+        conn.execute('DELETE FROM results')
+        conn.execute('DELETE FROM usage')
+        conn.executemany(
+            'INSERT INTO families (%s) VALUES (%s)' % (
+                ', '.join(FAMILY_COLUMNS),
+                ', '.join('?' * len(FAMILY_COLUMNS))),
+            ([entry.get(key, now if key.endswith('_at') else None)
+              for key in FAMILY_COLUMNS] for entry in families))
+        conn.executemany(
+            'INSERT OR REPLACE INTO results '
+            '(name, method, status, modified_at) VALUES (?, ?, ?, ?)',
+            ((name, method, status, now) for name, method, status in results))
+        conn.executemany(
+            'INSERT OR REPLACE INTO usage (%s) VALUES (%s)' % (
+                ', '.join(USAGE_COLUMNS), ', '.join('?' * len(USAGE_COLUMNS))),
+            ([name, method] + [record[key] for key in USAGE_COLUMNS[2:]]
+             for name, method, record in usages))
@@ -5,6 +5,7 @@
 # Library imports.
 #
 import datetime
+import os
 #
 # Name of this service.
 #
@@ -49,6 +50,7 @@ def configure_app(app):
         'hmmalign': ["--trim", "--informat", "FASTA"]  # command-line arguments
     }
     app.config['HMMALIGN_EXE'] = 'hmmalign'
+    app.config['HMMSTAT_EXE'] = 'hmmstat'
     #
     # Definitions for tree-building algorithms.
     #
@@ -64,10 +66,114 @@ def configure_app(app):
         }
     }
     #
+    # Compression of stored results.  Keys are file names, values are
+    # None (uncompressed), 'gzip', or 'zstd' (requires the zstandard
+    # package).  Compressed files get a .gz or .zst suffix.
+    #
+    app.config['STORAGE_CODECS'] = {
+        'alignment.stockholm': None,
+        'alignment.faa': None,
+        'alignment.fna': None,
+        'tree.nwk': None,
+        'tree.xml': None
+    }
+    #
+    # Maximum size in bytes of the cache of alignment and tree results.
+    # Runs with identical inputs, command line, and tool binary are
+    # restored from the cache instead of being recomputed.  Set to 0
+    # to disable caching.
+    #
+    app.config['RESULT_CACHE_SIZE'] = 10 * 1024 * 1024 * 1024
+    #
+    # Number of hmmstat processes run at once by bulk loads of families.
+    # 0 means one per CPU.
+    #
+    app.config['BULK_LOAD_WORKERS'] = 0
+    #
+    # Time in seconds for which batches of calculations, and the results
+    # of their jobs, are kept in Redis.
+    #
+    app.config['BATCH_TTL'] = 7 * 24 * 60 * 60  # 7 days
+    #
+    # Scheduling of queued jobs.  Workers started with
+    # "-w lorax.scheduler.BackfillWorker" take jobs in order of
+    #     class offset + estimated time + aging rate * time queued,
+    # so short jobs go first but no job waits forever.  Calculations
+    # requested one at a time are "interactive", those of bulk requests
+    # are "batch".  A worker with a maximum job time (set by the
+    # environmental variable LORAX_SCHEDULER_MAX_JOB_TIME, 0 for none)
+    # only takes jobs estimated, by fitted run-time models, to finish
+    # within that many seconds.
+    #
+    app.config['SCHEDULER_CLASSES'] = {
+        'interactive': 0,
+        'batch': 60 * 60  # seconds of waiting
+    }
+    app.config['SCHEDULER_AGING_RATE'] = 1.
+    app.config['SCHEDULER_MAX_JOB_TIME'] = int(
+        os.environ.get('LORAX_SCHEDULER_MAX_JOB_TIME', 0))
+    #
+    # Threads of aligner and tree-builder runs.  A run gets one thread
+    # per cells_per_thread cells (sequences times alignment width or HMM
+    # length) of its family, up to max_threads (0 for no limit) and the
+    # cores free on the host of a PackingWorker.  hmmalign runs with more
+    # than one thread align chunks of the sequences in parallel.  Workers
+    # on a host share WORKER_CORES cores (0 means all CPUs available).
+    # Other workers run tools with OMP_NUM_THREADS threads.
+    #
+    app.config['TOOL_THREADS'] = {
+        'hmmalign': {'cells_per_thread': 2000000, 'max_threads': 0},
+        'FastTree': {'cells_per_thread': 1000000, 'max_threads': 4},
+        'RAxML': {'cells_per_thread': 100000, 'max_threads': 0}
+    }
+    app.config['WORKER_CORES'] = 0
+    #
+    # Combined calculations (e.g., hmmalign_FastTree) of families of up
+    # to this many cells are run as one job, which pipes the alignment
+    # into tree builders that read stdin (FastTree) and writes no
+    # Stockholm file.  Set to 0 to always queue alignment and tree apart.
+    #
+    app.config['FUSED_PIPELINE_MAX_CELLS'] = 2000000
+    #
+    # Statuses of calculations are kept in Redis as well as in status
+    # files.  Bulk status requests may wait up to STATUS_WAIT_LIMIT
+    # seconds for a change (long polling).  Streams of status events are
+    # closed after STATUS_STREAM_TIME seconds (clients reconnect), with a
+    # comment sent after STATUS_HEARTBEAT idle seconds to keep them open.
+    #
+    app.config['STATUS_WAIT_LIMIT'] = 60
+    app.config['STATUS_STREAM_TIME'] = 5 * 60
+    app.config['STATUS_HEARTBEAT'] = 15
+    #
+    # Incremental alignments.  If INCREMENTAL_ALIGNMENTS is True, hmmalign
+    # runs align only the sequences that are new or changed since the
+    # last alignment of the family (or, for a superfamily, of its family)
+    # and append them to it.  Tree builders listed in INCREMENTAL_TREE_ARGS
+    # then start from the tree of that alignment with the sequences placed
+    # on it, refined with these command-line arguments, instead of
+    # building the tree from scratch.
+    #
+    app.config['INCREMENTAL_ALIGNMENTS'] = True
+    app.config['INCREMENTAL_TREE_ARGS'] = {
+        'FastTree': ['-nni', '0', '-spr', '0', '-mlnni', '2']
+    }
+    #
+    # Trimming of alignments for tree building.  Each tree builder is
+    # also run as <builder>-trimmed (e.g., FastTree-trimmed or
+    # hmmalign_FastTree-trimmed) on the alignment without the columns in
+    # which more than max_gap_fraction of the sequences have gaps, and
+    # then without the sequences with residues in fewer than
+    # min_coverage of the columns kept (0 keeps all sequences).
+    #
+    app.config['ALIGNMENT_TRIMMING'] = {'max_gap_fraction': 0.5,
+                                        'min_coverage': 0.}
+    #
     # Binaries.
     #
     app.config['FASTTREE_EXE'] = 'FastTree'
+    app.config['FASTTREEMP_EXE'] = 'FastTreeMP'
     app.config['RAXML_EXE'] = 'raxmlHPC'
+    app.config['RAXML_PTHREADS_EXE'] = 'raxmlHPC-PTHREADS'
     #
     # Current run.
     #
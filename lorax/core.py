@@ -4,23 +4,62 @@
 #
 # standard library imports
 #
-import io
 import json
+import io
+import multiprocessing
 import os
 import shutil
+import sqlite3
+import resource
 import subprocess
+import tarfile
+import tempfile
+import time
+import uuid
 from collections import OrderedDict  # python 3.1
+from concurrent.futures import ThreadPoolExecutor, as_completed  # python 3.2
 from datetime import datetime
 from pathlib import Path  # python 3.4
 #
 # third-party imports
 #
-from flask import Response, request, abort, render_template
-from Bio import SeqIO, AlignIO, Phylo
+import click
+from flask import (Response, g, request, abort, render_template,
+                   stream_with_context, url_for)
+from redis.exceptions import LockNotOwnedError, RedisError
+from rq import Worker, get_current_job
+from rq.job import JobStatus
+from werkzeug.exceptions import HTTPException
 #
 # local imports
 #
 from . import app, rq
+from . import accounting, cache, catalog, estimate, inflight
+from .cores import (CHUNKED_TOOLS, PackingWorker, host_cores, job_threads,
+                    threaded_command, threads_wanted)
+from .fasta import (build_fasta_index, copy_fasta, fasta_index_path,
+                    fetch_fasta_records, iter_lines, load_fasta_index,
+                    record_digests, FAI_EXTENSION)
+from .files import (codec_extension, copy_stored, discard_other_variants,
+                    find_stored, path_codec, plain_path, replace_stored,
+                    send_data_file, stored_variants, CODEC_EXTENSIONS,
+                    COPY_CHUNK_SIZE)
+from .hmm import hmmstat, read_hmm_header
+from .matrix import (build_alignment_matrix, column_stats,
+                     load_alignment_matrix, row_numbers, window_records,
+                     MATRIX_EXTENSION)
+from .metrics import (observe_tool_usage, render_metrics,
+                      FASTA_INGEST_SIZE, FASTA_INGEST_TIME, METRICS_MIMETYPE,
+                      REQUEST_DURATION)
+from .placement import place_sequences
+from .scheduler import (ESTIMATES_KEY_PREFIX, finish_job, schedule_job,
+                        scheduled_ahead)
+from .status import (fetch_statuses, forget_statuses, publish_status,
+                     remember_status, replace_statuses, status_changes)
+from .stockholm import (append_to_fasta_alignment, merge_stockholm,
+                        pfam_to_fasta_records, split_fasta, stockholm_to_fasta)
+from .trees import ArrayTree
+from .trimming import trim_alignment
 #
 # Non-configurable global constants.
 #
@@ -32,6 +71,7 @@ SEQUENCE_EXTENSIONS = OrderedDict([
 SEQUENCES_NAME = 'sequences'
 ALIGNMENT_NAME = 'alignment'
 RUN_LOG_NAME = 'run_log.txt'
+RUN_USAGE_NAME = 'run_usage.json'
 STATUS_NAME = 'status.txt'
 STOCKHOLM_NAME = 'alignment.stockholm'
 RAW_TREE_NAME = 'tree_raw.nwk'
@@ -41,6 +81,24 @@ SEQUENCE_DATA_NAME = 'sequence_data.json'
 HMM_FILENAME = 'family.hmm'
 HMMSTATS_NAME = 'hmmstats.json'
 FAMILIES_NAME = 'families.json'
+CATALOG_JSON_NAME = 'catalog.json'
+ESTIMATES_JSON_NAME = 'estimates.json'
+ALIGNMENT_STATS_NAME = 'alignment_stats.json'
+USAGE_JSON_NAME = 'usage.json'
+RESULT_CACHE_NAME = '.result_cache'
+UPLOAD_DIR_NAME = '.uploads'
+HMM_EXTENSION = '.hmm'
+CHUNK_DIR_PREFIX = '.chunks-'  # temporary directory of chunked alignments
+ALIGNMENT_MANIFEST_NAME = '.aligned_sequences.json'  # inputs of alignment
+ADDED_SEQUENCES_NAME = '.added_sequences.fa'  # sequences not yet aligned
+ADDED_ALIGNMENT_NAME = '.added_alignment.stockholm'
+START_TREE_NAME = '.start_tree.nwk'  # family tree with added sequences
+START_TREE_SWITCHES = {'FastTree': '-intree', 'RAxML': '-t'}
+STDIN_TREEBUILDERS = ['FastTree']  # tree builders that read stdin
+TRIMMED_SUFFIX = '-trimmed'  # of tree builders run on trimmed alignments
+TRIMMED_ALIGNMENT_NAME = '.trimmed_alignment.fa'  # input of trimmed runs
+TRIMMED_COLUMNS_NAME = 'trimmed_columns.json'  # columns of trimmed runs
+COMMAND_WRAPPERS = ['time', 'nice']  # prefixes of aligner and tree commands
 ALL_FILENAMES = ['',  # don't allow null name
                  ALIGNMENT_NAME + SEQUENCE_EXTENSIONS['DNA'],
                  ALIGNMENT_NAME + SEQUENCE_EXTENSIONS['peptide'],
@@ -50,15 +108,54 @@ ALL_FILENAMES = ['',  # don't allow null name
                  STATUS_NAME,
                  SEQUENCE_DATA_NAME,
                  RUN_LOG_NAME,
+                 RUN_USAGE_NAME,
                  STOCKHOLM_NAME,
                  HMMSTATS_NAME,
                  FAMILIES_NAME,
-                 PHYLOXML_NAME] + ['FastTree', 'RAxML']
+                 PHYLOXML_NAME,
+                 TRIMMED_COLUMNS_NAME] + \
+                [name + FAI_EXTENSION for name in [
+                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS['DNA'],
+                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS['peptide'],
+                    SEQUENCES_NAME + SEQUENCE_EXTENSIONS['DNA'],
+                    SEQUENCES_NAME + SEQUENCE_EXTENSIONS['peptide']]] + \
+                [ALIGNMENT_NAME + ext + MATRIX_EXTENSION for ext in
+                 SEQUENCE_EXTENSIONS.values()] + \
+                [name + ext for name in [
+                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS['DNA'],
+                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS['peptide'],
+                    STOCKHOLM_NAME] for ext in CODEC_EXTENSIONS.values()] + \
+                [builder + suffix for suffix in ['', TRIMMED_SUFFIX]
+                 for builder in ['FastTree', 'RAxML']]
 # MIME types.
 NEWICK_MIMETYPE = 'application/newick'
 JSON_MIMETYPE = 'application/json'
 FASTA_MIMETYPE = 'application/fasta'
 TEXT_MIMETYPE = 'text/plain'
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+# Decimal places of fractions in alignment stats.
+STATS_DECIMALS = 4
+# Default and maximum number of catalog entries per page.
+CATALOG_PAGE_SIZE = 100
+CATALOG_PAGE_LIMIT = 1000
+# Bulk-load job parameters.
+BULK_PROGRESS_INTERVAL = 100  # archive members between progress reports
+BULK_ERROR_LIMIT = 100  # number of error messages kept
+BULK_LOAD_METHOD = 'bulk_load'  # name under which load times are recorded
+HMMSTAT_JOB_TIME = 1.  # seconds; hmmstat of one HMM takes far less
+# Job-coalescing parameters.
+QUEUE_LOCK_TIMEOUT = 10 * 60  # longest seconds a family is locked to queue
+# Batch-submission parameters.
+BATCH_KEY_PREFIX = 'lorax:batch:'
+BATCH_PIPELINE_SIZE = 1000  # families queued per Redis transaction
+BATCH_STATUS_COUNTS = {'queued': 'queued',
+                       'deferred': 'queued',
+                       'scheduled': 'queued',
+                       'started': 'running',
+                       'finished': 'finished',
+                       'failed': 'failed',
+                       'stopped': 'failed',
+                       'canceled': 'failed'}
 # hmmalign stuff.
 HMM_SWITCHES = {'peptide': 'amino',
                 'DNA': 'dna'}
@@ -74,7 +171,6 @@ def create_fasta(familyname, data_name, superfamily=None):
     :param superfamily:
     :return:
     """
-    record_dict = None
     infileext = None
     if not superfamily:
         path = Path(app.config['DATA']) / familyname
@@ -98,61 +194,442 @@ def create_fasta(familyname, data_name, superfamily=None):
         fasta = None
         app.logger.error('Unrecognized request for FASTA.')
         abort(400)
-    try:  # parse FASTA file
-        record_dict = SeqIO.to_dict(
-            SeqIO.parse(io.StringIO(fasta.read().decode('UTF-8')), 'fasta'))
-        if len(record_dict) < 1:
-            raise ValueError
-    except (ValueError, RuntimeError):
-        app.logger.error('Unparseable/empty FASTA requested for family "%s".',
-                         familyname)
-        abort(406)
-    lengths = [len(rec.seq) for rec in record_dict.values()]
     infilename = data_name + infileext
-    if superfamily:  # Do superfamily processing
-        sub_path = Path(app.config['DATA']) / familyname / infilename
-        sub_parsed_fasta = SeqIO.parse(str(sub_path), 'fasta')
-        sub_record_dict = SeqIO.to_dict(sub_parsed_fasta)
-        for rec in record_dict.values():
-            if not rec.id.startswith(superfamily):
-                rec.id = superfamily + '.' + rec.id
-                rec.description = superfamily + '.' + rec.description
-        record_dict.update(sub_record_dict)  # combine sequences
-        fasta_dict = {'sequences': len(record_dict),
-                      'sub_sequences': len(sub_record_dict),
-                      'max_length': max(lengths),
-                      'min_length': min(lengths),
-                      'total_length': sum(lengths),
+    sub_path = Path(app.config['DATA']) / familyname / infilename
+    if superfamily and not sub_path.exists():
+        app.logger.error('No parent FASTA file for superfamily "%s.%s".',
+                         familyname, superfamily)
+        abort(428)
+    try:
+        fasta_dict = save_fasta(iter_lines(fasta.stream), path, infilename,
+                                familyname, superfamily)
+    except (ValueError, RuntimeError) as exc:
+        app.logger.error('Unparseable/empty FASTA requested for family '
+                         '"%s": %s', familyname, exc)
+        abort(406)
+    return Response(json.dumps(fasta_dict), mimetype=JSON_MIMETYPE)
+
+
+def save_fasta(lines, path, infilename, familyname, superfamily=None):
+    """Normalize FASTA records and save them with their index and stats.
+
+    Records are streamed to a temporary file that is renamed into place
+    once the whole input has been validated.
+
+    :param lines: Iterable of FASTA-formatted lines.
+    :param path: Path to family (or superfamily) directory.
+    :param infilename: Name of sequence file to be written.
+    :param familyname: Name of family.
+    :param superfamily: Name of superfamily, if any.
+    :return: Dictionary of sequence statistics.
+    """
+    start_time = time.monotonic()
+    sub_stats = None
+    sub_path = Path(app.config['DATA']) / familyname / infilename
+    seen_ids = set()
+    tmp_path = path / ('.%s.%s' % (infilename, uuid.uuid4().hex))
+    try:
+        with tmp_path.open(mode='w') as tmp_fh:
+            stats = copy_fasta(lines, tmp_fh, seen_ids, prefix=superfamily)
+            if stats['sequences'] < 1:
+                raise ValueError('No sequences found.')
+            if superfamily:  # Do superfamily processing
+                with sub_path.open(mode='rb') as sub_fh:
+                    sub_stats = copy_fasta(iter_lines(sub_fh), tmp_fh,
+                                           seen_ids, skip_duplicates=True)
+    except BaseException:
+        tmp_path.unlink()
+        raise
+    if superfamily:
+        fasta_dict = {'sequences': stats['sequences'] + sub_stats['written'],
+                      'sub_sequences': sub_stats['sequences'],
+                      'max_length': stats['max_length'],
+                      'min_length': stats['min_length'],
+                      'total_length': stats['total_length'],
                       'overwrite': False,
                       'superfamily_name': superfamily}
     else:
-        fasta_dict = {'sequences': len(record_dict),
-                      'max_length': max(lengths),
-                      'min_length': min(lengths),
-                      'total_length': sum(lengths),
+        fasta_dict = {'sequences': stats['sequences'],
+                      'max_length': stats['max_length'],
+                      'min_length': stats['min_length'],
+                      'total_length': stats['total_length'],
                       'overwrite': False}
     app.logger.debug('Saving FASTA file for family "%s".', familyname)
     if (path / infilename).exists():
         app.logger.warning('Overwriting existing FASTA file for family %s.',
                            familyname)
         fasta_dict['overwrite'] = True
-    with open(str(path / infilename), 'w') as fasta_outfh:
-        for seq in record_dict.values():
-            SeqIO.write(seq, fasta_outfh, 'fasta')
+    os.replace(str(tmp_path), str(path / infilename))
+    forget_inflight_jobs(familyname)
+    discard_other_variants(path / infilename)
+    build_fasta_index(path / infilename)
     with open(str(path / SEQUENCE_DATA_NAME), 'w') as sequence_data_fh:
         json.dump(fasta_dict, sequence_data_fh)
-    return Response(json.dumps(fasta_dict), mimetype=JSON_MIMETYPE)
+    kind = 'superfamily' if superfamily else 'family'
+    record_metric(FASTA_INGEST_SIZE, (path / infilename).stat().st_size,
+                  kind=kind)
+    record_metric(FASTA_INGEST_TIME, time.monotonic() - start_time,
+                  kind=kind)
+    update_catalog(catalog.update_family,
+                   catalog_name(familyname, superfamily),
+                   familyname,
+                   superfamily,
+                   sequences=fasta_dict['sequences'],
+                   sub_sequences=fasta_dict.get('sub_sequences'),
+                   max_length=fasta_dict['max_length'],
+                   min_length=fasta_dict['min_length'],
+                   total_length=fasta_dict['total_length'])
+    return fasta_dict
+
+
+def catalog_name(familyname, superfamily=None):
+    """Return the name under which a family is listed in the catalog.
+
+    :param familyname: Family name.
+    :param superfamily: Superfamily name, if any.
+    :return: Catalog name, as used in URLs.
+    """
+    if superfamily is None:
+        return familyname
+    return familyname + '.' + superfamily
+
+
+def update_catalog(update, *args, **kwargs):
+    """Apply an update to the family catalog, logging any failure.
+
+    The catalog can always be rebuilt from the data directory, so a
+    failed update does not fail the request.
+
+    :param update: Function from the catalog module.
+    :param args: Arguments following the data directory.
+    :param kwargs: Keyword arguments.
+    :return:
+    """
+    try:
+        update(app.config['DATA'], *args, **kwargs)
+    except sqlite3.Error as exc:  # pragma: no cover
+        app.logger.error('Unable to update catalog: %s', exc)
+
+
+def read_status(path):
+    """Read a numeric status from file.
+
+    :param path:
+    :return: Status code, or None if not readable.
+    """
+    try:
+        with path.open() as status_fh:
+            return int(status_fh.read())
+    except (IOError, ValueError):
+        return None
+
+
+def update_status_cache(update, *args):
+    """Apply an update to the statuses kept in Redis, logging any failure.
+
+    Status files are the record of calculations, so a failed update
+    does not fail the run or request.
+
+    :param update: Function from the status module.
+    :param args: Arguments following the Redis connection.
+    :return: Return value of update, or None if it failed.
+    """
+    try:
+        return update(rq.connection, *args)
+    except RedisError as exc:
+        app.logger.error('Unable to update status cache: %s', exc)
+        return None
+
+
+def record_metric(histogram, value, **labels):
+    """Add an observation to a histogram of the metrics, if Redis is up.
+
+    :param histogram: Histogram from the metrics module.
+    :param value: Observed value.
+    :param labels: Value of each label.
+    :return:
+    """
+    try:
+        histogram.observe(rq.connection, value, **labels)
+    except RedisError as exc:
+        app.logger.debug('Unable to record metric: %s', exc)
+
+
+def command_tool(cmdlist):
+    """Return the name of the program run by a command line.
+
+    :param cmdlist: Command line, possibly wrapped in time and nice.
+    :return: Base name of first argument that is not a wrapper.
+    """
+    for arg in cmdlist:
+        if arg not in COMMAND_WRAPPERS:
+            return Path(arg).name
+    return Path(cmdlist[-1]).name
+
+
+def record_run_usage(status_path, catalog_entry, record):
+    """Save the resource usage of a run next to its status file, in the
+    catalog, and in the metadata of the current job, and add it to the
+    tool metrics.
+
+    :param status_path: Path to status file of run.
+    :param catalog_entry: (name, method) under which status is cataloged,
+                          or None.
+    :param record: Dictionary of usage record fields.
+    :return:
+    """
+    accounting.write_usage(status_path.parent / RUN_USAGE_NAME, record)
+    if catalog_entry is not None:
+        update_catalog(catalog.set_usage, *catalog_entry, record)
+    job = get_current_job()
+    if job is not None:
+        job.meta.setdefault('usage', {})[record['tool']] = record
+        job.save_meta()
+    try:
+        observe_tool_usage(rq.connection, record['tool'], record)
+    except RedisError as exc:
+        app.logger.debug('Unable to record metric: %s', exc)
+
+
+def status_field(path):
+    """Return the field of a status file in the status cache.
+
+    :param path: Path to status file.
+    :return: Path relative to the data directory, or None if outside it.
+    """
+    try:
+        return path.relative_to(app.config['DATA']).as_posix()
+    except ValueError:
+        return None
+
+
+def read_statuses(paths):
+    """Read the statuses of calculations, from Redis if cached there.
+
+    Statuses not in Redis are read from their files and cached.
+
+    :param paths: List of paths to status files.
+    :return: List of status codes, None for those with no status.
+    """
+    fields = [status_field(path) for path in paths]
+    codes = update_status_cache(fetch_statuses, fields) or [None] * len(paths)
+    for index, (path, field, code) in enumerate(zip(paths, fields, codes)):
+        if code is None:
+            code = codes[index] = read_status(path)
+            if code is not None and field is not None:
+                update_status_cache(remember_status, field, code)
+    return codes
+
+
+def tree_methods():
+    """Return the names of tree-building methods.
+
+    Each tree builder is also run on trimmed alignments, under its name
+    with TRIMMED_SUFFIX (e.g., FastTree-trimmed).
+
+    :return: List of names of tree builders and their trimmed variants.
+    """
+    return [builder + suffix for suffix in ['', TRIMMED_SUFFIX]
+            for builder in app.config['TREEBUILDERS']]
+
+
+def split_tree_method(method):
+    """Return the tree builder of a tree-building method.
+
+    :param method: Name of tree-building method.
+    :return: Tuple of name of tree builder (None if method is not a
+             tree-building method) and whether alignments are trimmed.
+    """
+    if method in app.config['TREEBUILDERS']:
+        return method, False
+    if method.endswith(TRIMMED_SUFFIX) and \
+            method[:-len(TRIMMED_SUFFIX)] in app.config['TREEBUILDERS']:
+        return method[:-len(TRIMMED_SUFFIX)], True
+    return None, False
+
+
+def scan_catalog_entry(path, familyname, superfamily=None):
+    """Characterize a family directory for the catalog.
+
+    :param path: Path to family or superfamily directory.
+    :param familyname: Family name.
+    :param superfamily: Superfamily name, if any.
+    :return: Tuple of entry dict, list of (name, method, status), and
+             list of (name, method, usage record).
+    """
+    name = catalog_name(familyname, superfamily)
+    entry = {'name': name,
+             'family': familyname,
+             'superfamily': superfamily}
+    try:
+        with (path / SEQUENCE_DATA_NAME).open() as sequence_data_fh:
+            sequence_data = json.load(sequence_data_fh)
+        for key in ['sequences', 'sub_sequences', 'max_length',
+                    'min_length', 'total_length']:
+            entry[key] = sequence_data.get(key)
+    except (IOError, ValueError):
+        pass
+    try:
+        with (path / HMMSTATS_NAME).open() as hmmstats_fh:
+            hmmstats = json.load(hmmstats_fh)
+        entry['hmm_name'] = hmmstats.get('name')
+        entry['hmm_length'] = hmmstats.get('M')
+        entry['hmm_nseq'] = hmmstats.get('nseq')
+    except (IOError, ValueError):
+        pass
+    results = []
+    aligner_status = read_status(path / STATUS_NAME)
+    if aligner_status is not None:
+        for aligner in app.config['ALIGNERS']:
+            results.append((name, aligner, aligner_status))
+    for builder in tree_methods():
+        builder_status = read_status(path / builder / STATUS_NAME)
+        if builder_status is None and \
+                find_stored(path / builder / TREE_NAME) is not None:
+            builder_status = 0  # copied in without running
+        if builder_status is not None:
+            results.append((name, builder, builder_status))
+    usages = []
+    for run_dir in [path] + [path / builder for builder in tree_methods()]:
+        record = accounting.read_usage(run_dir / RUN_USAGE_NAME)
+        if record is not None:
+            usages.append((name, record['tool'], record))
+    return entry, results, usages
+
+
+def rebuild_catalog():
+    """Rebuild the family catalog by scanning the data directory.
+
+    The statuses cached in Redis are replaced by those of the status
+    files found.
+
+    :return: Number of catalog entries.
+    """
+    data_dir = Path(app.config['DATA'])
+    entries = []
+    results = []
+    usages = []
+    reserved = set(ALL_FILENAMES) | set(tree_methods())
+    for family_entry in os.scandir(str(data_dir)):
+        if family_entry.name.startswith('.') or not family_entry.is_dir():
+            continue
+        family_path = Path(family_entry.path)
+        entry, family_results, family_usages = scan_catalog_entry(
+            family_path, family_entry.name)
+        entries.append(entry)
+        results += family_results
+        usages += family_usages
+        for sub_entry in os.scandir(family_entry.path):
+            if sub_entry.name in reserved or not sub_entry.is_dir():
+                continue
+            entry, family_results, family_usages = scan_catalog_entry(
+                Path(sub_entry.path), family_entry.name, sub_entry.name)
+            entries.append(entry)
+            results += family_results
+            usages += family_usages
+    catalog.replace_all(data_dir, entries, results, usages)
+    app.logger.info('Catalog rebuilt with %d entries.', len(entries))
+    statuses = {}
+    for status_path in data_dir.glob('*/**/' + STATUS_NAME):
+        code = read_status(status_path)
+        if code is not None:
+            statuses[status_field(status_path)] = code
+    update_status_cache(replace_statuses, statuses)
+    return len(entries)
+
+
+@app.cli.command('rebuild-catalog')
+def rebuild_catalog_command():
+    """Rebuild the family catalog from the data directory."""
+    print('%d families cataloged.' % rebuild_catalog())
+
+
+@app.cli.command('run-workers')
+@click.option('--processes', type=int, default=0,
+              help='Number of workers (default one per core).')
+@click.argument('queues', nargs=-1)
+def run_workers_command(processes, queues):
+    """Run workers that share the cores of this host."""
+    queues = list(queues) or [app.config['ALIGNMENT_QUEUE'],
+                              app.config['TREE_QUEUE']]
+    workers = [multiprocessing.Process(target=run_worker, args=(queues,))
+               for i in range(processes or host_cores())]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run_worker(queues):
+    """Run a PackingWorker until it is stopped.
+
+    :param queues: List of queue names, in order of preference.
+    :return:
+    """
+    PackingWorker(queues, connection=rq.connection).work()
+
+
+def find_fasta_file(directory, data_name):
+    """Return the path of an existing FASTA file of either sequence type.
+
+    :param directory: Path to family or superfamily directory.
+    :param data_name: Stem of file name (sequences or alignment).
+    :return: Path to stored (possibly compressed) FASTA file, or None.
+    """
+    for ext in SEQUENCE_EXTENSIONS.values():
+        fasta_path = find_stored(directory / (data_name + ext))
+        if fasta_path is not None:
+            return fasta_path
+    return None
+
+
+def storage_path(directory, filename):
+    """Return the path to which a result file should be written.
+
+    :param directory: Path to directory.
+    :param filename: Plain (uncompressed) file name.
+    :return: Path with suffix of configured storage codec, if any.
+    """
+    codec = app.config['STORAGE_CODECS'].get(filename)
+    return directory / (filename + codec_extension(codec))
+
+
+def fasta_records_as_response(familyname, data_name, seq_ids):
+    """Return FASTA records looked up by ID through the offset index.
+
+    :param familyname: Family name, or family/superfamily path.
+    :param data_name: Stem of file name (sequences or alignment).
+    :param seq_ids: List of sequence IDs.
+    :return: Response of FASTA records in the order requested.
+    """
+    if not seq_ids:
+        app.logger.error('No sequence IDs requested.')
+        abort(400)
+    fasta_path = find_fasta_file(Path(app.config['DATA']) / familyname,
+                                 data_name)
+    if fasta_path is None:
+        abort(404)
+    records, missing = fetch_fasta_records(fasta_path, seq_ids)
+    if missing:
+        app.logger.warning('%d of %d sequence IDs not found in %s.',
+                           len(missing), len(seq_ids), fasta_path)
+    if not records:
+        abort(404)
+    return Response(b''.join(records), mimetype=FASTA_MIMETYPE)
 
 
 def write_status(path, code):
-    """Write a numeric status to file.
+    """Write a numeric status to file and publish it in Redis.
 
     :param path:
     :param code:
     :return:
     """
-    with path.open(mode='wt') as status_fh:
+    with replace_stored(path, 'wt') as status_fh:
         status_fh.write("%d\n" % code)
+    field = status_field(path)
+    if field is not None:
+        update_status_cache(publish_status, field, code)
 
 
 def run_subprocess_with_status(out_path,
@@ -161,34 +638,509 @@ def run_subprocess_with_status(out_path,
                                cwd,
                                status_path,
                                post_process,
-                               post_args):
+                               post_args,
+                               work_copies=(),
+                               trimming=None,
+                               catalog_entry=None,
+                               cache_spec=None,
+                               tasktype=None,
+                               parallel=None):
     """Run a subprocess, writing a status file.
 
     :param post_process: Function called after processing
     :param post_args: Arguments to post_process
-    :param out_path: Path to which stdout gets sent
+    :param out_path: Path to which stdout gets sent, compressed by suffix
     :param err_path: Path to which stderr gets sent
     :param cmdlist: List of commands to be sent
     :param cwd: Path to working directory
     :param status_path: Path to status log file
+    :param work_copies: Pairs of (stored, working) paths relative to cwd.
+                        Stored files are decompressed to working copies
+                        for the duration of the run.
+    :param trimming: Dictionary describing the trimming of the input
+                     alignment before the run (see trim_tree_input), or
+                     None.
+    :param catalog_entry: (name, method) under which status is cataloged.
+    :param cache_spec: Dictionary describing inputs and outputs for the
+                       result cache (see result_cache_key).
+    :param tasktype: 'alignment' or 'tree', for recording run time.
+    :param parallel: Dictionary of multithreaded tool and threads wanted.
     :return: Return code of subprocess
     """
-    with out_path.open(mode='wb') as out_fh:
+    key = None
+    if cache_spec is not None and app.config['RESULT_CACHE_SIZE']:
+        key = result_cache_key(cmdlist, cwd, cache_spec)
+        if restore_cached_result(key, cache_spec, err_path, status_path,
+                                 catalog_entry):
+            retire_current_job()
+            return 0
+    env = None
+    if parallel is not None:
+        cmdlist, env, threads = threaded_command(
+            cmdlist, parallel['tool'], job_threads(get_current_job()))
+        app.logger.debug('Running %s with %d threads.', parallel['tool'],
+                         threads)
+    start_time = time.monotonic()
+    start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        for stored, working in work_copies:
+            copy_stored(cwd / stored, cwd / working)
         with err_path.open(mode='wt') as err_fh:
-            status = subprocess.run(cmdlist,
-                                    stdout=out_fh,
-                                    stderr=err_fh,
-                                    cwd=str(cwd))
-    write_status(status_path, status.returncode)
+            if trimming is not None and \
+                    not trim_tree_input(cwd, trimming, err_fh):
+                usage = accounting.empty_usage()
+                status = subprocess.CompletedProcess(cmdlist, 1)
+            elif parallel is not None and \
+                    parallel['tool'] in CHUNKED_TOOLS and threads > 1:
+                status = run_in_chunks(cmdlist, cwd, out_path, err_fh,
+                                       threads, env)
+                usage = accounting.children_usage_since(start_usage)
+            elif path_codec(out_path) is None:
+                with replace_stored(out_path) as out_fh:
+                    process = subprocess.Popen(cmdlist,
+                                               stdout=out_fh,
+                                               stderr=err_fh,
+                                               cwd=str(cwd),
+                                               env=env)
+                    usage = wait_with_usage(process)
+                    status = subprocess.CompletedProcess(process.args,
+                                                         process.returncode)
+            else:
+                with replace_stored(out_path) as out_fh:
+                    process = subprocess.Popen(cmdlist,
+                                               stdout=subprocess.PIPE,
+                                               stderr=err_fh,
+                                               cwd=str(cwd),
+                                               env=env)
+                    shutil.copyfileobj(process.stdout, out_fh,
+                                       COPY_CHUNK_SIZE)
+                    process.stdout.close()
+                    usage = wait_with_usage(process)
+                    status = subprocess.CompletedProcess(process.args,
+                                                         process.returncode)
+    finally:
+        for stored, working in work_copies:
+            if (cwd / working).exists():
+                (cwd / working).unlink()
+        if trimming is not None and (cwd / trimming['trimmed']).exists():
+            (cwd / trimming['trimmed']).unlink()
+    wall_time = time.monotonic() - start_time
+    cpu_time = accounting.cpu_time(usage)
+    discard_other_variants(out_path)
+    #
+    # Outputs are put in place before the status is written, and the
+    # post-process may fail the run by setting its return code.
+    #
     if post_process is not None:
-        post_process(out_path,
-                     err_path,
-                     cwd,
-                     status,
-                     *post_args)
+        run_post_process(post_process, out_path, err_path, cwd, status,
+                         post_args)
+    write_status(status_path, status.returncode)
+    tool = catalog_entry[1] if catalog_entry is not None \
+        else command_tool(cmdlist)
+    record_run_usage(status_path, catalog_entry,
+                     accounting.usage_record(tool, tasktype,
+                                             status.returncode, wall_time,
+                                             usage))
+    if catalog_entry is not None:
+        update_catalog(catalog.set_result, *catalog_entry, status.returncode)
+    if key is not None and status.returncode == 0:
+        cache.store(Path(app.config['DATA']) / RESULT_CACHE_NAME,
+                    key,
+                    cache_spec['outputs'],
+                    app.config['RESULT_CACHE_SIZE'])
+    if catalog_entry is not None and tasktype is not None and \
+            status.returncode == 0:
+        alignment_dir = cwd if tasktype == 'alignment' else cwd.parent
+        update_catalog(catalog.add_timing, *catalog_entry, wall_time,
+                       cpu_time, calculation_features(tasktype,
+                                                      alignment_dir))
+    retire_current_job()
     return status.returncode
 
 
+def trim_tree_input(cwd, trimming, err_fh):
+    """Write the trimmed alignment read by a tree run and its column map.
+
+    :param cwd: Path to tree directory.
+    :param trimming: Dictionary of paths relative to cwd of the stored
+                     'alignment', the 'trimmed' alignment to be written,
+                     and the 'columns' map to be written, and the
+                     'max_gap_fraction' and 'min_coverage' thresholds
+                     (see trimming.trim_alignment).
+    :param err_fh: Text file handle of run log.
+    :return: True if trimmed, False if the alignment could not be.
+    """
+    try:
+        column_map = trim_alignment(cwd / trimming['alignment'],
+                                    cwd / trimming['trimmed'],
+                                    trimming['max_gap_fraction'],
+                                    trimming['min_coverage'])
+    except (IOError, ValueError) as exc:
+        err_fh.write('Unable to trim alignment: %s\n' % exc)
+        return False
+    with replace_stored(cwd / trimming['columns'], 'wt') as columns_fh:
+        json.dump(column_map, columns_fh)
+    app.logger.debug('Kept %d of %d columns and %d of %d sequences of %s.',
+                     column_map['kept_columns'], column_map['width'],
+                     column_map['kept_sequences'], column_map['sequences'],
+                     trimming['alignment'])
+    return True
+
+
+def run_post_process(post_process, out_path, err_path, cwd, status,
+                     post_args):
+    """Run the post-process of a run, failing the run if it raises.
+
+    :param post_process: Function called after processing.
+    :param out_path: Path to which stdout was sent.
+    :param err_path: Path to run log, to which errors are appended.
+    :param cwd: Path to working directory.
+    :param status: Status object from subprocess, whose return code is
+                   set to 1 if the outputs cannot be processed.
+    :param post_args: Arguments to post_process.
+    :return:
+    """
+    try:
+        post_process(out_path, err_path, cwd, status, *post_args)
+    except (IOError, ValueError) as exc:
+        with err_path.open(mode='at') as err_fh:
+            err_fh.write('Unable to process output: %s\n' % exc)
+        status.returncode = 1
+
+
+def run_in_chunks(cmdlist, cwd, out_path, err_fh, chunks, env):
+    """Align chunks of the input sequences in parallel and merge them.
+
+    :param cmdlist: hmmalign command line, ending with HMM and sequences.
+    :param cwd: Path to working directory.
+    :param out_path: Path to which merged Stockholm file is written.
+    :param err_fh: Text file handle to which logs of runs are written.
+    :param chunks: Number of chunks, all run at once.
+    :param env: Environment of runs.
+    :return: CompletedProcess with first non-zero return code, if any.
+    """
+    with tempfile.TemporaryDirectory(prefix=CHUNK_DIR_PREFIX,
+                                     dir=str(cwd)) as chunk_dir:
+        chunk_dir = Path(chunk_dir)
+        fasta_paths = [chunk_dir / ('%d.fa' % chunk)
+                       for chunk in range(chunks)]
+        counts = split_fasta(cwd / cmdlist[-1], fasta_paths)
+        chunk_paths = [fasta_path.with_suffix('.sto')
+                       for fasta_path, count in zip(fasta_paths, counts)
+                       if count]
+
+        def align_chunk(chunk_path):
+            with chunk_path.open('wb') as chunk_fh, \
+                    chunk_path.with_suffix('.log').open('wb') as log_fh:
+                return subprocess.run(cmdlist[:-2] +
+                                      ['--outformat', 'Pfam'] +
+                                      cmdlist[-2:-1] +
+                                      [str(chunk_path.with_suffix('.fa'))],
+                                      stdout=chunk_fh,
+                                      stderr=log_fh,
+                                      cwd=str(cwd),
+                                      env=env).returncode
+
+        with ThreadPoolExecutor(max_workers=chunks) as executor:
+            returncodes = list(executor.map(align_chunk, chunk_paths))
+        for chunk_path in chunk_paths:
+            err_fh.write(chunk_path.with_suffix('.log').read_text())
+        returncode = next((code for code in returncodes if code), 0)
+        if returncode == 0:
+            try:
+                with replace_stored(out_path, 'wt') as out_fh:
+                    merge_stockholm(chunk_paths, out_fh)
+            except ValueError as exc:
+                err_fh.write('Unable to merge alignments: %s\n' % exc)
+                returncode = 1
+    return subprocess.CompletedProcess(cmdlist, returncode)
+
+
+def run_fused_pipeline(alignment, tree, parallel=None, placement=None):
+    """Align a family and build its tree in one job.
+
+    If the tree builder reads alignments from stdin, hmmalign writes
+    Pfam format to a pipe, each sequence is converted to FASTA as it is
+    read, and the records are written both to the stored alignment and
+    to the stdin of the tree builder, so that no Stockholm file is
+    written and the alignment is not read back.  Otherwise the two runs
+    are made one after the other.  Either way, the alignment is stored
+    with its status, so that a tree can be built from it later if tree
+    building fails.
+
+    :param alignment: Dictionary of 'args' and 'kwargs' of the alignment
+                      run (see run_subprocess_with_status).
+    :param tree: Dictionary of 'args' and 'kwargs' of the tree run.
+    :param parallel: Dictionary of tool and threads wanted, for workers
+                     that reserve cores.
+    :param placement: Dictionary describing the starting tree of an
+                      incremental tree run (see place_on_family_tree),
+                      or None to build the tree from scratch.
+    :return: Return code of tree builder, or of aligner if it failed.
+    """
+    del parallel
+    if placement is None and tree['kwargs'].get('trimming') is None and \
+            tree['kwargs']['parallel']['tool'] in STDIN_TREEBUILDERS:
+        return stream_alignment_to_tree(alignment, tree,
+                                        job_threads(get_current_job()))
+    returncode = run_subprocess_with_status(*alignment['args'],
+                                            **alignment['kwargs'])
+    if returncode:
+        fail_tree_run(tree, returncode)
+        return returncode
+    if placement is None:
+        return run_subprocess_with_status(*tree['args'], **tree['kwargs'])
+    tree = place_on_family_tree(tree, placement)
+    try:
+        return run_subprocess_with_status(*tree['args'], **tree['kwargs'])
+    finally:
+        if placement['start_tree'].exists():
+            placement['start_tree'].unlink()
+
+
+def place_on_family_tree(tree, placement):
+    """Place added sequences on the family tree to start a tree run.
+
+    :param tree: Dictionary of 'args' and 'kwargs' of tree run.
+    :param placement: Dictionary of paths of the family 'tree', the
+                      'alignment' of the superfamily, and the
+                      'start_tree' to be written, and the tree-builder
+                      'command' that refines the starting tree.
+    :return: Dictionary of 'args' and 'kwargs' of the tree run, which
+             refines the starting tree, uncached, if the sequences were
+             placed.
+    """
+    try:
+        placed = place_sequences(placement['tree'], placement['alignment'],
+                                 placement['start_tree'])
+    except (IOError, ValueError) as exc:
+        app.logger.warning('Unable to place sequences on %s: %s',
+                           placement['tree'], exc)
+        placed = None
+    if placed is None:
+        app.logger.debug('Building tree in %s from scratch.',
+                         tree['args'][3])
+        return tree
+    app.logger.debug('Placed %d sequences on %s.', placed, placement['tree'])
+    args = list(tree['args'])
+    args[2] = placement['command']
+    return {'args': tuple(args),
+            'kwargs': dict(tree['kwargs'], cache_spec=None)}
+
+
+def stream_alignment_to_tree(alignment, tree, threads):
+    """Pipe hmmalign output through FASTA conversion to a tree builder.
+
+    :param alignment: Dictionary of 'args' and 'kwargs' of alignment run.
+    :param tree: Dictionary of 'args' and 'kwargs' of tree run.
+    :param threads: Number of threads reserved for the job, all given
+                    to the tree builder.
+    :return: Return code of tree builder, or of aligner if it failed.
+    """
+    (stockholm_path, alignment_log_path, aligner_command, alignment_dir,
+     alignment_status_path, unused_post_process,
+     (fasta_path, input_stamps)) = alignment['args']
+    (raw_tree_path, tree_log_path, tree_command, tree_dir, tree_status_path,
+     post_process, post_args) = tree['args']
+    tree_kwargs = tree['kwargs']
+    #
+    # hmmalign writes Pfam format to stdout; the tree builder reads FASTA
+    # from stdin when no input file is named.
+    #
+    aligner_command = aligner_command[:-2] + ['--outformat', 'Pfam'] + \
+        aligner_command[-2:]
+    builder_command, env, threads = threaded_command(
+        tree_command[:-1], tree_kwargs['parallel']['tool'], threads)
+    app.logger.debug('Streaming alignment to %s with %d threads.',
+                     tree_kwargs['parallel']['tool'], threads)
+    start_time = time.monotonic()
+    with alignment_log_path.open(mode='wt') as alignment_log_fh, \
+            tree_log_path.open(mode='wt') as tree_log_fh, \
+            raw_tree_path.open(mode='wb') as raw_tree_fh:
+        aligner = subprocess.Popen(aligner_command,
+                                   stdout=subprocess.PIPE,
+                                   stderr=alignment_log_fh,
+                                   cwd=str(alignment_dir))
+        builder = subprocess.Popen(builder_command,
+                                   stdin=subprocess.PIPE,
+                                   stdout=raw_tree_fh,
+                                   stderr=tree_log_fh,
+                                   cwd=str(tree_dir),
+                                   env=env,
+                                   universal_newlines=True)
+        builder_stdin = builder.stdin
+        conversion_error = None
+        try:
+            with replace_stored(fasta_path, 'wt') as fasta_fh:
+                for record in pfam_to_fasta_records(aligner.stdout,
+                                                    stockholm_path.name):
+                    fasta_fh.write(record)
+                    if builder_stdin is not None:
+                        try:
+                            builder_stdin.write(record)
+                        except BrokenPipeError:  # builder failed
+                            builder_stdin = None
+        except ValueError as exc:
+            conversion_error = exc
+            aligner.kill()
+        aligner.stdout.close()
+        try:
+            builder.stdin.close()
+        except BrokenPipeError:
+            pass
+        alignment_usage = wait_with_usage(aligner)
+        aligned_time = time.monotonic()
+        alignment_wall_time = aligned_time - start_time
+        alignment_code = aligner.returncode
+        if conversion_error is not None:
+            alignment_log_fh.write('Unable to convert alignment: %s\n' %
+                                   conversion_error)
+            alignment_code = 1
+        if alignment_code:
+            builder.kill()
+        tree_usage = wait_with_usage(builder)
+    tree_wall_time = time.monotonic() - aligned_time  # after input read
+    tree_code = alignment_code or builder.returncode
+    #
+    # Store the alignment as its own run would have.
+    #
+    for path in stored_variants(plain_path(stockholm_path)):
+        if path.exists():
+            path.unlink()
+    if alignment_code:
+        if fasta_path.exists():
+            fasta_path.unlink()
+    else:
+        finish_alignment(fasta_path, input_stamps)
+    write_status(alignment_status_path, alignment_code)
+    alignment_entry = alignment['kwargs']['catalog_entry']
+    record_run_usage(alignment_status_path, alignment_entry,
+                     accounting.usage_record(alignment_entry[1],
+                                             'alignment', alignment_code,
+                                             alignment_wall_time,
+                                             alignment_usage))
+    update_catalog(catalog.set_result, *alignment_entry, alignment_code)
+    if alignment_code == 0:
+        update_catalog(catalog.add_timing, *alignment_entry,
+                       alignment_wall_time,
+                       accounting.cpu_time(alignment_usage),
+                       calculation_features('alignment', alignment_dir))
+    else:
+        fail_tree_run(tree, alignment_code)
+        retire_current_job()
+        return alignment_code
+    #
+    # And the tree, whose outputs are put in place before its status is
+    # written.
+    #
+    tree_status = subprocess.CompletedProcess(builder_command, tree_code)
+    run_post_process(post_process, raw_tree_path, tree_log_path, tree_dir,
+                     tree_status, post_args)
+    tree_code = tree_status.returncode
+    write_status(tree_status_path, tree_code)
+    record_run_usage(tree_status_path, tree_kwargs['catalog_entry'],
+                     accounting.usage_record(tree_kwargs['catalog_entry'][1],
+                                             'tree', tree_code,
+                                             tree_wall_time, tree_usage))
+    update_catalog(catalog.set_result, *tree_kwargs['catalog_entry'],
+                   tree_code)
+    if tree_code == 0:
+        if app.config['RESULT_CACHE_SIZE']:
+            cache_spec = tree_kwargs['cache_spec']
+            cache.store(Path(app.config['DATA']) / RESULT_CACHE_NAME,
+                        result_cache_key(tree_command, tree_dir, cache_spec),
+                        cache_spec['outputs'],
+                        app.config['RESULT_CACHE_SIZE'])
+        update_catalog(catalog.add_timing, *tree_kwargs['catalog_entry'],
+                       tree_wall_time, accounting.cpu_time(tree_usage),
+                       calculation_features('tree', alignment_dir))
+    retire_current_job()
+    return tree_code
+
+
+def wait_with_usage(process):
+    """Wait for a subprocess to exit and return the resources it used.
+
+    :param process: Popen object.
+    :return: Dictionary of usage fields (see accounting module) of the
+             process and the children it waited for.
+    """
+    try:
+        unused_pid, wait_status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:  # already reaped by Popen.kill()
+        process.wait()
+        return accounting.empty_usage()
+    if os.WIFSIGNALED(wait_status):
+        process.returncode = -os.WTERMSIG(wait_status)
+    else:
+        process.returncode = os.WEXITSTATUS(wait_status)
+    return accounting.rusage_usage(usage)
+
+
+def fail_tree_run(tree, returncode):
+    """Mark a tree run as failed because its alignment failed.
+
+    :param tree: Dictionary of 'args' and 'kwargs' of tree run.
+    :param returncode: Return code of alignment run.
+    :return:
+    """
+    tree_log_path, tree_status_path = tree['args'][1], tree['args'][4]
+    with tree_log_path.open(mode='wt') as log_fh:
+        log_fh.write('Alignment failed with status %d.\n' % returncode)
+    write_status(tree_status_path, returncode)
+    update_catalog(catalog.set_result, *tree['kwargs']['catalog_entry'],
+                   returncode)
+
+
+def result_cache_key(cmdlist, cwd, cache_spec):
+    """Return the result-cache key of a calculation.
+
+    :param cmdlist: Command-line argument list.
+    :param cwd: Working directory of the command.
+    :param cache_spec: Dictionary with keys 'tool' (executable name),
+                       'inputs' (input paths relative to cwd, keyed by
+                       command-line argument), 'outputs' (output paths
+                       keyed by name), and 'extra' (other data on which
+                       the outputs depend).
+    :return: Cache key.
+    """
+    return cache.cache_key(cmdlist,
+                           cache_spec['inputs'],
+                           cwd,
+                           cache_spec['tool'],
+                           extra=cache_spec.get('extra'))
+
+
+def restore_cached_result(key, cache_spec, log_path, status_path,
+                          catalog_entry):
+    """Put cached outputs in place and mark the run as finished.
+
+    :param key: Cache key.
+    :param cache_spec: Cache specification (see result_cache_key).
+    :param log_path: Path to run log.
+    :param status_path: Path to status file.
+    :param catalog_entry: (name, method) under which status is cataloged.
+    :return: True on a cache hit, False otherwise.
+    """
+    restored = cache.restore(Path(app.config['DATA']) / RESULT_CACHE_NAME,
+                             key,
+                             {name: path.parent for name, path in
+                              cache_spec['outputs'].items()})
+    if restored is None:
+        return False
+    for name, path in restored.items():
+        if name == 'alignment':
+            finish_alignment(path)
+        else:
+            discard_other_variants(path)
+    with log_path.open(mode='wt') as log_fh:
+        log_fh.write('Results restored from cache entry %s.\n' % key)
+    write_status(status_path, 0)
+    if catalog_entry is not None:
+        update_catalog(catalog.set_result, *catalog_entry, 0)
+    return True
+
+
 def datetime_to_isoformat(time):
     if time is None:
         return 'None'
@@ -196,24 +1148,25 @@ def datetime_to_isoformat(time):
         return datetime.isoformat(time)
 
 
-def job_data_as_response(job, q):
+def job_data_as_response(job, q, extra=None):
     """Return a JSON dictionary of job parameters.
 
     :param job: Job object.
     :param q: Queue object.
+    :param extra: Dictionary of additional items, if any.
     :return: Response of JSON data.
     """
     job_ids = q.get_job_ids()
-    if job.id in job_ids:
-        queue_position = job_ids.index(job.id)
+    ahead = scheduled_ahead(q.connection, q.name, job.id)
+    if ahead is not None:  # dequeued in schedule order
+        queued = set(job_ids)
+        ahead = [job_id for job_id in ahead if job_id in queued]
+    elif job.id in job_ids:
+        ahead = job_ids[:job_ids.index(job.id)]
     else:
-        queue_position = len(job_ids)
-    queue_time = 0
-    # needs testing before shipping
-    # if queue_position > 1:
-    #    for otherjob in job_ids[:queue_position-1]:
-    #        queue_time += q.fetch_job(otherjob).estimated_time
-
+        ahead = job_ids
+    queue_position = len(ahead)
+    queue_time = estimate_queue_time(q, ahead)
     job_dict = {'id': job.id,
                 'description': job.description,
                 'status': job.get_status(),
@@ -232,31 +1185,191 @@ def job_data_as_response(job, q):
                 'ended_at': datetime_to_isoformat(job.ended_at),
                 'started_at': datetime_to_isoformat(job.started_at),
                 'estimated_job_time': job.estimated_time,
+                # resource usage of finished runs, by tool
+                'usage': job.meta.get('usage'),
                 # queue data
                 'queue_name': q.name,
                 'queue_position': queue_position,
                 'estimated_queue_time': queue_time
                 }
+    if extra is not None:
+        job_dict.update(extra)
     return Response(json.dumps(job_dict), mimetype=JSON_MIMETYPE)
 
 
-def estimate_job_time(task):
-    """Placeholder for alignment calculation time estimate.
+def calculation_features(tasktype, alignment_dir):
+    """Return the features of a calculation on which its run time depends.
+
+    :param tasktype: 'alignment' or 'tree'.
+    :param alignment_dir: Path to family (or superfamily) directory.
+    :return: Dictionary of number of sequences, total length of
+             sequences, and alignment width (HMM length if not aligned).
+    """
+    features = {}
+    try:
+        with (alignment_dir / SEQUENCE_DATA_NAME).open() as sequence_data_fh:
+            sequence_data = json.load(sequence_data_fh)
+        features['sequences'] = sequence_data['sequences']
+        features['total_length'] = sequence_data['total_length']
+    except (IOError, ValueError, KeyError):
+        pass
+    if tasktype == 'tree':
+        for ext in SEQUENCE_EXTENSIONS.values():
+            index_path = fasta_index_path(alignment_dir /
+                                          (ALIGNMENT_NAME + ext))
+            if index_path.exists():
+                with index_path.open() as index_fh:
+                    first_entry = index_fh.readline().split('\t')
+                if len(first_entry) > 1:
+                    features['width'] = int(first_entry[1])
+                break
+    if 'width' not in features:
+        for hmmstats_path in [alignment_dir / HMMSTATS_NAME,
+                              alignment_dir.parent / HMMSTATS_NAME]:
+            if hmmstats_path.exists():
+                try:
+                    with hmmstats_path.open() as hmmstats_fh:
+                        features['width'] = json.load(hmmstats_fh)['M']
+                except (IOError, ValueError, KeyError):
+                    pass
+                break
+    return features
+
+
+def estimate_job_time(tasktype, taskname, family, superfamily=None):
+    """Estimate the run time of a calculation from previous runs.
+
+    :param tasktype: 'alignment', 'tree', or 'pipeline' (both at once).
+    :param taskname: Name of aligner or tree builder, or of calculation
+                     for a pipeline.
+    :param family: Name of family.
+    :param superfamily: Name of superfamily, if any.
+    :return: Tuple of estimated wall time in seconds and whether it is
+             bounded (predicted by fitted cost models only).
+    """
+    if tasktype == 'pipeline':
+        aligner, tree_builder = taskname.split('_')
+        align_time, align_bounded = estimate_job_time('alignment', aligner,
+                                                      family, superfamily)
+        tree_time, tree_bounded = estimate_job_time('tree', tree_builder,
+                                                    family, superfamily)
+        return (round(align_time + tree_time, 1),
+                align_bounded and tree_bounded)
+    alignment_dir = Path(app.config['DATA']) / family
+    if superfamily:
+        alignment_dir = alignment_dir / superfamily
+    return predict_job_time(tasktype, taskname,
+                            calculation_features(tasktype, alignment_dir))
+
+
+def predict_job_time(tasktype, taskname, features):
+    """Predict the run time of a job from the cost model of its tool.
+
+    :param tasktype: 'alignment', 'tree', or 'load'.
+    :param taskname: Name of tool.
+    :param features: Dictionary of features of the job.
+    :return: Tuple of estimated wall time in seconds and whether it is
+             bounded (not the default time of an unfitted model).
+    """
+    model = tool_cost_model(tasktype, taskname)
+    return (round(estimate.predict_time(tasktype, model['coefficients'],
+                                        features), 1),
+            estimate.is_fitted(tasktype, model['coefficients'], features))
+
+
+def tool_cost_model(tasktype, taskname):
+    """Return the cost model of a tool, fitted to its recorded run times.
+
+    :param tasktype: 'alignment', 'tree', or 'load'.
+    :param taskname: Name of aligner or tree builder, or BULK_LOAD_METHOD.
+    :return: Dictionary describing model.
+    """
+    def load_records(tool, limit):
+        try:
+            return catalog.recent_timings(app.config['DATA'], tool, limit)
+        except sqlite3.Error as exc:  # pragma: no cover
+            app.logger.error('Unable to read run times: %s', exc)
+            return []
+    return estimate.cost_model(tasktype, taskname, load_records)
+
+
+def remember_job_estimate(job, connection=None):
+    """Store the estimated time of a queued job for queue-time estimates.
+
+    :param job: Job object, with estimated_time set.
+    :param connection: Redis connection or pipeline (default rq's).
+    :return:
+    """
+    if connection is None:
+        connection = rq.connection
+    estimates_key = ESTIMATES_KEY_PREFIX + job.origin
+    connection.hset(estimates_key, job.id, job.estimated_time)
+    connection.expire(estimates_key, app.config['TREE_QUEUE_TIMEOUT'])
+
+
+def recall_job_estimate(job):
+    """Return the estimated time stored for a queued or running job.
+
+    :param job: Job object.
+    :return: Estimated wall time in seconds, or None if not stored.
+    """
+    job_time = job.connection.hget(ESTIMATES_KEY_PREFIX + job.origin,
+                                   job.id)
+    return None if job_time is None else float(job_time)
+
+
+def retire_current_job():
+    """Remove the estimated time of the current job, if any, and update
+    the schedule.
 
-    :param task:
     :return:
     """
-    if task == 'alignment':
-        return 10
-    elif task == 'tree':
-        return 60
+    job = get_current_job()
+    if job is not None:
+        job.connection.hdel(ESTIMATES_KEY_PREFIX + job.origin, job.id)
+        finish_job(job)
+
+
+def estimate_queue_time(q, job_ids):
+    """Estimate the wait before a job starts.
+
+    The estimated times of the jobs ahead and the remaining times of
+    running jobs are fetched in a single HMGET each and divided among
+    the workers of the queue.
+
+    :param q: Queue object.
+    :param job_ids: IDs of queued jobs ahead of the job.
+    :return: Estimated wait in seconds.
+    """
+    estimates_key = ESTIMATES_KEY_PREFIX + q.name
+    queue_time = 0.
+    if job_ids:
+        queue_time += sum(float(job_time) for job_time in
+                          q.connection.hmget(estimates_key, job_ids)
+                          if job_time is not None)
+    running_ids = q.started_job_registry.get_job_ids()
+    if running_ids:
+        now = datetime.utcnow()
+        running_times = q.connection.hmget(estimates_key, running_ids)
+        for running_job, job_time in zip(
+                q.job_class.fetch_many(running_ids, connection=q.connection),
+                running_times):
+            if running_job is None or job_time is None or \
+                    running_job.started_at is None:
+                continue
+            elapsed = (now - running_job.started_at.replace(tzinfo=None)
+                       ).total_seconds()
+            queue_time += max(float(job_time) - elapsed, 0.)
+    workers = max(Worker.count(connection=q.connection, queue=q), 1)
+    return round(queue_time / workers, 1)
 
 
 def convert_stockholm_to_fasta(out_path,
                                err_path,
                                cwd,
                                status,
-                               fasta):
+                               fasta,
+                               input_stamps=None):
     """Convert a Stockholm-format alignment file to FASTA.
 
     :param cwd:
@@ -264,12 +1377,61 @@ def convert_stockholm_to_fasta(out_path,
     :param out_path: Path to which stdout was sent.
     :param status: Status object from subprocess.
     :param fasta: Path to FASTA file to be created.
+    :param input_stamps: Stamps of the inputs when the alignment was
+                         planned (see alignment_input_stamps).
     :return: Return code of subprocess.
     """
     del err_path, cwd
     if status.returncode == 0:
-        alignment = AlignIO.read(out_path.open(mode='rU'), 'stockholm')
-        AlignIO.write(alignment, fasta.open(mode='w'), 'fasta')
+        with replace_stored(fasta, 'wt') as fasta_fh:
+            stockholm_to_fasta(out_path, fasta_fh, buffer_dir=fasta.parent)
+        finish_alignment(fasta, input_stamps)
+
+
+def append_alignment(out_path,
+                     err_path,
+                     cwd,
+                     status,
+                     fasta,
+                     base_fasta,
+                     seqfile,
+                     input_stamps=None):
+    """Append the alignment of added sequences to an earlier alignment.
+
+    :param out_path: Path to which the Pfam-format alignment of the
+                     added sequences was sent.
+    :param err_path: Path to run log.
+    :param cwd: Path to family (or superfamily) directory.
+    :param status: Status object from subprocess, failed if the
+                   alignments cannot be merged.
+    :param fasta: Path to FASTA file to be created.
+    :param base_fasta: Path to earlier FASTA alignment of the family.
+    :param seqfile: Name of sequence file.
+    :param input_stamps: Stamps of the inputs when the alignment was
+                         planned (see alignment_input_stamps).
+    :return:
+    """
+    if status.returncode == 0:
+        # The family alignment may be the one being replaced, so it is
+        # read until the new one is renamed into place.
+        try:
+            with replace_stored(fasta, 'wt') as fasta_fh:
+                append_to_fasta_alignment(base_fasta, out_path,
+                                          list(load_fasta_index(
+                                              cwd / seqfile)),
+                                          fasta_fh)
+        except (IOError, ValueError) as exc:
+            with err_path.open(mode='at') as err_fh:
+                err_fh.write('Unable to append alignment: %s\n' % exc)
+            status.returncode = 1
+        else:
+            finish_alignment(fasta, input_stamps)
+            for path in stored_variants(cwd / STOCKHOLM_NAME):
+                if path.exists():  # of an earlier full alignment
+                    path.unlink()
+    for path in [out_path, cwd / ADDED_SEQUENCES_NAME]:
+        if path.exists():
+            path.unlink()
 
 
 def cleanup_tree(raw_path,
@@ -294,17 +1456,23 @@ def cleanup_tree(raw_path,
     """
     del err_path, cwd
     if status.returncode == 0:
-        tree = Phylo.read(raw_path.open(mode='rU'), 'newick')
+        with raw_path.open(mode='rt') as raw_fh:
+            tree = ArrayTree.from_newick(raw_fh)
         if make_rooted:
             tree.root_at_midpoint()
         tree.ladderize()
-        tree.root.name = root_name
-        Phylo.write(tree, clean_path.open(mode='w'), 'newick')
-        Phylo.write(tree, xml_path.open(mode='w'), 'phyloxml')
+        tree.name[tree.root] = root_name
+        with replace_stored(clean_path, 'wt') as clean_fh:
+            tree.write_newick(clean_fh)
+        discard_other_variants(clean_path)
+        with replace_stored(xml_path, 'wt') as xml_fh:
+            tree.write_phyloxml(xml_fh)
+        discard_other_variants(xml_path)
 
 
-def set_job_description(tasktype, taskname, job, family, superfamily):
-    """Set the job description.
+def set_job_description(tasktype, taskname, job, family, superfamily,
+                        priority_class='interactive'):
+    """Set the job description and schedule the job.
 
     :param tasktype:
     :param taskname: Type of task (string).
@@ -312,22 +1480,73 @@ def set_job_description(tasktype, taskname, job, family, superfamily):
     :param job: rc job object.
     :param family: Name of family.
     :param superfamily: Name of superfamily.
+    :param priority_class: Scheduling class of job.
     :return:
     """
     job.tasktype = tasktype
     job.taskname = taskname
     job.family = family
     job.superfamily = superfamily
-    job.estimated_time = estimate_job_time(tasktype)
+    job.estimated_time, bounded = estimate_job_time(tasktype, taskname,
+                                                    family, superfamily)
+    job.description = describe_task(tasktype, taskname, family, superfamily)
+    remember_job_estimate(job)
+    schedule_job(job, job.estimated_time, priority_class, bounded=bounded)
+
+
+def describe_task(tasktype, taskname, family, superfamily):
+    """Return a human-readable description of a task.
+
+    :param tasktype: Type of task (string).
+    :param taskname: Name of task (string).
+    :param family: Name of family.
+    :param superfamily: Name of superfamily.
+    :return: Description string.
+    """
     if superfamily is None:
-        job.description = '%s %s of family %s' % (job.taskname,
-                                                  job.tasktype,
-                                                  job.family)
+        return '%s %s of family %s' % (taskname, tasktype, family)
     else:
-        job.description = '%s %s of superfamily %s.%s' % (job.taskname,
-                                                          job.tasktype,
-                                                          job.family,
-                                                          job.superfamily)
+        return '%s %s of superfamily %s.%s' % (taskname,
+                                               tasktype,
+                                               family,
+                                               superfamily)
+
+
+def cached_result_as_response(tasktype, taskname, family, superfamily):
+    """Return a JSON dictionary like that of a job, for a cached result.
+
+    :param tasktype: Type of task (string).
+    :param taskname: Name of task (string).
+    :param family: Name of family.
+    :param superfamily: Name of superfamily.
+    :return: Response of JSON data.
+    """
+    job_dict = {'id': None,
+                'description': describe_task(tasktype, taskname, family,
+                                             superfamily),
+                'status': 'finished',
+                'tasktype': tasktype,
+                'taskname': taskname,
+                'family': family,
+                'superfamily': superfamily,
+                'cached': True,
+                # booleans
+                'is_queued': False,
+                'is_started': False,
+                'is_finished': True,
+                'is_failed': False,
+                # times
+                'created_at': 'None',
+                'enqueued_at': 'None',
+                'ended_at': 'None',
+                'started_at': 'None',
+                'estimated_job_time': 0,
+                # queue data
+                'queue_name': None,
+                'queue_position': 0,
+                'estimated_queue_time': 0
+                }
+    return Response(json.dumps(job_dict), mimetype=JSON_MIMETYPE)
 
 
 def queue_calculation(familyname,
@@ -341,6 +1560,362 @@ def queue_calculation(familyname,
     :option superfamily: Name of superfamily directory.
     :return: JobID
     """
+    lock = lock_family(familyname)
+    try:
+        job = find_inflight_job(familyname, calculation, superfamily)
+        if job is not None:
+            app.logger.debug('Request for %s of %s joins job %s.',
+                             calculation,
+                             catalog_name(familyname, superfamily), job.id)
+            job.family = familyname
+            job.superfamily = superfamily
+            job.description = describe_task(job.tasktype, job.taskname,
+                                            familyname, superfamily)
+            job.estimated_time = recall_job_estimate(job)
+            return job_data_as_response(job, rq.get_queue(job.origin),
+                                        {'coalesced': True})
+        plan = plan_calculation(familyname, calculation, superfamily,
+                                find_inflight_alignment(familyname,
+                                                        calculation,
+                                                        superfamily))
+        if plan['alignment'] is None and plan['tree'] is None:
+            return cached_result_as_response(plan['tasktype'],
+                                             plan['taskname'],
+                                             familyname,
+                                             superfamily)
+        job = enqueue_plan(plan)
+    finally:
+        unlock_family(lock)
+    return job_data_as_response(job, rq.get_queue(job.origin))
+
+
+def enqueue_plan(plan):
+    """Queue the jobs of a planned calculation and register them.
+
+    :param plan: Plan from plan_calculation.
+    :return: Job whose end is that of the calculation.
+    """
+    familyname = plan['family']
+    superfamily = plan['superfamily']
+    align_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
+    tree_queue = rq.get_queue(app.config['TREE_QUEUE'])
+    if plan['fused'] is not None:
+        fused_job = tree_queue.enqueue(run_fused_pipeline,
+                                       **plan['fused']['enqueue'])
+        set_job_description('pipeline', plan['fused']['taskname'],
+                            fused_job, familyname, superfamily)
+        register_inflight_jobs(plan, fused_job)
+        return fused_job
+    align_job = plan['alignment_job']
+    if plan['alignment'] is not None:
+        align_job = align_queue.enqueue(run_subprocess_with_status,
+                                        **plan['alignment']['enqueue'])
+        set_job_description('alignment', plan['alignment']['taskname'],
+                            align_job, familyname, superfamily)
+        if plan['tree'] is None:
+            register_inflight_jobs(plan, align_job)
+            return align_job
+    tree_job = tree_queue.enqueue(run_subprocess_with_status,
+                                  depends_on=align_job,
+                                  **plan['tree']['enqueue'])
+    set_job_description('tree', plan['tree']['taskname'], tree_job,
+                        familyname, superfamily)
+    register_inflight_jobs(plan, tree_job, align_job=align_job)
+    return tree_job
+
+
+def lock_family(familyname):
+    """Lock the queueing of calculations of a family.
+
+    Requests for calculations of the same family wait for each other,
+    so that each finds the jobs queued by the others.
+
+    :param familyname: Name of family.
+    :return: Lock, acquired.
+    """
+    lock = inflight.family_lock(rq.connection, familyname,
+                                QUEUE_LOCK_TIMEOUT)
+    if not lock.acquire():
+        app.logger.error('Timed out waiting to queue calculations of %s.',
+                         familyname)
+        abort(503)
+    return lock
+
+
+def unlock_family(lock):
+    """Release a lock from lock_family.
+
+    :param lock: Lock object.
+    :return:
+    """
+    try:
+        lock.release()
+    except LockNotOwnedError:
+        app.logger.warning('Lock %s expired while calculations were queued.',
+                           lock.name)
+
+
+def find_inflight_job(familyname, calculation, superfamily=None):
+    """Return the queued or running job of a calculation, if any.
+
+    :param familyname: Name of family.
+    :param calculation: Name of calculation.
+    :param superfamily: Name of superfamily, if any.
+    :return: Job object, or None.
+    """
+    return inflight.find_job(rq.connection,
+                             rq.get_queue(app.config['ALIGNMENT_QUEUE']
+                                          ).job_class,
+                             familyname,
+                             inflight.calculation_field(calculation,
+                                                        superfamily))
+
+
+def find_inflight_alignment(familyname, calculation, superfamily=None):
+    """Return the queued or running job of the aligner of a calculation.
+
+    :param familyname: Name of family.
+    :param calculation: Name of calculation.
+    :param superfamily: Name of superfamily, if any.
+    :return: Job object, or None if there is none or the calculation
+             is not combined.
+    """
+    aligner, underscore, unused_builder = calculation.partition('_')
+    if not underscore:
+        return None
+    return find_inflight_job(familyname, aligner, superfamily)
+
+
+def register_inflight_jobs(plan, job, align_job=None, connection=None):
+    """Register the jobs of a plan as those of their calculations.
+
+    The job that ends the plan is registered for the calculation
+    requested, and the alignment and tree jobs (or the job that runs
+    both) for the aligner and the tree builder, so that a request for
+    either stage alone joins them too.
+
+    :param plan: Plan from plan_calculation.
+    :param job: Job whose end is that of the calculation.
+    :param align_job: Alignment job, if apart from job.
+    :param connection: Redis connection or pipeline (default rq's).
+    :return:
+    """
+    if connection is None:
+        connection = rq.connection
+    tasks = OrderedDict()
+    if plan['fused'] is not None:
+        for stage in ['alignment', 'tree']:
+            tasks[plan[stage]['taskname']] = (job.id, 'pipeline',
+                                              plan['fused']['taskname'])
+    else:
+        if plan['alignment'] is not None:
+            tasks[plan['alignment']['taskname']] = (
+                (align_job or job).id, 'alignment',
+                plan['alignment']['taskname'])
+        if plan['tree'] is not None:
+            tasks[plan['tree']['taskname']] = (job.id, 'tree',
+                                               plan['tree']['taskname'])
+    tasks[plan['calculation']] = list(tasks.values())[-1]
+    inflight.register_jobs(connection,
+                           plan['family'],
+                           {inflight.calculation_field(name,
+                                                       plan['superfamily']):
+                            task for name, task in tasks.items()},
+                           app.config['ALIGNMENT_QUEUE_TIMEOUT'] +
+                           app.config['TREE_QUEUE_TIMEOUT'])
+
+
+def forget_inflight_jobs(familyname):
+    """Stop joining requests to the jobs of a family, whose inputs changed.
+
+    :param familyname: Name of family.
+    :return:
+    """
+    try:
+        inflight.forget_jobs(rq.connection, familyname)
+    except RedisError as exc:
+        app.logger.warning('Unable to forget jobs of %s: %s', familyname,
+                           exc)
+
+
+def finish_alignment(fasta, input_stamps=None):
+    """Index a new FASTA alignment and record what it was made from.
+
+    :param fasta: Path to FASTA alignment, which replaces any stored
+                  under another codec.
+    :param input_stamps: Stamps of the inputs of the alignment when it
+                         was planned (see alignment_input_stamps), or
+                         None if they are read now.
+    :return:
+    """
+    discard_other_variants(fasta)
+    build_fasta_index(fasta)
+    try:
+        build_alignment_matrix(fasta)
+    except ValueError as exc:
+        app.logger.warning('Unable to write matrix of %s: %s', fasta, exc)
+    write_alignment_manifest(fasta, input_stamps)
+
+
+def alignment_input_paths(fasta):
+    """Return the HMM and sequence file from which an alignment is made.
+
+    :param fasta: Path to FASTA alignment.
+    :return: List of paths to HMM and sequences.
+    """
+    alignment_dir = fasta.parent
+    hmm_path = alignment_dir / HMM_FILENAME
+    if not hmm_path.exists():  # superfamily
+        hmm_path = alignment_dir.parent / HMM_FILENAME
+    return [hmm_path,
+            alignment_dir / (SEQUENCES_NAME + plain_path(fasta).suffix)]
+
+
+def alignment_input_stamps(fasta):
+    """Return stamps of the inputs of an alignment, which change when
+    the inputs are replaced or written.
+
+    :param fasta: Path to FASTA alignment.
+    :return: Tuple of (inode, size, mtime in ns) of each input, or of
+             None for inputs that do not exist.
+    """
+    stamps = []
+    for path in alignment_input_paths(fasta):
+        try:
+            path_stat = path.stat()
+        except FileNotFoundError:
+            stamps.append(None)
+        else:
+            stamps.append((path_stat.st_ino, path_stat.st_size,
+                           path_stat.st_mtime_ns))
+    return tuple(stamps)
+
+
+def write_alignment_manifest(fasta, input_stamps=None):
+    """Record the sequences and HMM from which an alignment was made.
+
+    Inputs that changed since the alignment was planned may not be what
+    the aligner read, so no manifest is written for them and the next
+    alignment of the family is made from scratch.
+
+    :param fasta: Path to stored FASTA alignment.
+    :param input_stamps: Stamps of the inputs when the alignment was
+                         planned, or None if they are read now.
+    :return:
+    """
+    manifest_path = fasta.parent / ALIGNMENT_MANIFEST_NAME
+    hmm_path, sequences_path = alignment_input_paths(fasta)
+    try:
+        if input_stamps is not None and \
+                alignment_input_stamps(fasta) != input_stamps:
+            raise IOError('inputs changed during alignment')
+        fasta_stat = fasta.stat()
+        manifest = {'hmm': cache.hash_file(hmm_path),
+                    'alignment': [fasta.name, fasta_stat.st_size,
+                                  fasta_stat.st_mtime_ns],
+                    'sequences': record_digests(sequences_path)}
+        if input_stamps is not None and \
+                alignment_input_stamps(fasta) != input_stamps:
+            raise IOError('inputs changed during alignment')
+        with replace_stored(manifest_path, 'wt') as manifest_fh:
+            json.dump(manifest, manifest_fh)
+    except IOError as exc:
+        app.logger.warning('Unable to record inputs of %s: %s', fasta, exc)
+        if manifest_path.exists():
+            manifest_path.unlink()
+
+
+def read_alignment_manifest(alignment_dir):
+    """Return the current alignment of a directory and its manifest.
+
+    :param alignment_dir: Path to family (or superfamily) directory.
+    :return: Tuple of path to alignment and manifest dictionary, or None
+             if there is no finished alignment with a manifest.
+    """
+    try:
+        with (alignment_dir / ALIGNMENT_MANIFEST_NAME).open() as manifest_fh:
+            manifest = json.load(manifest_fh)
+        name, size, mtime_ns = manifest['alignment']
+        fasta_stat = (alignment_dir / name).stat()
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    if (fasta_stat.st_size, fasta_stat.st_mtime_ns) != (size, mtime_ns) or \
+            read_status(alignment_dir / STATUS_NAME) != 0:
+        return None
+    return alignment_dir / name, manifest
+
+
+def write_changed_sequences(alignment_dir, seqfile, hmm_path, base_dirs):
+    """Write the sequences that are new or changed since an alignment.
+
+    Of the alignments of base_dirs to the same HMM, the one that holds
+    the most of the sequences as they are now, in the same order, is
+    used.
+
+    :param alignment_dir: Path to family (or superfamily) directory.
+    :param seqfile: Name of sequence file.
+    :param hmm_path: Path to HMM relative to alignment_dir.
+    :param base_dirs: List of paths to directories of alignments.
+    :return: Path to alignment to which the alignment of the sequences
+             written is to be appended, or None if all sequences are to
+             be aligned.
+    """
+    try:
+        hmm_digest = cache.hash_file(alignment_dir / hmm_path)
+        digests = record_digests(alignment_dir / seqfile)
+    except IOError as exc:
+        app.logger.warning('Unable to read inputs of %s: %s', alignment_dir,
+                           exc)
+        return None
+    base = None
+    for base_dir in base_dirs:
+        found = read_alignment_manifest(base_dir)
+        if found is None or found[1]['hmm'] != hmm_digest:
+            continue
+        aligned = found[1]['sequences']
+        positions = dict((seq_id, position)
+                         for position, seq_id in enumerate(aligned))
+        kept = [positions[seq_id] for seq_id, digest in digests.items()
+                if aligned.get(seq_id) == digest]
+        if kept != sorted(kept):
+            continue
+        changed = [seq_id for seq_id, digest in digests.items()
+                   if aligned.get(seq_id) != digest]
+        if base is None or len(changed) < len(base[1]):
+            base = (found[0], changed)
+    if base is None or not base[1]:
+        return None
+    records, unused_missing = fetch_fasta_records(alignment_dir / seqfile,
+                                                  base[1])
+    with (alignment_dir / ADDED_SEQUENCES_NAME).open(mode='wb') as added_fh:
+        added_fh.writelines(records)
+    return base[0]
+
+
+def plan_calculation(familyname,
+                     calculation,
+                     superfamily=None,
+                     alignment_job=None):
+    """Prepare alignment or tree-building jobs or both for queueing.
+
+    Results found in the result cache are restored instead of being
+    planned.  Status files of planned jobs are initialized.
+
+    :param familyname: Name of previously-created family.
+    :param calculation: Name of calculation to be done.
+    :param superfamily: Name of superfamily directory.
+    :param alignment_job: Queued or running job that makes the alignment
+                          of a combined calculation (see
+                          find_inflight_alignment), for the tree job to
+                          wait on instead of an alignment job.
+    :return: Dictionary with the tasktype and taskname of the calculation
+             requested, its family, superfamily, and calculation
+             names, the 'alignment_job' waited on, and the 'alignment'
+             and 'tree' jobs to be queued (None if not needed), each a
+             dictionary of taskname and arguments to enqueue, and the
+             'fused' job to be queued instead of both (None if they are
+             to be queued apart).
+    """
     #
     # Assignments to make PEP8 happy
     #
@@ -362,6 +1937,10 @@ def queue_calculation(familyname,
     tree_path = None
     phyloxml_path = None
     alignment_output_path = None
+    tree_work_copies = ()
+    tree_tool = None
+    trimmed = False
+    trimming = None
     #
     # Get calculation type(s).
     #
@@ -373,8 +1952,7 @@ def queue_calculation(familyname,
             app.logger.error('Unrecognized aligner %s.',
                              calculation_components[0])
             abort(404)
-        if calculation_components[1] in list(
-                app.config['TREEBUILDERS'].keys()):
+        if calculation_components[1] in tree_methods():
             tree_builder = calculation_components[1]
         else:
             app.logger.error('Unrecognized tree builder %s.',
@@ -383,12 +1961,14 @@ def queue_calculation(familyname,
     elif calculation in list(app.config['ALIGNERS'].keys()):
         alignment_tool = calculation
         tree_builder = None
-    elif calculation in list(app.config['TREEBUILDERS'].keys()):
+    elif calculation in tree_methods():
         alignment_tool = None
         tree_builder = calculation
     else:
         app.logger.error('Unrecognized calculation type %s.', calculation)
         abort(404)
+    if tree_builder is not None:
+        tree_tool, trimmed = split_tree_method(tree_builder)
     #
     # Get paths to things we might need for either calculation.
     #
@@ -411,20 +1991,19 @@ def queue_calculation(familyname,
                          alignment_dir)
         abort(428)
     if alignment_tool is not None:  # will do an alignment.
-        stockholm_path = alignment_dir / STOCKHOLM_NAME
+        stockholm_path = storage_path(alignment_dir, STOCKHOLM_NAME)
         alignment_status_path = alignment_dir / STATUS_NAME
         alignment_log_path = alignment_dir / RUN_LOG_NAME
         for key in SEQUENCE_EXTENSIONS.keys():
             if (alignment_dir / (
                     SEQUENCES_NAME + SEQUENCE_EXTENSIONS[key])).exists():
                 seqfile = SEQUENCES_NAME + SEQUENCE_EXTENSIONS[key]
-                alignment_output_path = alignment_dir / (
-                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS[key])
+                alignment_output_path = storage_path(
+                    alignment_dir, ALIGNMENT_NAME + SEQUENCE_EXTENSIONS[key])
                 hmm_seq_type = HMM_SWITCHES[key]
 
                 # These are only used if building a tree.
-                alignment_input_path = Path('..') / (
-                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS[key])
+                alignment_input_path = Path('..') / alignment_output_path.name
                 seq_type = key
                 break
         else:
@@ -434,23 +2013,35 @@ def queue_calculation(familyname,
         tree_dir = alignment_dir / tree_builder
         treebuilder_status_path = tree_dir / STATUS_NAME
         raw_tree_path = tree_dir / RAW_TREE_NAME
-        tree_path = tree_dir / TREE_NAME
-        phyloxml_path = tree_dir / PHYLOXML_NAME
+        tree_path = storage_path(tree_dir, TREE_NAME)
+        phyloxml_path = storage_path(tree_dir, PHYLOXML_NAME)
         tree_log_path = tree_dir / RUN_LOG_NAME
         if not tree_dir.exists():
             tree_dir.mkdir()
         if alignment_tool is None:  # build tree with alignment already done
             for key in SEQUENCE_EXTENSIONS.keys():
-                if (alignment_dir / (
-                    ALIGNMENT_NAME +
-                        SEQUENCE_EXTENSIONS[key])).exists():
-                    alignment_input_path = Path('..') / (
-                        ALIGNMENT_NAME + SEQUENCE_EXTENSIONS[key])
+                stored_alignment = find_stored(alignment_dir / (
+                    ALIGNMENT_NAME + SEQUENCE_EXTENSIONS[key]))
+                if stored_alignment is not None:
+                    alignment_input_path = Path('..') / stored_alignment.name
                     seq_type = key
                     break
             else: # pragma: no cover
                 app.logger.error('Unable to find aligned sequences.')
                 abort(404)
+        if trimmed:
+            # Tree builders read the trimmed alignment, written by the
+            # run in the tree directory.
+            trimming = dict(app.config['ALIGNMENT_TRIMMING'],
+                            alignment=alignment_input_path,
+                            trimmed=Path(TRIMMED_ALIGNMENT_NAME),
+                            columns=Path(TRIMMED_COLUMNS_NAME))
+            alignment_input_path = trimming['trimmed']
+        elif path_codec(alignment_input_path) is not None:
+            # Tree builders can't read compressed input.
+            tree_work_copies = ((alignment_input_path,
+                                 plain_path(Path(alignment_input_path.name))),)
+            alignment_input_path = tree_work_copies[0][1]
     #
     # Marshal command-line arguments.
     #
@@ -458,95 +2049,258 @@ def queue_calculation(familyname,
         aligner_command = ['time', 'nice', app.config['HMMALIGN_EXE']] + \
             app.config['ALIGNERS'][alignment_tool] + \
             ['--' + hmm_seq_type, str(hmm_path), str(seqfile)]
-    if tree_builder == 'FastTree':
+    if tree_tool == 'FastTree':
         tree_command = ['time', 'nice', app.config['FASTTREE_EXE']] \
-            + app.config['TREEBUILDERS'][tree_builder][seq_type] \
+            + app.config['TREEBUILDERS'][tree_tool][seq_type] \
             + [str(alignment_input_path)]
-    elif tree_builder == 'RAxML': # pragma: no cover
+    elif tree_tool == 'RAxML': # pragma: no cover
         tree_command = ['time', 'nice', app.config['RAXML_EXE']] \
-            + app.config['TREEBUILDERS'][tree_builder][seq_type] \
+            + app.config['TREEBUILDERS'][tree_tool][seq_type] \
             + ['-n',
                'production',
-               '-T',
-               '%d' % int(os.environ.get('OMP_NUM_THREADS', 1)),
                '-s', str(alignment_input_path)]
     #
+    # The alignment of a combined calculation may already be under way,
+    # in which case its status is left alone and the tree is not looked
+    # up in the cache, since the alignment it is made from is not done.
+    #
+    if alignment_job is not None:
+        alignment_tool = None
+    #
+    # Describe inputs and outputs for the result cache.
+    #
+    name = catalog_name(familyname, superfamily)
+    alignment_cache_spec = None
+    tree_cache_spec = None
+    if alignment_tool is not None:
+        alignment_cache_spec = {'tool': aligner_command[2],
+                                'inputs': {str(hmm_path): hmm_path,
+                                           seqfile: seqfile},
+                                'outputs': {'stockholm': stockholm_path,
+                                            'alignment':
+                                                alignment_output_path}}
+    if tree_builder is not None:
+        if tree_work_copies:
+            stored_input_path = tree_work_copies[0][0]
+        elif trimming is not None:
+            stored_input_path = trimming['alignment']
+        else:
+            stored_input_path = alignment_input_path
+        tree_cache_spec = {'tool': tree_command[2],
+                           'inputs': {str(alignment_input_path):
+                                      stored_input_path},
+                           'outputs': {'raw': raw_tree_path,
+                                       'tree': tree_path,
+                                       'phyloxml': phyloxml_path},
+                           'extra': familyname}  # name of root node
+        if trimming is not None:
+            tree_cache_spec['outputs']['columns'] = \
+                tree_dir / TRIMMED_COLUMNS_NAME
+            tree_cache_spec['extra'] = [familyname,
+                                        trimming['max_gap_fraction'],
+                                        trimming['min_coverage']]
+    #
+    # Check the result cache for results of the same calculation.
+    #
+    if tree_builder is not None:
+        plan = {'tasktype': 'tree', 'taskname': tree_builder}
+    else:
+        plan = {'tasktype': 'alignment', 'taskname': alignment_tool}
+    plan.update(family=familyname, superfamily=superfamily,
+                calculation=calculation, alignment_job=alignment_job)
+    if app.config['RESULT_CACHE_SIZE'] and alignment_job is None:
+        if alignment_tool is not None and restore_cached_result(
+                result_cache_key(aligner_command,
+                                 alignment_dir,
+                                 alignment_cache_spec),
+                alignment_cache_spec,
+                alignment_log_path,
+                alignment_status_path,
+                (name, alignment_tool)):
+            app.logger.debug('Alignment of %s restored from cache.', name)
+            alignment_tool = None
+        if alignment_tool is None and tree_builder is not None and \
+                restore_cached_result(result_cache_key(tree_command,
+                                                       tree_dir,
+                                                       tree_cache_spec),
+                                      tree_cache_spec,
+                                      tree_log_path,
+                                      treebuilder_status_path,
+                                      (name, tree_builder)):
+            app.logger.debug('Tree of %s restored from cache.', name)
+            tree_builder = None
+    #
+    # Families (and superfamilies of families) with a current alignment
+    # are aligned incrementally: only new or changed sequences are
+    # aligned, in one thread, and appended to that alignment.  Their
+    # trees start from the tree of that alignment with the sequences
+    # placed on it, except trees of trimmed alignments, whose columns
+    # change with the sequences.
+    #
+    alignment_out_path = stockholm_path
+    alignment_post_process = convert_stockholm_to_fasta
+    input_stamps = None
+    if alignment_tool is not None:
+        input_stamps = alignment_input_stamps(alignment_output_path)
+    alignment_post_args = (alignment_output_path, input_stamps)
+    alignment_parallel = None
+    if alignment_tool is not None:
+        alignment_parallel = {
+            'tool': alignment_tool,
+            'threads': threads_wanted(alignment_tool,
+                                      calculation_features('alignment',
+                                                           alignment_dir))}
+    base_alignment = None
+    placement = None
+    if alignment_tool == 'hmmalign' and \
+            app.config['INCREMENTAL_ALIGNMENTS']:
+        base_alignment = write_changed_sequences(
+            alignment_dir, seqfile, hmm_path,
+            [alignment_dir] + ([alignment_dir.parent] if superfamily
+                               else []))
+    if base_alignment is not None:
+        app.logger.debug('Aligning sequences of %s not in %s.', name,
+                         base_alignment)
+        aligner_command = aligner_command[:-2] + ['--outformat', 'Pfam'] + \
+            aligner_command[-2:-1] + [ADDED_SEQUENCES_NAME]
+        alignment_out_path = alignment_dir / ADDED_ALIGNMENT_NAME
+        alignment_post_process = append_alignment
+        alignment_post_args = (alignment_output_path, base_alignment,
+                               seqfile, input_stamps)
+        alignment_cache_spec = None
+        alignment_parallel = None
+    if base_alignment is not None and \
+            tree_builder in app.config['INCREMENTAL_TREE_ARGS']:
+        base_tree_path = base_alignment.parent / tree_builder / \
+            RAW_TREE_NAME
+        if read_status(base_tree_path.parent / STATUS_NAME) == 0 and \
+                base_tree_path.exists() and \
+                base_tree_path.stat().st_mtime >= \
+                base_alignment.stat().st_mtime:
+            placement = {'tree': base_tree_path,
+                         'alignment': alignment_output_path,
+                         'start_tree': tree_dir / START_TREE_NAME,
+                         'command': tree_command[:3] +
+                         app.config['INCREMENTAL_TREE_ARGS'][tree_builder] +
+                         [START_TREE_SWITCHES[tree_builder],
+                          START_TREE_NAME] + tree_command[3:]}
+    #
     # Log command line and initialize status files.
     #
+    plan['alignment'] = None
+    plan['tree'] = None
     if alignment_tool is not None:
         app.logger.debug('Alignment command line is %s.', aligner_command)
         write_status(alignment_status_path, -1)
+        update_catalog(catalog.set_result, name, alignment_tool, -1)
+        plan['alignment'] = {
+            'taskname': alignment_tool,
+            'enqueue': {'args': (alignment_out_path,
+                                 alignment_log_path,
+                                 aligner_command,
+                                 alignment_dir,
+                                 alignment_status_path,
+                                 alignment_post_process,
+                                 alignment_post_args),
+                        'kwargs': {'catalog_entry': (name, alignment_tool),
+                                   'cache_spec': alignment_cache_spec,
+                                   'tasktype': 'alignment',
+                                   'parallel': alignment_parallel},
+                        'timeout': app.config['ALIGNMENT_QUEUE_TIMEOUT']}}
     if tree_builder is not None:
         app.logger.debug('Tree builder command line is %s.', tree_command)
         write_status(treebuilder_status_path, -1)
+        update_catalog(catalog.set_result, name, tree_builder, -1)
+        plan['tree'] = {
+            'taskname': tree_builder,
+            'enqueue': {'args': (raw_tree_path,
+                                 tree_log_path,
+                                 tree_command,
+                                 tree_dir,
+                                 treebuilder_status_path,
+                                 cleanup_tree,
+                                 (tree_path, True, familyname,
+                                  phyloxml_path)),
+                        'kwargs': {'work_copies': tree_work_copies,
+                                   'trimming': trimming,
+                                   'catalog_entry': (name, tree_builder),
+                                   'cache_spec': tree_cache_spec,
+                                   'tasktype': 'tree',
+                                   'parallel': {
+                                       'tool': tree_tool,
+                                       'threads': threads_wanted(
+                                           tree_tool,
+                                           calculation_features(
+                                               'tree', alignment_dir))}},
+                        'timeout': app.config['TREE_QUEUE_TIMEOUT']}}
     #
-    # Queue processes.
+    # Small families are aligned and their trees built in one job, as
+    # are incremental calculations, whose starting trees need the
+    # alignment.
     #
-    align_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
-    tree_queue = rq.get_queue(app.config['TREE_QUEUE'])
-    if alignment_tool is not None and tree_builder is not None:
-        align_job = align_queue.enqueue(run_subprocess_with_status,
-                                        args=(stockholm_path,
-                                              alignment_log_path,
-                                              aligner_command,
-                                              alignment_dir,
-                                              alignment_status_path,
-                                              convert_stockholm_to_fasta,
-                                              (alignment_output_path,),
-                                              ),
-                                        timeout=app.config[
-                                            'ALIGNMENT_QUEUE_TIMEOUT']
-                                        )
-        set_job_description('alignment', alignment_tool, align_job, familyname,
-                            superfamily)
-        tree_job = tree_queue.enqueue(run_subprocess_with_status,
-                                      args=(raw_tree_path,
-                                            tree_log_path,
-                                            tree_command,
-                                            tree_dir,
-                                            treebuilder_status_path,
-                                            cleanup_tree,
-                                            (tree_path, True, familyname,
-                                             phyloxml_path)),
-                                      timeout=app.config['TREE_QUEUE_TIMEOUT'],
-                                      depends_on=align_job
-                                      )
-        set_job_description('tree', tree_builder, tree_job, familyname,
-                            superfamily)
-        return job_data_as_response(tree_job, tree_queue)
-    elif alignment_tool is not None:
-        align_job = align_queue.enqueue(run_subprocess_with_status,
-                                        args=(stockholm_path,
-                                              alignment_log_path,
-                                              aligner_command,
-                                              alignment_dir,
-                                              alignment_status_path,
-                                              convert_stockholm_to_fasta,
-                                              (alignment_output_path,)
-                                              ),
-                                        timeout=app.config[
-                                            'ALIGNMENT_QUEUE_TIMEOUT']
-                                        )
-        set_job_description('alignment', alignment_tool, align_job, familyname,
-                            superfamily)
-        return job_data_as_response(align_job, align_queue)
-    elif tree_builder is not None:
-        tree_job = tree_queue.enqueue(run_subprocess_with_status,
-                                      args=(raw_tree_path,
-                                            tree_log_path,
-                                            tree_command,
-                                            tree_dir,
-                                            treebuilder_status_path,
-                                            cleanup_tree,
-                                            (tree_path, True, familyname,
-                                             phyloxml_path)),
-                                      timeout=app.config['TREE_QUEUE_TIMEOUT']
-                                      )
-        set_job_description('tree', tree_builder, tree_job, familyname,
-                            superfamily)
-        return job_data_as_response(tree_job, tree_queue)
-    else:
-        abort(404)
+    plan['fused'] = None
+    features = calculation_features('alignment', alignment_dir)
+    cells = features.get('sequences', 0) * features.get('width', 0)
+    if plan['alignment'] is not None and plan['tree'] is not None and \
+            (placement is not None or
+             (base_alignment is None and
+              0 < cells <= app.config['FUSED_PIPELINE_MAX_CELLS'])):
+        stages = [dict(args=plan[stage]['enqueue']['args'],
+                       kwargs=plan[stage]['enqueue']['kwargs'])
+                  for stage in ['alignment', 'tree']]
+        plan['fused'] = {
+            'taskname': calculation,
+            'enqueue': {'args': tuple(stages),
+                        'kwargs': {'parallel': {
+                            'tool': tree_tool,
+                            'threads': max(stage['kwargs']['parallel']
+                                           ['threads'] for stage in stages
+                                           if stage['kwargs']['parallel'])},
+                                   'placement': placement},
+                        'timeout': app.config['ALIGNMENT_QUEUE_TIMEOUT'] +
+                        app.config['TREE_QUEUE_TIMEOUT']}}
+    return plan
+
+
+@app.before_request
+def start_request_timer():
+    """Note the time a request started, for the request metrics."""
+    g.request_start_time = time.monotonic()
+
+
+@app.after_request
+def record_request_time(response):
+    """Add the time taken by a request to the request metrics.
+
+    Requests are labeled by endpoint, so that calculations are told
+    apart by the names of their bound functions.
+
+    :param response: Response object.
+    :return: Response object.
+    """
+    start_time = g.get('request_start_time')
+    if start_time is not None:
+        record_metric(REQUEST_DURATION, time.monotonic() - start_time,
+                      endpoint=request.endpoint or 'none',
+                      method=request.method,
+                      code=response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Return metrics in the Prometheus text format.
+
+    :return: Response of metrics text.
+    """
+    try:
+        metrics = render_metrics(rq.connection,
+                                 [rq.get_queue(app.config['ALIGNMENT_QUEUE']),
+                                  rq.get_queue(app.config['TREE_QUEUE'])])
+    except RedisError as exc:
+        app.logger.error('Unable to read metrics: %s', exc)
+        abort(503)
+    return Response(metrics, mimetype=METRICS_MIMETYPE)
 
 
 @app.route('/trees/' + FAMILIES_NAME)
@@ -555,8 +2309,105 @@ def return_families():
 
     :return: JSON list
     """
-    directory_list = sorted(os.listdir(path=app.config['DATA']))
-    return Response(json.dumps(directory_list), mimetype=JSON_MIMETYPE)
+    entries = query_catalog()[1]
+    return Response(json.dumps([entry['name'] for entry in entries]),
+                    mimetype=JSON_MIMETYPE)
+
+
+@app.route('/trees/' + CATALOG_JSON_NAME)
+def return_catalog():
+    """Return a page of family metadata from the catalog.
+
+    :return: JSON dictionary with total count and list of entries.
+    """
+    total, entries = query_catalog(default_limit=CATALOG_PAGE_SIZE)
+    return Response(json.dumps({'total': total,
+                                'families': entries}),
+                    mimetype=JSON_MIMETYPE)
+
+
+@app.route('/trees/' + ESTIMATES_JSON_NAME)
+def return_estimates():
+    """Return the run-time models of aligners, tree builders, and bulk
+    loads of families.
+
+    :return: JSON dictionary of models by tool.
+    """
+    models = OrderedDict()
+    for tasktype, tools in [('alignment', app.config['ALIGNERS']),
+                            ('tree', tree_methods()),
+                            ('load', [BULK_LOAD_METHOD])]:
+        for tool in tools:
+            models[tool] = dict(tool_cost_model(tasktype, tool),
+                                default_time=estimate.DEFAULT_TIMES[tasktype])
+    return Response(json.dumps(models), mimetype=JSON_MIMETYPE)
+
+
+@app.route('/trees/' + USAGE_JSON_NAME)
+def return_usage_totals():
+    """Return the resource usage of the latest runs, summed by family or
+    by tool, largest first.
+
+    :return: JSON list of dictionaries of group name and totals.
+    """
+    if not catalog.catalog_path(app.config['DATA']).exists():
+        rebuild_catalog()
+    args = request.args
+    tool = args.get('tool')
+    if tool is not None and tool not in app.config['ALIGNERS'] and \
+            tool not in tree_methods():
+        app.logger.error('Unrecognized tool "%s".', tool)
+        abort(428)
+    try:
+        limit = int(args.get('limit', CATALOG_PAGE_SIZE))
+        totals = catalog.usage_totals(app.config['DATA'],
+                                      args.get('by', 'family'),
+                                      sort=args.get('sort', 'cpu_time'),
+                                      method=tool,
+                                      limit=limit)
+    except ValueError as exc:
+        app.logger.error('Bad usage query: %s', exc)
+        abort(400)
+    if limit < 0 or limit > CATALOG_PAGE_LIMIT:
+        app.logger.error('Usage page out of range.')
+        abort(400)
+    return Response(json.dumps(totals), mimetype=JSON_MIMETYPE)
+
+
+def query_catalog(default_limit=None):
+    """Query the catalog with filters and paging from request arguments.
+
+    :param default_limit: Page size if no limit argument is given.
+    :return: Tuple of total matches and list of entry dicts.
+    """
+    if not catalog.catalog_path(app.config['DATA']).exists():
+        rebuild_catalog()
+    args = request.args
+    try:
+        limit = int(args.get('limit', default_limit or 0)) or None
+        offset = int(args.get('offset', 0))
+        min_sequences = args.get('min_sequences')
+        max_sequences = args.get('max_sequences')
+        query_args = {
+            'prefix': args.get('prefix'),
+            'superfamilies': args.get('superfamilies', 'false') == 'true',
+            'min_sequences': None if min_sequences is None
+            else int(min_sequences),
+            'max_sequences': None if max_sequences is None
+            else int(max_sequences),
+            'has_hmm': None if 'has_hmm' not in args
+            else args['has_hmm'] == 'true',
+            'finished': args.get('finished'),
+            'offset': offset,
+            'limit': limit}
+    except ValueError:
+        app.logger.error('Non-integer catalog query argument.')
+        abort(400)
+    if offset < 0 or (limit is not None and
+                      (limit < 0 or limit > CATALOG_PAGE_LIMIT)):
+        app.logger.error('Catalog page out of range.')
+        abort(400)
+    return catalog.query(app.config['DATA'], **query_args)
 
 
 @app.route('/trees/<family>/alignment', methods=['POST', 'GET'])
@@ -570,15 +2421,16 @@ def post_or_get_alignment(family):
     if request.method == 'POST':
         return create_fasta(family, ALIGNMENT_NAME)
     elif request.method == 'GET':
-        alignment_path = Path(
-            app.config['DATA']) / family / ALIGNMENT_NAME
-        for ext in SEQUENCE_EXTENSIONS.keys():
-            test_path = alignment_path.with_suffix(SEQUENCE_EXTENSIONS[ext])
-            if test_path.exists():
-                break
-        else:
+        if 'start' in request.args or 'end' in request.args:
+            return alignment_window_as_response(family)
+        if 'id' in request.args:
+            return fasta_records_as_response(family, ALIGNMENT_NAME,
+                                             request.args.getlist('id'))
+        test_path = find_fasta_file(Path(app.config['DATA']) / family,
+                                    ALIGNMENT_NAME)
+        if test_path is None:
             abort(404)
-        return Response(test_path.open().read(), mimetype=FASTA_MIMETYPE)
+        return send_data_file(plain_path(test_path), FASTA_MIMETYPE)
 
 
 @app.route('/trees/<family>.<superfamily>/alignment', methods=['POST', 'GET'])
@@ -593,15 +2445,106 @@ def post_or_get_alignment_superfamily(family, superfamily):
     if request.method == 'POST':
         return create_fasta(family, ALIGNMENT_NAME, superfamily=superfamily)
     elif request.method == 'GET':
-        alignment_path = Path(
-            app.config['DATA']) / family / superfamily / ALIGNMENT_NAME
-        for ext in SEQUENCE_EXTENSIONS.keys():
-            test_path = alignment_path.with_suffix(SEQUENCE_EXTENSIONS[ext])
-            if test_path.exists():
-                break
-        else:
+        if 'start' in request.args or 'end' in request.args:
+            return alignment_window_as_response(family + '/' + superfamily)
+        if 'id' in request.args:
+            return fasta_records_as_response(family + '/' + superfamily,
+                                             ALIGNMENT_NAME,
+                                             request.args.getlist('id'))
+        test_path = find_fasta_file(
+            Path(app.config['DATA']) / family / superfamily, ALIGNMENT_NAME)
+        if test_path is None:
+            abort(404)
+        return send_data_file(plain_path(test_path), FASTA_MIMETYPE)
+
+
+@app.route('/trees/<family>/' + ALIGNMENT_STATS_NAME)
+def get_alignment_stats(family):
+    """GET the occupancy and consensus of columns of an alignment.
+
+    Columns and rows are selected as for alignment windows (see
+    alignment_window).
+
+    :param family: Family name, or family/superfamily path.
+    :return: Response of JSON data, with the fraction of rows with a
+             residue ("occupancy") and a gap ("gap_fraction") and the
+             consensus residue of each column.
+    """
+    matrix, names, rows, start, stop = alignment_window(family)
+    occupancy, consensus = column_stats(matrix, start, stop, rows)
+    stats = {'sequences': len(names) if rows is None else len(rows),
+             'width': matrix.shape[1],
+             'start': start + 1,
+             'end': stop,
+             'occupancy': [round(fraction, STATS_DECIMALS)
+                           for fraction in occupancy.tolist()],
+             'gap_fraction': [round(1. - fraction, STATS_DECIMALS)
+                              for fraction in occupancy.tolist()],
+             'consensus': consensus}
+    return Response(json.dumps(stats), mimetype=JSON_MIMETYPE)
+
+
+@app.route('/trees/<family>.<sup>/' + ALIGNMENT_STATS_NAME)
+def get_alignment_stats_super(family, sup):
+    return get_alignment_stats(family + '/' + sup)
+
+
+def alignment_window(familyname):
+    """Return the matrix of an alignment and the window requested of it.
+
+    Columns are given by the "start" and "end" query arguments (1-based
+    and inclusive, by default the first and last) and rows by "id"
+    arguments (by default all, in alignment order).
+
+    :param familyname: Family name, or family/superfamily path.
+    :return: Tuple of alignment matrix, list of sequence IDs of its rows,
+             list of row numbers requested (None for all), and first
+             (0-based) and after-last column.
+    """
+    fasta_path = find_fasta_file(Path(app.config['DATA']) / familyname,
+                                 ALIGNMENT_NAME)
+    if fasta_path is None:
+        abort(404)
+    try:
+        matrix = load_alignment_matrix(fasta_path)
+    except ValueError as exc:
+        app.logger.error('Unable to read matrix of %s: %s', fasta_path, exc)
+        abort(400)
+    names = list(load_fasta_index(fasta_path))
+    try:
+        start = int(request.args.get('start', 1))
+        end = min(int(request.args.get('end', matrix.shape[1])),
+                  matrix.shape[1])
+    except ValueError:
+        app.logger.error('Non-integer alignment column.')
+        abort(400)
+    if start < 1 or end < start:
+        app.logger.error('Alignment columns %d-%d out of range.', start, end)
+        abort(400)
+    rows = None
+    if 'id' in request.args:
+        seq_ids = request.args.getlist('id')
+        rows, missing = row_numbers(fasta_path, seq_ids)
+        if missing:
+            app.logger.warning('%d of %d sequence IDs not found in %s.',
+                               len(missing), len(seq_ids), fasta_path)
+        if not rows:
             abort(404)
-        return Response(test_path.open().read(), mimetype=FASTA_MIMETYPE)
+    return matrix, names, rows, start - 1, end
+
+
+def alignment_window_as_response(familyname):
+    """Return aligned FASTA of a window of columns and rows.
+
+    Records are read from the alignment matrix and titled by sequence
+    ID only.
+
+    :param familyname: Family name, or family/superfamily path.
+    :return: Response streaming FASTA records.
+    """
+    matrix, names, rows, start, stop = alignment_window(familyname)
+    return Response(window_records(matrix, names, rows, start, stop),
+                    mimetype=FASTA_MIMETYPE)
 
 
 @app.route('/trees/<family>/sequences', methods=['POST'])
@@ -614,6 +2557,54 @@ def post_sequences(family):
     return create_fasta(family, SEQUENCES_NAME)
 
 
+@app.route('/trees/<family>/sequences', methods=['GET'])
+def get_sequences(family):
+    """GET the sequences whose IDs are given as "id" query arguments.
+
+    :param family: Existing family name.
+    :return: FASTA of requested sequences.
+    """
+    return fasta_records_as_response(family, SEQUENCES_NAME,
+                                     request.args.getlist('id'))
+
+
+@app.route('/trees/<family>.<sup>/sequences', methods=['GET'])
+def get_sequences_super(family, sup):
+    return get_sequences(family + '/' + sup)
+
+
+@app.route('/trees/<family>/sequences/<path:seq_id>')
+def get_sequence(family, seq_id):
+    """GET a single sequence by ID.
+
+    :param family: Existing family name.
+    :param seq_id: Sequence ID.
+    :return: FASTA of sequence.
+    """
+    return fasta_records_as_response(family, SEQUENCES_NAME, [seq_id])
+
+
+@app.route('/trees/<family>.<sup>/sequences/<path:seq_id>')
+def get_sequence_super(family, sup, seq_id):
+    return get_sequence(family + '/' + sup, seq_id)
+
+
+@app.route('/trees/<family>/alignment/<path:seq_id>')
+def get_aligned_sequence(family, seq_id):
+    """GET a single aligned sequence by ID.
+
+    :param family: Existing family name.
+    :param seq_id: Sequence ID.
+    :return: FASTA of aligned sequence.
+    """
+    return fasta_records_as_response(family, ALIGNMENT_NAME, [seq_id])
+
+
+@app.route('/trees/<family>.<sup>/alignment/<path:seq_id>')
+def get_aligned_sequence_super(family, sup, seq_id):
+    return get_aligned_sequence(family + '/' + sup, seq_id)
+
+
 @app.route('/trees/<family>.<superfamily>', methods=['DELETE'])
 def delete_superfamily(family, superfamily):
     """DELETE a superfamily.
@@ -629,6 +2620,8 @@ def delete_superfamily(family, superfamily):
         abort(403)
 
     shutil.rmtree(str(path))
+    update_catalog(catalog.delete_family, catalog_name(family, superfamily))
+    update_status_cache(forget_statuses, status_field(path))
     return 'Deleted "%s.%s".' % (family, superfamily)
 
 
@@ -647,56 +2640,594 @@ def post_superfamily_sequences(family, superfamily):
 def put_hmm(family):
     """PUT an hmm that belongs with the family.
 
+    The HMM header is checked before the HMM is saved.  Full stats are
+    computed by hmmstat in a queued job and written to hmmstats.json.
+
     :param family: name of existing family
-    :return:
+    :return: Response of HMM header values and job data, with status 202.
     """
-    hmm_fh = None
-    hmmstats_output = None
     hmm_path = Path(app.config['DATA']) / family / HMM_FILENAME
     try:
-        hmm_fh = hmm_path.open('wb')
+        header = read_hmm_header(
+            io.StringIO(request.data.decode('UTF-8', errors='replace')))
+    except ValueError as exc:
+        app.logger.error('Not a valid HMM file for family %s: %s',
+                         family, exc)
+        abort(406)
+    try:
+        with replace_stored(hmm_path) as hmm_fh:
+            hmm_fh.write(request.data)
     except IOError:  # pragma: no cover
         app.logger.error('Unable to create "%s".', str(hmm_path))
         abort(400)
-    hmm_fh.write(request.data)
-    hmm_fh.close()
-    try:  # get HMM stats with hmmstat
-        with open(os.devnull, 'w') as devnull:
-            hmmstats_output = subprocess.check_output(
-                ['hmmstat', HMM_FILENAME],
-                universal_newlines=True,
-                stderr=devnull,
-                cwd=str(hmm_path.parent))
-    except subprocess.CalledProcessError:
-        app.logger.error('Not a valid HMM file for family %s, removing.',
+    forget_inflight_jobs(family)
+    hmmstats_path = hmm_path.parent / HMMSTATS_NAME
+    if hmmstats_path.exists():  # stale
+        hmmstats_path.unlink()
+    update_catalog(catalog.update_family, family, family,
+                   hmm_name=header['name'],
+                   hmm_length=header['M'],
+                   hmm_nseq=header.get('nseq'))
+    hmm_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
+    hmm_job = hmm_queue.enqueue(compute_hmm_stats,
+                                args=(family,),
+                                description='hmmstat of family %s' % family,
+                                timeout=app.config['ALIGNMENT_QUEUE_TIMEOUT']
+                                )
+    hmm_job.estimated_time = HMMSTAT_JOB_TIME
+    remember_job_estimate(hmm_job)
+    schedule_job(hmm_job, HMMSTAT_JOB_TIME, 'interactive', bounded=True)
+    response = hmm_job_as_response(family, hmm_job, hmm_queue,
+                                   header=header)
+    response.status_code = 202
+    response.headers['Location'] = response.json['status_url']
+    return response
+
+
+@app.route('/trees/<family>/HMM/status/<job_id>')
+def get_hmm_status(family, job_id):
+    """Return the status of the hmmstat job of an HMM PUT.
+
+    :param family: Name of family.
+    :param job_id: ID of hmmstat job.
+    :return: Response of job data, with HMM stats when finished.
+    """
+    hmm_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
+    hmm_job = hmm_queue.fetch_job(job_id)
+    if hmm_job is None or hmm_job.args != (family,):
+        app.logger.error('No hmmstat job "%s" for family %s.', job_id,
                          family)
+        abort(404)
+    return hmm_job_as_response(family, hmm_job, hmm_queue)
+
+
+def hmm_job_as_response(family, job, q, header=None):
+    """Return a JSON dictionary of hmmstat job parameters and results.
+
+    :param family: Name of family.
+    :param job: Job object.
+    :param q: Queue object.
+    :param header: Dictionary of HMM header values, if any.
+    :return: Response of JSON data.
+    """
+    job.tasktype = 'hmmstat'
+    job.taskname = 'hmmstat'
+    job.family = family
+    job.superfamily = None
+    job.estimated_time = recall_job_estimate(job)
+    extra = {'status_url': url_for('get_hmm_status', family=family,
+                                   job_id=job.id),
+             'hmmstats': None}
+    if header is not None:
+        extra['header'] = header
+    if job.is_finished:
+        extra['hmmstats'] = job.result
+    return job_data_as_response(job, q, extra=extra)
+
+
+def compute_hmm_stats(family):
+    """Run hmmstat on the HMM of a family and save the stats.
+
+    An HMM that hmmstat cannot read is removed.
+
+    :param family: Name of family.
+    :return: Dictionary of HMM stats.
+    """
+    hmm_path = Path(app.config['DATA']) / family / HMM_FILENAME
+    try:
+        hmmstats_dict = hmmstat(hmm_path, app.config['HMMSTAT_EXE'])
+    except ValueError as exc:
+        app.logger.error('%s Removing HMM for family %s.', exc, family)
         hmm_path.unlink()
-        abort(406)
-    hmmstats_dict = {}
-    for line in io.StringIO(hmmstats_output):
-        if line.startswith('#') or line.startswith('\n'):
+        update_catalog(catalog.update_family, family, family,
+                       hmm_name=None, hmm_length=None, hmm_nseq=None)
+        raise
+    save_hmm_stats(family, hmmstats_dict)
+    retire_current_job()
+    return hmmstats_dict
+
+
+def save_hmm_stats(family, hmmstats_dict):
+    """Write HMM statistics to disk and to the catalog.
+
+    :param family: Name of family.
+    :param hmmstats_dict: Dictionary of statistics from hmmstat.
+    :return:
+    """
+    hmmstats_path = Path(app.config['DATA']) / family / HMMSTATS_NAME
+    with hmmstats_path.open(mode='w') as hmmstats_fh:
+        json.dump(hmmstats_dict, hmmstats_fh)
+    update_catalog(catalog.update_family, family, family,
+                   hmm_name=hmmstats_dict.get('name'),
+                   hmm_length=hmmstats_dict.get('M'),
+                   hmm_nseq=hmmstats_dict.get('nseq'))
+
+
+@app.route('/trees/bulk/families', methods=['POST'])
+def post_bulk_families():
+    """POST an archive of FASTA and HMM files for many families.
+
+    The archive is a tar file, optionally compressed with gzip, bzip2,
+    or xz, sent either as the request body or as file field "archive".
+    Members named <family>.faa, <family>.fna, and <family>.hmm are
+    loaded by a queued job.  An optional "strip_prefix" argument is
+    removed from the start of member names.
+
+    :return: Response of job data, with status 202.
+    """
+    strip_prefix = request.args.get('strip_prefix', '')
+    upload_dir = Path(app.config['DATA']) / UPLOAD_DIR_NAME
+    if not upload_dir.exists():
+        upload_dir.mkdir()
+    if 'archive' in request.files:
+        in_fh = request.files['archive'].stream
+    else:
+        in_fh = request.stream
+    archive_path = upload_dir / (uuid.uuid4().hex + '.tar')
+    with archive_path.open(mode='wb') as archive_fh:
+        shutil.copyfileobj(in_fh, archive_fh, COPY_CHUNK_SIZE)
+    if archive_path.stat().st_size == 0:
+        archive_path.unlink()
+        app.logger.error('Empty archive in bulk load of families.')
+        abort(400)
+    load_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
+    load_job = load_queue.enqueue(load_families,
+                                  args=(archive_path, strip_prefix),
+                                  description='bulk load of families',
+                                  timeout=app.config['ALIGNMENT_QUEUE_TIMEOUT']
+                                  )
+    load_job.estimated_time, bounded = predict_job_time(
+        'load', BULK_LOAD_METHOD,
+        {'total_length': archive_path.stat().st_size})
+    remember_job_estimate(load_job)
+    schedule_job(load_job, load_job.estimated_time, 'batch', bounded=bounded)
+    response = bulk_job_as_response(load_job, load_queue)
+    response.status_code = 202
+    response.headers['Location'] = response.json['status_url']
+    return response
+
+
+@app.route('/trees/bulk/families/<job_id>')
+def get_bulk_families(job_id):
+    """Return the status and progress of a bulk load of families.
+
+    :param job_id: ID of bulk-load job.
+    :return: Response of job data.
+    """
+    load_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
+    load_job = load_queue.fetch_job(job_id)
+    if load_job is None:
+        app.logger.error('No bulk-load job "%s".', job_id)
+        abort(404)
+    return bulk_job_as_response(load_job, load_queue)
+
+
+def bulk_job_as_response(job, q):
+    """Return a JSON dictionary of bulk-load job parameters and progress.
+
+    :param job: Job object.
+    :param q: Queue object.
+    :return: Response of JSON data.
+    """
+    job.tasktype = 'load'
+    job.taskname = 'families'
+    job.family = None
+    job.superfamily = None
+    job.estimated_time = recall_job_estimate(job)
+    return job_data_as_response(job, q, extra={
+        'progress': job.meta.get('progress'),
+        'status_url': url_for('get_bulk_families', job_id=job.id)})
+
+
+def report_progress(job, progress):
+    """Save progress of the current job in its metadata.
+
+    :param job: Job object, or None if not running in a worker.
+    :param progress: Dictionary of progress data.
+    :return:
+    """
+    if job is not None:
+        job.meta['progress'] = progress
+        job.save_meta()
+
+
+def record_load_error(progress, message):
+    """Log an error in loading a family and record it in progress data.
+
+    :param progress: Dictionary of progress data.
+    :param message: Error message.
+    :return:
+    """
+    app.logger.error(message)
+    progress['error_count'] += 1
+    if len(progress['errors']) < BULK_ERROR_LIMIT:
+        progress['errors'].append(message)
+
+
+def load_families(archive_path, strip_prefix=''):
+    """Load families from an archive of FASTA and HMM files.
+
+    The archive is read as a stream, so members are loaded in the order
+    they are stored and memory use does not depend on archive size.
+    HMM statistics are computed in a pool of hmmstat processes while
+    the rest of the archive is being read.  The archive is removed when
+    done, and the time taken is recorded for estimates of later loads.
+
+    :param archive_path: Path to tar archive.
+    :param strip_prefix: String removed from the start of member names.
+    :return: Dictionary of counts and error messages.
+    """
+    job = get_current_job()
+    start_time = time.monotonic()
+    start_cpu_time = time.process_time()
+    start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    progress = {'archive_size': archive_path.stat().st_size,
+                'bytes_read': 0,
+                'members': 0,
+                'families': 0,
+                'hmms': 0,
+                'hmmstats': 0,
+                'skipped': 0,
+                'error_count': 0,
+                'errors': []}
+    hmm_futures = {}
+    report_progress(job, progress)
+    try:
+        with archive_path.open(mode='rb') as archive_fh, \
+                ThreadPoolExecutor(
+                    max_workers=app.config['BULK_LOAD_WORKERS'] or
+                    os.cpu_count()) as pool:
+            try:
+                with tarfile.open(fileobj=archive_fh, mode='r|*') as archive:
+                    for member in archive:
+                        progress['members'] += 1
+                        if member.isfile():
+                            load_archive_member(archive, member, strip_prefix,
+                                                pool, hmm_futures, progress)
+                        if progress['members'] % BULK_PROGRESS_INTERVAL == 0:
+                            progress['bytes_read'] = archive_fh.tell()
+                            report_progress(job, progress)
+            except tarfile.TarError as exc:
+                record_load_error(progress, 'Unreadable archive: %s' % exc)
+            progress['bytes_read'] = archive_fh.tell()
+            report_progress(job, progress)
+            futures = {future: family
+                       for family, future in hmm_futures.items()}
+            for count, future in enumerate(as_completed(futures), start=1):
+                family = futures[future]
+                try:
+                    save_hmm_stats(family, future.result())
+                    progress['hmmstats'] += 1
+                except ValueError as exc:
+                    record_load_error(progress, '%s Removing HMM for family '
+                                                '%s.' % (exc, family))
+                    (Path(app.config['DATA']) / family /
+                     HMM_FILENAME).unlink()
+                if count % BULK_PROGRESS_INTERVAL == 0:
+                    report_progress(job, progress)
+    finally:
+        archive_path.unlink()
+        retire_current_job()
+    report_progress(job, progress)
+    if progress['families'] or progress['hmms']:
+        update_catalog(catalog.add_timing, 'bulk', BULK_LOAD_METHOD,
+                       time.monotonic() - start_time,
+                       time.process_time() - start_cpu_time +
+                       accounting.cpu_time(
+                           accounting.children_usage_since(start_usage)),
+                       {'total_length': progress['archive_size']})
+    app.logger.info('Bulk load of %d families and %d HMMs done with %d '
+                    'errors.', progress['families'], progress['hmms'],
+                    progress['error_count'])
+    return progress
+
+
+def load_archive_member(archive, member, strip_prefix, pool, hmm_futures,
+                        progress):
+    """Load one FASTA or HMM file from an archive into a family directory.
+
+    :param archive: Open TarFile.
+    :param member: TarInfo of member.
+    :param strip_prefix: String removed from the start of member names.
+    :param pool: Executor in which hmmstat is run.
+    :param hmm_futures: Dictionary of hmmstat futures by family name.
+    :param progress: Dictionary of progress data.
+    :return:
+    """
+    basename = os.path.basename(member.name)
+    if strip_prefix and basename.startswith(strip_prefix):
+        basename = basename[len(strip_prefix):]
+    family, extension = os.path.splitext(basename)
+    sequence_types = {ext: key for key, ext in SEQUENCE_EXTENSIONS.items()}
+    if extension not in sequence_types and extension != HMM_EXTENSION:
+        progress['skipped'] += 1
+        return
+    if not family or family.startswith('.') or '.' in family:
+        record_load_error(progress, 'Bad family name in archive member '
+                                    '"%s".' % member.name)
+        return
+    family_path = Path(app.config['DATA']) / family
+    if not family_path.is_dir():
+        family_path.mkdir()
+    member_fh = archive.extractfile(member)
+    if extension == HMM_EXTENSION:
+        hmm_path = family_path / HMM_FILENAME
+        tmp_path = family_path / ('.%s.%s' % (HMM_FILENAME,
+                                              uuid.uuid4().hex))
+        with tmp_path.open(mode='wb') as hmm_fh:
+            shutil.copyfileobj(member_fh, hmm_fh, COPY_CHUNK_SIZE)
+        os.replace(str(tmp_path), str(hmm_path))
+        forget_inflight_jobs(family)
+        hmm_futures[family] = pool.submit(hmmstat, hmm_path,
+                                          app.config['HMMSTAT_EXE'])
+        progress['hmms'] += 1
+        return
+    try:
+        save_fasta(iter_lines(member_fh), family_path,
+                   SEQUENCES_NAME + extension, family)
+    except (ValueError, RuntimeError) as exc:
+        record_load_error(progress, 'Unparseable/empty FASTA for family '
+                                    '"%s": %s' % (family, exc))
+        return
+    progress['families'] += 1
+
+
+@app.route('/trees/bulk/calculations/<calculation>', methods=['POST'])
+def post_bulk_calculation(calculation):
+    """Queue a calculation for many families in one batch.
+
+    Families are given as a JSON list in the "families" item of the
+    request body (names of superfamilies as family.superfamily), or
+    else selected from the catalog by the query arguments accepted by
+    catalog.json.  Jobs for each chunk of families are queued in a
+    single Redis transaction.  Families listed more than once, or whose
+    calculation is already queued or running, join the jobs they have.
+
+    :param calculation: Name of calculation to be done.
+    :return: Response of batch status, with status 202.
+    """
+    if calculation not in [method.__name__[len('calculate_'):]
+                           for method in calculation_methods]:
+        app.logger.error('Unrecognized calculation type %s.', calculation)
+        abort(404)
+    body = request.get_json(silent=True)
+    if body is not None and 'families' in body:
+        names = body['families']
+        if not isinstance(names, list) or \
+                not all(isinstance(name, str) for name in names):
+            app.logger.error('Families of batch must be a list of names.')
+            abort(400)
+    else:
+        names = [entry['name'] for entry in query_catalog()[1]]
+    batch_id = uuid.uuid4().hex
+    batch = {'id': batch_id,
+             'calculation': calculation,
+             'created_at': datetime.isoformat(datetime.utcnow()),
+             'families': len(names),
+             'cached': 0,
+             'coalesced': 0,
+             'errors': {}}
+    seen = set()
+    for start in range(0, len(names), BATCH_PIPELINE_SIZE):
+        plans = []
+        inflight_ids = []
+        locks = {}
+        try:
+            for name in names[start:start + BATCH_PIPELINE_SIZE]:
+                if name in seen:
+                    batch['coalesced'] += 1
+                    continue
+                seen.add(name)
+                familyname, _dot, superfamily = name.partition('.')
+                try:
+                    if familyname not in locks:
+                        locks[familyname] = lock_family(familyname)
+                    job = find_inflight_job(familyname, calculation,
+                                            superfamily or None)
+                    if job is not None:
+                        batch['coalesced'] += 1
+                        inflight_ids.append(job.id)
+                        continue
+                    plan = plan_calculation(
+                        familyname, calculation, superfamily or None,
+                        find_inflight_alignment(familyname, calculation,
+                                                superfamily or None))
+                except HTTPException as exc:
+                    batch['errors'][name] = exc.code
+                    continue
+                if plan['alignment'] is None and plan['tree'] is None:
+                    batch['cached'] += 1
+                else:
+                    plans.append(plan)
+            enqueue_batch(batch_id, plans, inflight_ids)
+        finally:
+            for lock in locks.values():
+                unlock_family(lock)
+    rq.connection.set(BATCH_KEY_PREFIX + batch_id, json.dumps(batch),
+                      ex=app.config['BATCH_TTL'])
+    rq.connection.expire(BATCH_KEY_PREFIX + batch_id + ':jobs',
+                         app.config['BATCH_TTL'])
+    response = batch_status_as_response(batch)
+    response.status_code = 202
+    response.headers['Location'] = response.json['status_url']
+    return response
+
+
+@app.route('/trees/bulk/batches/<batch_id>')
+def get_batch_status(batch_id):
+    """Return aggregate status of the jobs of a batch.
+
+    :param batch_id: ID of batch.
+    :return: Response of batch status.
+    """
+    batch_json = rq.connection.get(BATCH_KEY_PREFIX + batch_id)
+    if batch_json is None:
+        app.logger.error('No batch "%s".', batch_id)
+        abort(404)
+    return batch_status_as_response(json.loads(batch_json))
+
+
+def enqueue_batch(batch_id, plans, inflight_ids=()):
+    """Queue planned jobs and record them in a batch, in one transaction.
+
+    Tree jobs that depend on an alignment job are registered as deferred
+    before the alignment job is queued, so none can be missed by a
+    worker that finishes the alignment right away.  Tree jobs that wait
+    on alignment jobs queued before are queued on their own.
+
+    :param batch_id: ID of batch.
+    :param plans: List of plans from plan_calculation.
+    :param inflight_ids: IDs of jobs already queued that join the batch.
+    :return: List of IDs of jobs queued.
+    """
+    align_queue = rq.get_queue(app.config['ALIGNMENT_QUEUE'])
+    tree_queue = rq.get_queue(app.config['TREE_QUEUE'])
+    ttl = app.config['BATCH_TTL']
+    ready = []
+    deferred = []
+    joined = []  # tree jobs queued on alignment jobs queued before
+    registered = []  # (plan, last job, alignment job if apart)
+    for plan in plans:
+        if plan['fused'] is not None:
+            fused_job = tree_queue.create_job(
+                run_fused_pipeline,
+                description=describe_task('pipeline',
+                                          plan['fused']['taskname'],
+                                          plan['family'],
+                                          plan['superfamily']),
+                result_ttl=ttl,
+                failure_ttl=ttl,
+                **plan['fused']['enqueue'])
+            fused_job.estimated_time, fused_job.bounded = estimate_job_time(
+                'pipeline', plan['fused']['taskname'], plan['family'],
+                plan['superfamily'])
+            ready.append((tree_queue, fused_job))
+            registered.append((plan, fused_job, None))
             continue
+        if plan['alignment_job'] is not None:
+            # The alignment job was queued before and may end at any
+            # time, so rq checks it as the tree job is queued.
+            tree_job = tree_queue.enqueue(
+                run_subprocess_with_status,
+                result_ttl=ttl,
+                failure_ttl=ttl,
+                depends_on=plan['alignment_job'],
+                **plan['tree']['enqueue'])
+            set_job_description('tree', plan['tree']['taskname'], tree_job,
+                                plan['family'], plan['superfamily'],
+                                'batch')
+            joined.append(tree_job.id)
+            registered.append((plan, tree_job, None))
+            continue
+        align_job = None
+        if plan['alignment'] is not None:
+            align_job = align_queue.create_job(
+                run_subprocess_with_status,
+                description=describe_task('alignment',
+                                          plan['alignment']['taskname'],
+                                          plan['family'],
+                                          plan['superfamily']),
+                result_ttl=ttl,
+                failure_ttl=ttl,
+                **plan['alignment']['enqueue'])
+            align_job.estimated_time, align_job.bounded = estimate_job_time(
+                'alignment', plan['alignment']['taskname'], plan['family'],
+                plan['superfamily'])
+            ready.append((align_queue, align_job))
+        if plan['tree'] is not None:
+            tree_job = tree_queue.create_job(
+                run_subprocess_with_status,
+                description=describe_task('tree',
+                                          plan['tree']['taskname'],
+                                          plan['family'],
+                                          plan['superfamily']),
+                result_ttl=ttl,
+                failure_ttl=ttl,
+                depends_on=align_job,
+                **plan['tree']['enqueue'])
+            tree_job.estimated_time, tree_job.bounded = estimate_job_time(
+                'tree', plan['tree']['taskname'], plan['family'],
+                plan['superfamily'])
+            if align_job is None:
+                ready.append((tree_queue, tree_job))
+            else:
+                tree_job.origin = tree_queue.name
+                deferred.append(tree_job)
+            registered.append((plan, tree_job, align_job))
         else:
-            fields = line.split()
-            try:
-                hmmstats_dict['idx'] = fields[0]
-                hmmstats_dict['name'] = fields[1]
-                hmmstats_dict['accession'] = fields[2]
-                hmmstats_dict['nseq'] = int(fields[3])
-                hmmstats_dict['eff_nseq'] = float(fields[4])
-                hmmstats_dict['M'] = int(fields[5])
-                hmmstats_dict['relent'] = float(fields[6])
-                hmmstats_dict['info'] = float(fields[7])
-                hmmstats_dict['relE'] = float(fields[8])
-                hmmstats_dict['compKL'] = float(fields[9])
-            except (TypeError, KeyError,
-                    ValueError):  # pragma: no cover
-                app.logger.error(
-                    'hmmstats did not return expected stats, check version.')
-                abort(406)
-    with (Path(hmm_path.parent) / HMMSTATS_NAME).open(mode='w') as hmmstats_fh:
-        json.dump(hmmstats_dict, hmmstats_fh)
-    return Response(json.dumps(hmmstats_dict), mimetype=JSON_MIMETYPE)
+            registered.append((plan, align_job, None))
+    job_ids = [job.id for job in deferred] + \
+        [job.id for q, job in ready] + joined
+    if not job_ids and not inflight_ids:
+        return job_ids
+    with rq.connection.pipeline() as pipe:
+        pipe.multi()
+        for job in deferred:
+            job.set_status(JobStatus.DEFERRED, pipeline=pipe)
+            job.register_dependency(pipeline=pipe)
+            job.save(pipeline=pipe)
+            remember_job_estimate(job, pipe)
+            schedule_job(job, job.estimated_time, 'batch', pipe,
+                         bounded=job.bounded)
+        for q, job in ready:
+            schedule_job(job, job.estimated_time, 'batch', pipe,
+                         bounded=job.bounded)
+            q.enqueue_job(job, pipeline=pipe)
+            remember_job_estimate(job, pipe)
+        for plan, job, align_job in registered:
+            register_inflight_jobs(plan, job, align_job=align_job,
+                                   connection=pipe)
+        pipe.rpush(BATCH_KEY_PREFIX + batch_id + ':jobs',
+                   *(job_ids + list(inflight_ids)))
+        pipe.execute()
+    return job_ids
+
+
+def batch_status_as_response(batch):
+    """Return a JSON dictionary of batch data and job-status counts.
+
+    :param batch: Dictionary of batch data.
+    :return: Response of JSON data.
+    """
+    batch_dict = dict(batch)
+    counts = OrderedDict([(count_name, 0) for count_name in
+                          ['queued', 'running', 'finished', 'failed',
+                           'expired']])
+    job_ids = [job_id.decode('UTF-8') for job_id in rq.connection.lrange(
+        BATCH_KEY_PREFIX + batch['id'] + ':jobs', 0, -1)]
+    job_class = rq.get_queue(app.config['ALIGNMENT_QUEUE']).job_class
+    for job in job_class.fetch_many(job_ids, connection=rq.connection):
+        if job is None:
+            counts['expired'] += 1
+        else:
+            status = job.get_status(refresh=False)
+            counts[BATCH_STATUS_COUNTS.get(getattr(status, 'value', status),
+                                           'queued')] += 1
+    batch_dict['jobs'] = len(job_ids)
+    batch_dict.update(counts)
+    batch_dict['status_url'] = url_for('get_batch_status',
+                                       batch_id=batch['id'])
+    return Response(json.dumps(batch_dict), mimetype=JSON_MIMETYPE)
 
 
 def bind_calculation(method, superfamily=False):
@@ -728,19 +3259,19 @@ calculation_methods = []
 for aligner in list(app.config['ALIGNERS'].keys()):
     calculation_methods.append(bind_calculation(aligner))
     calculation_methods.append(bind_calculation(aligner, superfamily=True))
-    for builder in list(app.config['TREEBUILDERS'].keys()):
+    for builder in tree_methods():
         calculation_methods.append(bind_calculation(aligner + '_' + builder))
         calculation_methods.append(bind_calculation(aligner +
                                                     '_' + builder,
                                                     superfamily=True))
-for builder in list(app.config['TREEBUILDERS'].keys()):
+for builder in tree_methods():
     calculation_methods.append(bind_calculation(builder))
     calculation_methods.append(bind_calculation(builder, superfamily=True))
 
 # FIXME: currently doesn't render correctly
 @app.route('/trees/<familyname>/<method>/view', methods=['GET'])
 def phyd3(familyname, method):
-    if method not in app.config['TREEBUILDERS']:
+    if method not in tree_methods():
         abort(404)
     inpath = Path(app.config['DATA']) / familyname / method
     if not inpath.exists():
@@ -749,12 +3280,10 @@ def phyd3(familyname, method):
 
 @app.route('/trees/<familyname>/<method>/' + TREE_NAME)
 def get_existing_tree(familyname, method):
-    if method not in app.config['TREEBUILDERS']:
+    if method not in tree_methods():
         abort(404)
     inpath = Path(app.config['DATA']) / familyname / method / TREE_NAME
-    if not inpath.exists():
-        abort(404)
-    return Response(inpath.open().read(), mimetype=NEWICK_MIMETYPE)
+    return send_data_file(inpath, NEWICK_MIMETYPE)
 
 
 @app.route('/trees/<family>.<sup>/<method>/' + TREE_NAME)
@@ -764,13 +3293,11 @@ def get_existing_tree_super(family, method, sup):
 
 @app.route('/trees/<familyname>/<method>/' + PHYLOXML_NAME)
 def get_phyloxml_tree(familyname, method):
-    if method not in app.config['TREEBUILDERS']:
+    if method not in tree_methods():
         abort(404)
     inpath = Path(
         app.config['DATA']) / familyname / method / PHYLOXML_NAME
-    if not inpath.exists():
-        abort(404)
-    return Response(inpath.open().read(), mimetype=NEWICK_MIMETYPE)
+    return send_data_file(inpath, NEWICK_MIMETYPE)
 
 
 @app.route('/trees/<family>.<sup>/<method>/' + PHYLOXML_NAME)
@@ -781,7 +3308,7 @@ def get_phyloxml_tree_super(family, method, sup):
 @app.route('/trees/<familyname>/<method>/' + RUN_LOG_NAME)
 def get_log(familyname, method):
     inpath = None
-    if method in list(app.config['TREEBUILDERS'].keys()):
+    if method in tree_methods():
         inpath = Path(
             app.config['DATA']) / familyname / method / RUN_LOG_NAME
     elif method in list(app.config['ALIGNERS'].keys()):
@@ -790,7 +3317,7 @@ def get_log(familyname, method):
         abort(428)
     if not inpath.exists():
         abort(404)
-    return Response(inpath.open().read(), mimetype=TEXT_MIMETYPE)
+    return send_data_file(inpath, TEXT_MIMETYPE)
 
 
 @app.route('/trees/<family>.<sup>/<method>/' + RUN_LOG_NAME)
@@ -798,22 +3325,166 @@ def get_log_super(family, method, sup):
     return get_log(family + '/' + sup, method)
 
 
+@app.route('/trees/<familyname>/<method>/' + RUN_USAGE_NAME)
+def get_run_usage(familyname, method):
+    inpath = calculation_status_path(familyname, method)
+    if inpath is None:
+        abort(428)
+    inpath = inpath.parent / RUN_USAGE_NAME
+    if not inpath.exists():
+        abort(404)
+    return send_data_file(inpath, JSON_MIMETYPE)
+
+
+@app.route('/trees/<family>.<sup>/<method>/' + RUN_USAGE_NAME)
+def get_run_usage_super(family, method, sup):
+    return get_run_usage(family + '/' + sup, method)
+
+
+@app.route('/trees/<familyname>/<method>/' + TRIMMED_COLUMNS_NAME)
+def get_trimmed_columns(familyname, method):
+    if not split_tree_method(method)[1]:
+        abort(404)
+    inpath = Path(
+        app.config['DATA']) / familyname / method / TRIMMED_COLUMNS_NAME
+    return send_data_file(inpath, JSON_MIMETYPE)
+
+
+@app.route('/trees/<family>.<sup>/<method>/' + TRIMMED_COLUMNS_NAME)
+def get_trimmed_columns_super(family, method, sup):
+    return get_trimmed_columns(family + '/' + sup, method)
+
+
+def calculation_status_path(familyname, method):
+    """Return the path to the status file of a calculation.
+
+    :param familyname: Name of family, or family/superfamily.
+    :param method: Name of aligner or tree builder.
+    :return: Path to status file, or None if method is not recognized.
+    """
+    if method in tree_methods():
+        return Path(app.config['DATA']) / familyname / method / STATUS_NAME
+    elif method in list(app.config['ALIGNERS'].keys()):
+        return Path(app.config['DATA']) / familyname / STATUS_NAME
+    return None
+
+
 @app.route('/trees/<familyname>/<method>/status')
 def get_status(familyname, method):
-    inpath = None
-    if method in list(app.config['TREEBUILDERS'].keys()):
-        inpath = Path(
-            app.config['DATA']) / familyname / method / STATUS_NAME
-    elif method in list(app.config['ALIGNERS'].keys()):
-        inpath = Path(app.config['DATA']) / familyname / STATUS_NAME
-    else:
+    inpath = calculation_status_path(familyname, method)
+    if inpath is None:
         abort(428)
-    if not inpath.exists():
+    status = read_statuses([inpath])[0]
+    if status is None:
         abort(404)
-    status = inpath.open().read()
-    return status
+    return '%d\n' % status
 
 
 @app.route('/trees/<family>.<sup>/<method>/status')
 def get_status_super(family, method, sup):
     return get_status(family + '/' + sup, method)
+
+
+def status_paths_of(names):
+    """Return the paths to the status files of named calculations.
+
+    :param names: List of names of the form family/method or
+                  family.superfamily/method.
+    :return: List of paths to status files.
+    """
+    paths = []
+    for name in names:
+        family, _slash, method = str(name).rpartition('/')
+        parts = family.split('.', 1)
+        path = calculation_status_path('/'.join(parts), method)
+        if path is None or '/' in family or \
+                not all(part and not part.startswith('.') for part in parts):
+            app.logger.error('"%s" is not a calculation.', name)
+            abort(400)
+        paths.append(path)
+    return paths
+
+
+@app.route('/trees/bulk/status', methods=['POST'])
+def post_bulk_status():
+    """Return the statuses of many calculations at once.
+
+    Calculations are given as a JSON list of names of the form
+    family/method (or family.superfamily/method) in the "calculations"
+    item of the request body.  With the query argument "wait" (seconds,
+    up to STATUS_WAIT_LIMIT), the response is held until the status of a
+    calculation differs from that given for it in the "known" item of the
+    body (a dictionary of statuses by name), or until the wait ends.
+
+    :return: Response of JSON dictionary of statuses by name, null for
+             calculations with no status.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or \
+            not isinstance(body.get('calculations'), list) or \
+            not isinstance(body.get('known', {}), dict):
+        app.logger.error('Calculations must be a list of names.')
+        abort(400)
+    names = body['calculations']
+    paths = status_paths_of(names)
+    statuses = dict(zip(names, read_statuses(paths)))
+    known = body.get('known')
+    wait = min(request.args.get('wait', 0., type=float),
+               app.config['STATUS_WAIT_LIMIT'])
+    if known is not None and wait > 0. and \
+            all(statuses[name] == known.get(name) for name in names):
+        try:
+            for changed in status_changes(rq.connection,
+                                          [status_field(path)
+                                           for path in paths],
+                                          wait):
+                if changed is None or changed:
+                    statuses = dict(zip(names, read_statuses(paths)))
+                    if any(statuses[name] != known.get(name)
+                           for name in names):
+                        break
+        except RedisError as exc:
+            app.logger.error('Unable to wait for status changes: %s', exc)
+    return Response(json.dumps(statuses), mimetype=JSON_MIMETYPE)
+
+
+@app.route('/trees/bulk/status/events')
+def get_bulk_status_events():
+    """Stream the statuses of calculations as Server-Sent Events.
+
+    Calculations are named, as for post_bulk_status, by "calculation"
+    query arguments.  An event is sent with the status of each at the
+    start and on each change.  The stream ends after STATUS_STREAM_TIME
+    seconds, after which clients reconnect.
+
+    :return: Streamed response of events.
+    """
+    names = request.args.getlist('calculation')
+    paths = status_paths_of(names)
+    fields = [status_field(path) for path in paths]
+
+    def events():
+        sent = {}
+        sent_time = time.monotonic()
+        try:
+            for changed in status_changes(rq.connection, fields,
+                                          app.config['STATUS_STREAM_TIME']):
+                if changed is None or changed:
+                    for name, code in zip(names, read_statuses(paths)):
+                        if name not in sent or sent[name] != code:
+                            sent[name] = code
+                            sent_time = time.monotonic()
+                            yield 'event: status\ndata: %s\n\n' % \
+                                json.dumps({'calculation': name,
+                                            'status': code})
+                elif time.monotonic() - sent_time >= \
+                        app.config['STATUS_HEARTBEAT']:
+                    sent_time = time.monotonic()
+                    yield ': keep-alive\n\n'
+        except RedisError as exc:
+            app.logger.error('Unable to stream status changes: %s', exc)
+
+    return Response(stream_with_context(events()),
+                    mimetype=EVENT_STREAM_MIMETYPE,
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Share the cores of a host among the jobs of its workers.
+
+Aligners and tree builders are run with a number of threads that grows
+with the size of the family, up to a limit per tool.  Workers of class
+PackingWorker reserve cores for each job from a per-host budget kept
+in Redis, so that many small jobs run side by side on a large host
+while a large job gets as many threads as are free.  A worker does not
+take a job while all cores of its host are reserved.
+"""
+#
+# standard library imports
+#
+import math
+import os
+import shutil
+import time
+#
+# local imports
+#
+from . import app
+from .scheduler import POLL_INTERVAL, BackfillWorker
+#
+# Non-configurable global constants.
+#
+CORES_KEY_PREFIX = 'lorax:cores:'  # hash of cores reserved by worker
+WORKER_KEY_PREFIX = 'rq:worker:'
+CHUNKED_TOOLS = ['hmmalign']  # tools run in parallel on chunks of input
+#
+# Reserve up to the requested number of cores for a worker, dropping
+# reservations of workers that have died.  Returns the number reserved,
+# which is 0 if no core is free.
+#
+RESERVE_SCRIPT = '''
+local used = 0
+local reserved = redis.call('HGETALL', KEYS[1])
+for i = 1, #reserved, 2 do
+    if reserved[i] ~= ARGV[1] then
+        if redis.call('EXISTS', ARGV[4] .. reserved[i]) == 1 then
+            used = used + tonumber(reserved[i + 1])
+        else
+            redis.call('HDEL', KEYS[1], reserved[i])
+        end
+    end
+end
+local cores = math.min(tonumber(ARGV[2]), tonumber(ARGV[3]) - used)
+if cores < 1 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], cores)
+return cores
+'''
+#
+# Helper function defs start here.
+#
+
+
+def host_cores():
+    """Return the number of cores that workers on this host may use.
+
+    :return: WORKER_CORES if set, else the number of CPUs available.
+    """
+    if app.config['WORKER_CORES']:
+        return app.config['WORKER_CORES']
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+def threads_wanted(tool, features):
+    """Return the number of threads worth giving a run of a tool.
+
+    :param tool: Name of aligner or tree builder.
+    :param features: Dictionary with numbers of sequences and width.
+    :return: Number of threads, at least 1.
+    """
+    sizing = app.config['TOOL_THREADS'].get(tool)
+    if sizing is None:
+        return 1
+    cells = (features.get('sequences') or 0) * (features.get('width') or 0)
+    threads = max(math.ceil(cells / sizing['cells_per_thread']), 1)
+    if sizing['max_threads']:
+        threads = min(threads, sizing['max_threads'])
+    return threads
+
+
+def job_threads(job):
+    """Return the number of threads a job may use.
+
+    :param job: Job object, or None if not run by a worker.
+    :return: Threads reserved by a PackingWorker, else OMP_NUM_THREADS.
+    """
+    if job is not None and job.meta.get('threads'):
+        return job.meta['threads']
+    return int(os.environ.get('OMP_NUM_THREADS', 1))
+
+
+def threaded_command(cmdlist, tool, threads):
+    """Return a command line and environment for a thread count.
+
+    The multithreaded builds of FastTree and RAxML are used if more than
+    one thread is available and they are installed; otherwise the run is
+    single-threaded.  hmmalign runs keep their threads for aligning in
+    chunks.
+
+    :param cmdlist: Command line, with the tool third.
+    :param tool: Name of aligner or tree builder.
+    :param threads: Number of threads.
+    :return: Tuple of command line, environment, and number of threads.
+    """
+    threaded_exe = {'FastTree': app.config['FASTTREEMP_EXE'],
+                    'RAxML': app.config['RAXML_PTHREADS_EXE']}.get(tool)
+    if tool in CHUNKED_TOOLS:
+        threaded_exe = cmdlist[2]
+    if threads < 2 or threaded_exe is None or \
+            shutil.which(threaded_exe) is None:
+        threads = 1
+    cmdlist = list(cmdlist)
+    if threads > 1:
+        cmdlist[2] = threaded_exe
+        if tool == 'RAxML':
+            cmdlist += ['-T', '%d' % threads]
+    env = dict(os.environ, OMP_NUM_THREADS='%d' % threads)
+    return cmdlist, env, threads
+
+
+class PackingWorker(BackfillWorker):
+    """Worker that reserves cores of its host for each job it runs.
+
+    Start one per core (e.g., with "flask run-workers"), so that small
+    jobs fill the host one core each while large jobs get many threads.
+    """
+
+    def reserve_cores(self, cores):
+        """Set the number of cores reserved by this worker.
+
+        :param cores: Number of cores wanted.
+        :return: Number reserved, 0 if none are free.
+        """
+        return self.connection.register_script(RESERVE_SCRIPT)(
+            keys=[CORES_KEY_PREFIX + self.hostname],
+            args=[self.name, cores, host_cores(), WORKER_KEY_PREFIX])
+
+    def release_cores(self):
+        """Release the cores reserved by this worker.
+
+        :return:
+        """
+        self.connection.hdel(CORES_KEY_PREFIX + self.hostname, self.name)
+
+    def dequeue_job_and_maintain_ttl(self, timeout, *args, **kwargs):
+        """Wait for a free core, then take a job.
+
+        :param timeout: Seconds to wait for a job, or None to not wait.
+        :return: Tuple of job and queue, or None.
+        """
+        while not self.reserve_cores(1):
+            if timeout is None:
+                return None
+            self.heartbeat()
+            time.sleep(POLL_INTERVAL)
+        result = super().dequeue_job_and_maintain_ttl(timeout, *args,
+                                                      **kwargs)
+        if result is None:
+            self.release_cores()
+        return result
+
+    def execute_job(self, job, queue):
+        """Reserve the cores wanted by a job while it runs.
+
+        :param job: Job object.
+        :param queue: Queue object.
+        :return:
+        """
+        parallel = job.kwargs.get('parallel')
+        if parallel is not None:
+            job.meta['threads'] = max(
+                self.reserve_cores(parallel['threads']), 1)
+            job.save_meta()
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            self.release_cores()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Estimate run times of calculations from the times of previous runs.
+
+Each tool gets a power-law cost model,
+
+    time = exp(c0) * feature1**c1 * feature2**c2,
+
+fitted by least squares on the logarithms of recorded run times.  The
+features are total residues and HMM length for alignments, number of
+sequences and alignment width for trees, and archive size (recorded as
+total length) for bulk loads of families.  Tools with too few recorded
+runs get a fixed default estimate, which is not fitted to anything.
+"""
+#
+# standard library imports
+#
+import math
+import time
+#
+# third-party imports
+#
+import numpy as np
+#
+# Non-configurable global constants.
+#
+FEATURES = {'alignment': ['total_length', 'width'],
+            'tree': ['sequences', 'width'],
+            'load': ['total_length']}
+DEFAULT_TIMES = {'alignment': 10.,
+                 'tree': 60.,
+                 'load': 600.}
+MIN_RECORDS = 10  # runs needed before a model is fitted
+MAX_RECORDS = 1000  # most recent runs used in a fit
+REFIT_INTERVAL = 300  # seconds a fitted model is used before refitting
+#
+# Fitted models, by tool.
+#
+_models = {}
+#
+# Helper function defs start here.
+#
+
+
+def _log_features(tasktype, features):
+    return [1.] + [math.log(max(features.get(name) or 1, 1))
+                   for name in FEATURES[tasktype]]
+
+
+def fit_cost_model(tasktype, records):
+    """Fit a cost model to recorded run times.
+
+    :param tasktype: 'alignment', 'tree', or 'load'.
+    :param records: List of dictionaries of features and 'wall_time'.
+    :return: List of coefficients, or None if there are too few records.
+    """
+    records = [record for record in records
+               if record['wall_time'] > 0 and
+               all(record.get(name) for name in FEATURES[tasktype])]
+    if len(records) < MIN_RECORDS:
+        return None
+    design = np.array([_log_features(tasktype, record)
+                       for record in records])
+    times = np.log([record['wall_time'] for record in records])
+    coefficients = np.linalg.lstsq(design, times, rcond=None)[0]
+    return [float(coefficient) for coefficient in coefficients]
+
+
+def is_fitted(tasktype, coefficients, features):
+    """Return whether a prediction comes from a fitted cost model.
+
+    :param tasktype: 'alignment', 'tree', or 'load'.
+    :param coefficients: Coefficients of cost model, or None.
+    :param features: Dictionary of features of the calculation.
+    :return: False if the prediction is the default time.
+    """
+    return coefficients is not None and \
+        all(features.get(name) for name in FEATURES[tasktype])
+
+
+def predict_time(tasktype, coefficients, features):
+    """Predict the run time of a calculation.
+
+    :param tasktype: 'alignment', 'tree', or 'load'.
+    :param coefficients: Coefficients of cost model, or None.
+    :param features: Dictionary of features of the calculation.
+    :return: Estimated wall time in seconds.
+    """
+    if not is_fitted(tasktype, coefficients, features):
+        return DEFAULT_TIMES[tasktype]
+    return math.exp(sum(coefficient * value for coefficient, value in
+                        zip(coefficients,
+                            _log_features(tasktype, features))))
+
+
+def cost_model(tasktype, tool, load_records):
+    """Return the cost model of a tool, refitting it if out of date.
+
+    :param tasktype: 'alignment', 'tree', or 'load'.
+    :param tool: Name of aligner or tree builder.
+    :param load_records: Function returning recent records of the tool.
+    :return: Dictionary of coefficients, number of records, and fit time.
+    """
+    model = _models.get(tool)
+    if model is None or time.time() - model['fitted_at'] > REFIT_INTERVAL:
+        records = load_records(tool, MAX_RECORDS)
+        model = {'tasktype': tasktype,
+                 'features': FEATURES[tasktype],
+                 'coefficients': fit_cost_model(tasktype, records),
+                 'records': len(records),
+                 'fitted_at': time.time()}
+        _models[tool] = model
+    return model
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Streaming FASTA parsing and writing.
+
+Records are processed one line at a time, so memory use is bounded by
+line length rather than by file size.  Output matches what Biopython's
+FASTA writer produces for the same records.  Written files get an
+offset index in the samtools faidx format for random access by ID.
+"""
+#
+# standard library imports
+#
+import codecs
+import functools
+import hashlib
+import os
+import uuid
+#
+# local imports
+#
+from .files import open_stored, plain_path
+#
+# Non-configurable global constants.
+#
+FASTA_LINE_LENGTH = 60  # same as Biopython's FASTA writer
+READ_CHUNK_SIZE = 1024 * 1024
+FAI_EXTENSION = '.fai'
+INDEX_CACHE_SIZE = 16  # number of parsed indices kept per process
+#
+# Helper function defs start here.
+#
+
+
+def iter_lines(binary_fh, chunk_size=READ_CHUNK_SIZE, encoding='UTF-8'):
+    """Decode a binary stream in chunks, yielding lines.
+
+    :param binary_fh: File-like object opened in binary mode.
+    :param chunk_size: Number of bytes to read at a time.
+    :param encoding: Text encoding of stream.
+    :return: Generator of lines, including line terminators.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    remainder = ''
+    while True:
+        chunk = binary_fh.read(chunk_size)
+        text = remainder + decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            if text:
+                yield text
+            return
+        lines = text.split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\n'
+
+
+def copy_fasta(lines, out_fh, seen_ids, prefix=None, skip_duplicates=False):
+    """Parse FASTA records from lines and write them normalized to out_fh.
+
+    :param lines: Iterable of FASTA-formatted lines.
+    :param out_fh: Text file handle to which records are written.
+    :param seen_ids: Set of IDs already written, updated in place.
+    :param prefix: If given, prepended with a dot to IDs lacking it.
+    :param skip_duplicates: Silently drop duplicates instead of raising.
+    :return: Dictionary of record count, records written, and lengths.
+    """
+    stats = {'sequences': 0,
+             'written': 0,
+             'max_length': None,
+             'min_length': None,
+             'total_length': 0}
+    in_record = False
+    writing = False
+    length = 0
+    carry = ''
+
+    def finish_record():
+        if writing and carry:
+            out_fh.write(carry + '\n')
+        stats['sequences'] += 1
+        stats['total_length'] += length
+        if stats['max_length'] is None or length > stats['max_length']:
+            stats['max_length'] = length
+        if stats['min_length'] is None or length < stats['min_length']:
+            stats['min_length'] = length
+
+    for line in lines:
+        if line.startswith('>'):
+            if in_record:
+                finish_record()
+            in_record = True
+            length = 0
+            carry = ''
+            title = line[1:].rstrip()
+            seq_id = title.split(None, 1)[0] if title else ''
+            if prefix is not None and not seq_id.startswith(prefix):
+                seq_id = prefix + '.' + seq_id
+                title = prefix + '.' + title
+            if seq_id in seen_ids:
+                if not skip_duplicates:
+                    raise ValueError('Duplicate sequence ID "%s".' % seq_id)
+                writing = False
+                continue
+            seen_ids.add(seq_id)
+            writing = True
+            stats['written'] += 1
+            out_fh.write('>' + title + '\n')
+        elif in_record:
+            residues = line.rstrip().replace(' ', '').replace('\r', '')
+            length += len(residues)
+            if not writing:
+                continue
+            carry += residues
+            full = len(carry) - len(carry) % FASTA_LINE_LENGTH
+            for start in range(0, full, FASTA_LINE_LENGTH):
+                out_fh.write(carry[start:start + FASTA_LINE_LENGTH] + '\n')
+            carry = carry[full:]
+    if in_record:
+        finish_record()
+    return stats
+
+
+def fasta_index_path(fasta_path):
+    """Return the path of the offset index belonging to a FASTA file.
+
+    Offsets in the index of a compressed file refer to the uncompressed
+    data, so the index is named after the uncompressed file.
+
+    :param fasta_path: Path to (possibly compressed) FASTA file.
+    :return: Path to index file.
+    """
+    fasta_path = plain_path(fasta_path)
+    return fasta_path.with_name(fasta_path.name + FAI_EXTENSION)
+
+
+def build_fasta_index(fasta_path):
+    """Write a samtools-faidx-style offset index for a FASTA file.
+
+    Each line of the index holds NAME, LENGTH, OFFSET, LINEBASES and
+    LINEWIDTH, separated by tabs.  The index is written to a temporary
+    file and renamed into place.
+
+    :param fasta_path: Path to FASTA file.
+    :return: Path to index file.
+    """
+    index_path = fasta_index_path(fasta_path)
+    tmp_path = index_path.with_name('.%s.%s' % (index_path.name,
+                                                uuid.uuid4().hex))
+    entry = None
+    offset = 0
+    try:
+        with open_stored(fasta_path, 'rb') as fasta_fh, \
+                tmp_path.open(mode='w') as index_fh:
+            for line in fasta_fh:
+                if line.startswith(b'>'):
+                    if entry is not None:
+                        index_fh.write(_format_index_entry(entry))
+                    entry = {'name': _record_id(line),
+                             'length': 0,
+                             'offset': offset + len(line),
+                             'linebases': 0,
+                             'linewidth': 0,
+                             'short_line': False}
+                elif entry is not None:
+                    bases = len(line.rstrip(b'\r\n'))
+                    if bases and entry['short_line']:
+                        raise ValueError('Uneven line lengths in record "%s".'
+                                         % entry['name'])
+                    if not entry['linebases']:
+                        entry['linebases'] = bases
+                        entry['linewidth'] = len(line)
+                    elif bases > entry['linebases'] or (
+                            line.endswith(b'\n') and
+                            bases == entry['linebases'] and
+                            len(line) != entry['linewidth']):
+                        raise ValueError('Uneven line lengths in record "%s".'
+                                         % entry['name'])
+                    if bases < entry['linebases']:
+                        entry['short_line'] = True
+                    entry['length'] += bases
+                offset += len(line)
+            if entry is not None:
+                index_fh.write(_format_index_entry(entry))
+    except BaseException:
+        tmp_path.unlink()
+        raise
+    os.replace(str(tmp_path), str(index_path))
+    return index_path
+
+
+def record_digests(fasta_path):
+    """Return digests of the records of a FASTA file, to tell which changed.
+
+    :param fasta_path: Path to (possibly compressed) FASTA file.
+    :return: Dictionary of SHA-256 hex digests of record bytes (title and
+             sequence lines) keyed by sequence ID, in file order.
+    """
+    digests = {}
+    seq_id = None
+    digest = None
+    with open_stored(fasta_path, 'rb') as fasta_fh:
+        for line in fasta_fh:
+            if line.startswith(b'>'):
+                if digest is not None:
+                    digests[seq_id] = digest.hexdigest()
+                seq_id = _record_id(line)
+                digest = hashlib.sha256()
+            if digest is not None:
+                digest.update(line)
+    if digest is not None:
+        digests[seq_id] = digest.hexdigest()
+    return digests
+
+
+def _record_id(header):
+    fields = header[1:].split(None, 1)
+    return fields[0].decode('UTF-8') if fields else ''
+
+
+def _format_index_entry(entry):
+    return '%s\t%d\t%d\t%d\t%d\n' % (entry['name'],
+                                     entry['length'],
+                                     entry['offset'],
+                                     entry['linebases'],
+                                     entry['linewidth'])
+
+
+@functools.lru_cache(maxsize=INDEX_CACHE_SIZE)
+def _read_fasta_index(index_path, mtime_ns, size):
+    """Parse an index file into a dictionary of byte ranges.
+
+    The mtime and size arguments are only there to key the cache.
+
+    :return: Dictionary of (start, end) byte ranges of whole records.
+    """
+    del mtime_ns, size
+    ranges = {}
+    end = 0
+    with open(index_path) as index_fh:
+        for line in index_fh:
+            name, length, offset, linebases, linewidth = line.split('\t')
+            length, offset = int(length), int(offset)
+            linebases, linewidth = int(linebases), int(linewidth)
+            start = end
+            end = offset
+            if length:
+                full_lines, remainder = divmod(length, linebases)
+                end += full_lines * linewidth
+                if remainder:
+                    end += remainder + linewidth - linebases
+            if name not in ranges:
+                ranges[name] = (start, end)
+    return ranges
+
+
+def load_fasta_index(fasta_path):
+    """Return the offset index of a FASTA file, (re)building it if stale.
+
+    :param fasta_path: Path to FASTA file.
+    :return: Dictionary of (start, end) byte ranges keyed by sequence ID.
+    """
+    index_path = fasta_index_path(fasta_path)
+    if not index_path.exists() or \
+            index_path.stat().st_mtime_ns < fasta_path.stat().st_mtime_ns:
+        build_fasta_index(fasta_path)
+    index_stat = index_path.stat()
+    return _read_fasta_index(str(index_path),
+                             index_stat.st_mtime_ns,
+                             index_stat.st_size)
+
+
+def scan_fasta_records(fasta_path, seq_ids):
+    """Find records by reading through a FASTA file that cannot be indexed.
+
+    :param fasta_path: Path to FASTA file.
+    :param seq_ids: Sequence IDs to be returned.
+    :return: Dictionary of record bytes keyed by sequence ID.
+    """
+    wanted = set(seq_ids)
+    records = {}
+    seq_id = None
+    with open_stored(fasta_path, 'rb') as fasta_fh:
+        for line in fasta_fh:
+            if line.startswith(b'>'):
+                seq_id = _record_id(line)
+                if seq_id not in wanted or seq_id in records:
+                    seq_id = None
+                    continue
+                records[seq_id] = [line]
+            elif seq_id is not None:
+                records[seq_id].append(line)
+    return {seq_id: b''.join(lines) for seq_id, lines in records.items()}
+
+
+def fetch_fasta_records(fasta_path, seq_ids):
+    """Return FASTA records by seeking to their offsets.
+
+    Seeks in a compressed file decompress forward from the start, so
+    records are read in file order in a single pass.
+
+    :param fasta_path: Path to FASTA file.
+    :param seq_ids: Sequence IDs to be returned.
+    :return: Tuple of list of record bytes in request order and list of
+             IDs that were not found.
+    """
+    try:
+        index = load_fasta_index(fasta_path)
+    except ValueError:
+        found = scan_fasta_records(fasta_path, seq_ids)
+    else:
+        found = {}
+        wanted = sorted(set(seq_id for seq_id in seq_ids if seq_id in index),
+                        key=lambda seq_id: index[seq_id][0])
+        with open_stored(fasta_path, 'rb') as fasta_fh:
+            for seq_id in wanted:  # in file order, so seeks are forward
+                start, end = index[seq_id]
+                fasta_fh.seek(start)
+                found[seq_id] = fasta_fh.read(end - start)
+    return ([found[seq_id] for seq_id in seq_ids if seq_id in found],
+            [seq_id for seq_id in seq_ids if seq_id not in found])
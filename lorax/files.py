@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Store and serve result files from the data directory.
+
+Result files may be stored compressed.  The codec is given by the file
+suffix (e.g., ``alignment.faa.gz``), so readers find a file by its plain
+name and decompress as needed.
+"""
+#
+# standard library imports
+#
+import gzip
+import io
+import os
+import shutil
+import uuid
+from collections import OrderedDict  # python 3.1
+from contextlib import contextmanager
+#
+# third-party imports
+#
+from flask import Response, abort, request, send_file
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+#
+# Non-configurable global constants.
+#
+CODEC_EXTENSIONS = OrderedDict([
+    ('gzip', '.gz'),
+    ('zstd', '.zst')
+])
+COPY_CHUNK_SIZE = 1024 * 1024
+#
+# Helper function defs start here.
+#
+
+
+def codec_extension(codec):
+    """Return the file suffix for a storage codec.
+
+    :param codec: None, 'gzip', or 'zstd'.
+    :return: Suffix string, empty if uncompressed.
+    """
+    if not codec:
+        return ''
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError('Unknown storage codec "%s".' % codec)
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError('Storage codec "zstd" requires zstandard package.')
+    return CODEC_EXTENSIONS[codec]
+
+
+def path_codec(path):
+    """Return the codec of a stored file, judged by its suffix.
+
+    :param path: Path to stored file.
+    :return: Codec name, or None if uncompressed.
+    """
+    for codec, ext in CODEC_EXTENSIONS.items():
+        if path.name.endswith(ext):
+            return codec
+    return None
+
+
+def plain_path(path):
+    """Return the uncompressed name of a stored file.
+
+    :param path: Path to stored file.
+    :return: Path with any codec suffix removed.
+    """
+    codec = path_codec(path)
+    if codec is None:
+        return path
+    return path.with_name(path.name[:-len(CODEC_EXTENSIONS[codec])])
+
+
+def stored_variants(path):
+    """Return all the names under which a file may be stored.
+
+    :param path: Plain (uncompressed) path.
+    :return: List of paths, uncompressed first.
+    """
+    return [path] + [path.with_name(path.name + ext)
+                     for ext in CODEC_EXTENSIONS.values()]
+
+
+def find_stored(path):
+    """Return the path under which a file is actually stored.
+
+    :param path: Plain (uncompressed) path.
+    :return: Path to stored file, or None if it does not exist.
+    """
+    for candidate in stored_variants(path):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def discard_other_variants(path):
+    """Remove stored copies of a file other than the one at path.
+
+    :param path: Path to stored file to be kept.
+    :return:
+    """
+    for candidate in stored_variants(plain_path(path)):
+        if candidate != path and candidate.exists():
+            candidate.unlink()
+
+
+def open_stored(path, mode='rb'):
+    """Open a stored file, compressing or decompressing by suffix.
+
+    Files opened for writing are replaced rather than truncated.
+
+    :param path: Path to stored file.
+    :param mode: One of 'rb', 'wb', 'rt', or 'wt'.
+    :return: File object.
+    """
+    codec = path_codec(path)
+    if mode.startswith('w') and path.exists():
+        path.unlink()  # the old file may be hard-linked elsewhere
+    if codec == 'gzip':
+        if mode.startswith('w'):  # no timestamp, for reproducible output
+            gzip_fh = gzip.GzipFile(str(path), mode='wb', mtime=0)
+            if mode == 'wt':
+                return io.TextIOWrapper(gzip_fh, encoding='UTF-8')
+            return gzip_fh
+        return gzip.open(str(path), mode)
+    elif codec == 'zstd':
+        return zstandard.open(str(path), mode)
+    return path.open(mode=mode)
+
+
+@contextmanager
+def replace_stored(path, mode='wb'):
+    """Write a stored file under a temporary name and rename it into place.
+
+    Readers see the old file until the new one is complete, and of two
+    runs writing the same file, the last to finish wins whole.  If
+    writing fails, the temporary file is removed and the old file kept.
+
+    :param path: Path to stored file.
+    :param mode: One of 'wb' or 'wt'.
+    :return: File object, in a context manager.
+    """
+    # The codec suffix is kept at the end of the temporary name.
+    tmp_path = path.with_name('.%s.%s' % (uuid.uuid4().hex, path.name))
+    try:
+        with open_stored(tmp_path, mode) as out_fh:
+            yield out_fh
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    os.replace(str(tmp_path), str(path))
+
+
+def copy_stored(src_path, dest_path):
+    """Copy a file, recompressing according to the suffixes of both paths.
+
+    :param src_path: Path to stored file.
+    :param dest_path: Path to file to be written.
+    :return:
+    """
+    with open_stored(src_path, 'rb') as src_fh:
+        with open_stored(dest_path, 'wb') as dest_fh:
+            shutil.copyfileobj(src_fh, dest_fh, COPY_CHUNK_SIZE)
+
+
+def file_etag(file_stat):
+    """Return a strong entity tag built from modification time and size.
+
+    :param file_stat: os.stat_result of file.
+    :return: ETag string (without quotes).
+    """
+    return '%x-%x' % (file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def _stream_decompressed(path):
+    with open_stored(path, 'rb') as stored_fh:
+        while True:
+            chunk = stored_fh.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def send_data_file(path, mimetype):
+    """Stream a file, honoring conditional and range requests.
+
+    Responses carry ETag and Last-Modified headers and are marked
+    no-cache, so clients revalidate on each poll and get a 304 if the
+    file is unchanged.  The body is passed to the WSGI server's file
+    wrapper (or X-Sendfile, if USE_X_SENDFILE is set) rather than
+    being read into memory.  Compressed files are sent as stored with
+    a Content-Encoding header to clients that accept the encoding,
+    and decompressed on the fly (without range support) for others.
+
+    :param path: Plain (uncompressed) path to file.
+    :param mimetype: MIME type of response.
+    :return: Response.
+    """
+    stored_path = find_stored(path)
+    if stored_path is None:
+        abort(404)
+    try:
+        file_stat = stored_path.stat()
+    except FileNotFoundError:
+        abort(404)
+    codec = path_codec(stored_path)
+    if codec is None:
+        return send_file(str(stored_path.resolve()),
+                         mimetype=mimetype,
+                         conditional=True,
+                         etag=file_etag(file_stat),
+                         last_modified=file_stat.st_mtime)
+    if request.accept_encodings[codec]:
+        response = send_file(str(stored_path.resolve()),
+                             mimetype=mimetype,
+                             conditional=True,
+                             etag=file_etag(file_stat) + '-' + codec,
+                             last_modified=file_stat.st_mtime)
+        response.content_encoding = codec
+    else:
+        response = Response(_stream_decompressed(stored_path),
+                            mimetype=mimetype)
+        response.set_etag(file_etag(file_stat))
+        response.last_modified = file_stat.st_mtime
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Characterize profile HMM files.
+"""
+#
+# standard library imports
+#
+import io
+import os
+import subprocess
+#
+# Non-configurable global constants.
+#
+# Header tags of HMMER3 files, and the keys used for them by hmmstat.
+HEADER_TAGS = {'NAME': ('name', str),
+               'ACC': ('accession', str),
+               'DESC': ('description', str),
+               'LENG': ('M', int),
+               'ALPH': ('alphabet', str),
+               'NSEQ': ('nseq', int),
+               'EFFN': ('eff_nseq', float)}
+REQUIRED_TAGS = ['NAME', 'LENG', 'ALPH']
+#
+# Helper function defs start here.
+#
+
+
+def read_hmm_header(lines):
+    """Parse and check the header of a HMMER3 profile HMM.
+
+    This is a quick sanity check that does not run any HMMER binary.
+
+    :param lines: Iterable of lines of the HMM file.
+    :return: Dictionary of header values, keyed as by hmmstat.
+    """
+    lines = iter(lines)
+    first_line = next(lines, '')
+    if not first_line.startswith('HMMER3'):
+        raise ValueError('Not a HMMER3 file.')
+    header = {'format': first_line.split()[0]}
+    for line in lines:
+        tag, _space, value = line.rstrip().partition(' ')
+        if tag == 'HMM':
+            break
+        if tag in HEADER_TAGS:
+            key, value_type = HEADER_TAGS[tag]
+            try:
+                header[key] = value_type(value.strip())
+            except ValueError:
+                raise ValueError('Bad value of %s in HMM header.' % tag)
+    else:
+        raise ValueError('HMM file ends in header.')
+    for tag in REQUIRED_TAGS:
+        if HEADER_TAGS[tag][0] not in header:
+            raise ValueError('No %s in HMM header.' % tag)
+    return header
+
+
+def parse_hmmstat(hmmstat_output):
+    """Parse the output of hmmstat into a dictionary of statistics.
+
+    :param hmmstat_output: Text printed by hmmstat.
+    :return: Dictionary of statistics of the (last) model in the file.
+    """
+    hmmstats_dict = {}
+    for line in io.StringIO(hmmstat_output):
+        if line.startswith('#') or line.startswith('\n'):
+            continue
+        fields = line.split()
+        try:
+            hmmstats_dict['idx'] = fields[0]
+            hmmstats_dict['name'] = fields[1]
+            hmmstats_dict['accession'] = fields[2]
+            hmmstats_dict['nseq'] = int(fields[3])
+            hmmstats_dict['eff_nseq'] = float(fields[4])
+            hmmstats_dict['M'] = int(fields[5])
+            hmmstats_dict['relent'] = float(fields[6])
+            hmmstats_dict['info'] = float(fields[7])
+            hmmstats_dict['relE'] = float(fields[8])
+            hmmstats_dict['compKL'] = float(fields[9])
+        except (IndexError, TypeError, KeyError, ValueError):
+            raise ValueError(
+                'hmmstat did not return expected stats, check version.')
+    return hmmstats_dict
+
+
+def hmmstat(hmm_path, executable='hmmstat'):
+    """Run hmmstat on an HMM file.
+
+    :param hmm_path: Path to HMM file.
+    :param executable: Name or path of hmmstat executable.
+    :return: Dictionary of statistics.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            hmmstat_output = subprocess.check_output(
+                [executable, hmm_path.name],
+                universal_newlines=True,
+                stderr=devnull,
+                cwd=str(hmm_path.parent))
+    except subprocess.CalledProcessError:
+        raise ValueError('Not a valid HMM file.')
+    return parse_hmmstat(hmmstat_output)
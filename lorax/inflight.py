@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Coalesce requests for calculations that are already queued or running.
+
+The jobs queued for calculations (their IDs, task types, and task
+names) are kept in a Redis hash per family, keyed by superfamily and
+calculation, so that a request for a calculation whose job is still
+queued or running gets that job rather than a second one writing the
+same files.  Calculations of a family are planned and queued while
+holding a Redis lock on the family, so that requests that arrive
+together cannot both find no job.  Entries for jobs that have ended are
+ignored; the hash of a family is removed when its sequences or HMM
+change, since a running job may have read the old ones.
+"""
+#
+# standard library imports
+#
+import json
+#
+# Non-configurable global constants.
+#
+INFLIGHT_KEY_PREFIX = 'lorax:inflight:'  # hashes of jobs by calculation
+LOCK_KEY_PREFIX = 'lorax:lock:'  # locks on queueing calculations
+LIVE_STATUSES = ['queued', 'deferred', 'scheduled', 'started']
+ENDED_STATUSES = ['failed', 'stopped', 'canceled']  # with no result
+#
+# Helper function defs start here.
+#
+
+
+def _status(job):
+    status = job.get_status(refresh=False)
+    return getattr(status, 'value', status)
+
+
+def calculation_field(calculation, superfamily=None):
+    """Return the field under which the job of a calculation is kept.
+
+    :param calculation: Name of calculation (e.g., hmmalign_FastTree).
+    :param superfamily: Name of superfamily, if any.
+    :return: Field of the hash of the family.
+    """
+    return '%s/%s' % (superfamily or '', calculation)
+
+
+def family_lock(connection, family, timeout):
+    """Return a lock on queueing calculations of a family.
+
+    :param connection: Redis connection.
+    :param family: Name of family.
+    :param timeout: Seconds after which the lock expires if not
+                    released, which are also the longest wait for it.
+    :return: redis.lock.Lock object, not yet acquired.
+    """
+    return connection.lock(LOCK_KEY_PREFIX + family, timeout=timeout,
+                           blocking_timeout=timeout)
+
+
+def find_job(connection, job_class, family, field):
+    """Return the job of a calculation, if it is queued or running.
+
+    :param connection: Redis connection.
+    :param job_class: Class of RQ jobs.
+    :param family: Name of family.
+    :param field: Field from calculation_field.
+    :return: Job object with tasktype and taskname set, or None.
+    """
+    entry = connection.hget(INFLIGHT_KEY_PREFIX + family, field)
+    if entry is None:
+        return None
+    job_id, tasktype, taskname = json.loads(entry)
+    job = job_class.fetch_many([job_id], connection=connection)[0]
+    if job is None:  # expired
+        return None
+    if _status(job) not in LIVE_STATUSES:
+        return None
+    if _status(job) == 'deferred':
+        # Jobs that wait on a failed job are never queued.
+        for parent in job_class.fetch_many(job.dependency_ids,
+                                           connection=connection):
+            if parent is None or _status(parent) in ENDED_STATUSES:
+                return None
+    job.tasktype = tasktype
+    job.taskname = taskname
+    return job
+
+
+def register_jobs(connection, family, jobs, ttl):
+    """Record the jobs queued for calculations of a family.
+
+    :param connection: Redis connection or pipeline.
+    :param family: Name of family.
+    :param jobs: Dictionary by field of (job ID, task type, task name).
+    :param ttl: Seconds for which the hash of the family is kept.
+    :return:
+    """
+    connection.hset(INFLIGHT_KEY_PREFIX + family,
+                    mapping={field: json.dumps(job)
+                             for field, job in jobs.items()})
+    connection.expire(INFLIGHT_KEY_PREFIX + family, ttl)
+
+
+def forget_jobs(connection, family):
+    """Stop coalescing requests with the jobs of a family.
+
+    :param connection: Redis connection.
+    :param family: Name of family.
+    :return:
+    """
+    connection.delete(INFLIGHT_KEY_PREFIX + family)
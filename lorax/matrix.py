@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped byte matrices of aligned FASTA files.
+
+Each aligned FASTA file may be accompanied by a matrix of its rows, one
+byte per residue or gap, one row per sequence in file order, stored in
+NumPy's .npy format under the name of the FASTA file with a .npy suffix
+(e.g., alignment.faa.npy).  Matrices are read through a memory map, so
+windows of columns, subsets of rows, and column statistics are computed
+from the pages they touch without parsing the FASTA file or loading the
+whole alignment.  Rows are matched to sequence IDs by the offset index
+of the FASTA file, whose entries are in the same order.
+"""
+#
+# standard library imports
+#
+import os
+import uuid
+#
+# third-party imports
+#
+import numpy as np
+#
+# local imports
+#
+from .fasta import load_fasta_index, FASTA_LINE_LENGTH
+from .files import plain_path
+from .stockholm import aligned_fasta_rows
+#
+# Non-configurable global constants.
+#
+MATRIX_EXTENSION = '.npy'
+BLOCK_CELLS = 1024 * 1024  # matrix cells processed at a time
+ALPHABET_SIZE = 26  # residue letters, case-folded
+GAP_CODE = ord('-')
+#
+# Helper function defs start here.
+#
+
+
+def matrix_path(fasta_path):
+    """Return the path of the matrix belonging to an aligned FASTA file.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :return: Path to matrix file.
+    """
+    fasta_path = plain_path(fasta_path)
+    return fasta_path.with_name(fasta_path.name + MATRIX_EXTENSION)
+
+
+def build_alignment_matrix(fasta_path):
+    """Write the matrix of an aligned FASTA file.
+
+    Rows are copied one at a time into a memory-mapped temporary file,
+    which is renamed into place.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :return: Path to matrix file.
+    :raises ValueError: If rows differ in width or IDs are repeated.
+    """
+    path = matrix_path(fasta_path)
+    tmp_path = path.with_name('.%s.%s' % (uuid.uuid4().hex, path.name))
+    rows = len(load_fasta_index(fasta_path))
+    matrix = None
+    try:
+        for row_number, (title, row) in enumerate(
+                aligned_fasta_rows(fasta_path)):
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(str(tmp_path),
+                                                   mode='w+',
+                                                   dtype=np.uint8,
+                                                   shape=(rows, len(row)))
+            if row_number >= rows:
+                raise ValueError('Repeated sequence IDs in %s.' %
+                                 fasta_path)
+            if len(row) != matrix.shape[1]:
+                raise ValueError('Row "%s" of %s is %d columns wide, not %d.'
+                                 % (title, fasta_path, len(row),
+                                    matrix.shape[1]))
+            matrix[row_number] = np.frombuffer(row, dtype=np.uint8)
+        if matrix is None:
+            raise ValueError('No rows in %s.' % fasta_path)
+        matrix.flush()
+    except BaseException:
+        del matrix  # closes the map
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    del matrix
+    os.replace(str(tmp_path), str(path))
+    return path
+
+
+def load_alignment_matrix(fasta_path):
+    """Return the matrix of an aligned FASTA file, (re)building it if stale.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :return: Read-only memory-mapped array of shape (rows, columns).
+    :raises ValueError: If the file is not an alignment.
+    """
+    path = matrix_path(fasta_path)
+    if not path.exists() or \
+            path.stat().st_mtime_ns < fasta_path.stat().st_mtime_ns:
+        build_alignment_matrix(fasta_path)
+    return np.load(str(path), mmap_mode='r')
+
+
+def row_numbers(fasta_path, seq_ids):
+    """Return the rows of the matrix of an aligned FASTA file by ID.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :param seq_ids: Sequence IDs.
+    :return: Tuple of list of row numbers of IDs found, in the order
+             given, and list of IDs that were not found.
+    """
+    rows = {seq_id: row for row, seq_id in
+            enumerate(load_fasta_index(fasta_path))}
+    return ([rows[seq_id] for seq_id in seq_ids if seq_id in rows],
+            [seq_id for seq_id in seq_ids if seq_id not in rows])
+
+
+def _row_blocks(matrix, rows, start, stop):
+    """Yield blocks of rows of a window of a matrix.
+
+    :param matrix: Array of aligned rows.
+    :param rows: Sequence of row numbers, or None for all rows.
+    :param start: First column (0-based).
+    :param stop: Column after the last.
+    :return: Iterator of tuples of row numbers and 2-D arrays.
+    """
+    block_rows = max(BLOCK_CELLS // max(stop - start, 1), 1)
+    if rows is None:
+        rows = range(matrix.shape[0])
+    for first in range(0, len(rows), block_rows):
+        block = rows[first:first + block_rows]
+        if isinstance(block, range):
+            yield block, matrix[block.start:block.stop, start:stop]
+        else:
+            yield block, matrix[np.asarray(block), start:stop]
+
+
+def residues(block):
+    """Return which cells of aligned rows hold residues (letters).
+
+    :param block: Array of row bytes.
+    :return: Boolean array of the same shape.
+    """
+    folded = block | 0x20  # lower case
+    return (folded >= ord('a')) & (folded <= ord('z'))
+
+
+def column_stats(matrix, start=0, stop=None, rows=None):
+    """Compute the occupancy and consensus residue of columns.
+
+    The consensus residue of a column is its most frequent residue,
+    ignoring case (the first in the alphabet if tied), or a gap if the
+    column has none.
+
+    :param matrix: Array of aligned rows.
+    :param start: First column (0-based).
+    :param stop: Column after the last (default the width of matrix).
+    :param rows: Sequence of row numbers, or None for all rows.
+    :return: Tuple of array of fractions of rows with a residue in each
+             column, and consensus residues as a string.
+    """
+    if stop is None:
+        stop = matrix.shape[1]
+    width = stop - start
+    counts = np.zeros(width, dtype=np.int64)
+    letter_counts = np.zeros(width * ALPHABET_SIZE, dtype=np.int64)
+    total = 0
+    for block_rows, block in _row_blocks(matrix, rows, start, stop):
+        total += len(block_rows)
+        occupied = residues(block)
+        counts += occupied.sum(axis=0)
+        letters = (block[occupied] & 0xDF).astype(np.intp) - ord('A')
+        columns = np.nonzero(occupied)[1]
+        letter_counts += np.bincount(columns * ALPHABET_SIZE + letters,
+                                     minlength=width * ALPHABET_SIZE)
+    letter_counts = letter_counts.reshape(width, ALPHABET_SIZE)
+    consensus = np.where(counts > 0,
+                         ord('A') + np.argmax(letter_counts, axis=1),
+                         GAP_CODE).astype(np.uint8)
+    occupancy = counts / total if total else np.zeros(width)
+    return occupancy, consensus.tobytes().decode('ascii')
+
+
+def column_residues(matrix, rows=None):
+    """Count the residues in each column of a matrix.
+
+    :param matrix: Array of aligned rows.
+    :param rows: Sequence of row numbers, or None for all rows.
+    :return: Array of counts.
+    """
+    counts = np.zeros(matrix.shape[1], dtype=np.int64)
+    for unused_rows, block in _row_blocks(matrix, rows, 0, matrix.shape[1]):
+        counts += residues(block).sum(axis=0)
+    return counts
+
+
+def row_residues(matrix, columns):
+    """Count the residues of each row of a matrix in some columns.
+
+    :param matrix: Array of aligned rows.
+    :param columns: Array of column numbers (0-based).
+    :return: Array of counts.
+    """
+    counts = np.zeros(matrix.shape[0], dtype=np.int64)
+    for block_rows, block in _row_blocks(matrix, None, 0, matrix.shape[1]):
+        counts[block_rows.start:block_rows.stop] = \
+            residues(block[:, columns]).sum(axis=1)
+    return counts
+
+
+def window_records(matrix, names, rows, start, stop, columns=None):
+    """Yield FASTA records of a window of an alignment matrix.
+
+    :param matrix: Array of aligned rows.
+    :param names: List of the sequence ID of each row of matrix.
+    :param rows: Sequence of row numbers, or None for all rows.
+    :param start: First column (0-based).
+    :param stop: Column after the last.
+    :param columns: Array of the columns of the window (0-based, from
+                    start) to be written, or None for all.
+    :return: Iterator of bytes of FASTA records, a block of rows at a
+             time, with sequence IDs as titles.
+    """
+    for block_rows, block in _row_blocks(matrix, rows, start, stop):
+        if columns is not None:
+            block = block[:, columns]
+        records = []
+        for row, row_bytes in zip(block_rows, block):
+            row_bytes = row_bytes.tobytes()
+            records.append(b'>' + names[row].encode('UTF-8') + b'\n')
+            for line_start in range(0, len(row_bytes), FASTA_LINE_LENGTH):
+                records.append(row_bytes[line_start:line_start +
+                                         FASTA_LINE_LENGTH] + b'\n')
+        yield b''.join(records)
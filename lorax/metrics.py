@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Collect metrics in Redis and expose them to Prometheus.
+
+The web server and the workers run in processes (and containers) of
+their own, so observations are kept in Redis rather than in process
+memory: each histogram is a hash of bucket counts, sums, and counts by
+label set, updated in one pipelined round trip per observation.  Queue
+depths and the age of the oldest queued job are read when metrics are
+scraped.  Metrics are written in the Prometheus text format.
+
+Run times, CPU times, and peak memory of aligners and tree builders are
+taken from the usage records of their runs (see the accounting module),
+which the workers build from the resource use of the processes they
+wait for.
+"""
+#
+# standard library imports
+#
+from datetime import datetime
+#
+# Non-configurable global constants.
+#
+HISTOGRAM_KEY_PREFIX = 'lorax:metrics:'
+METRICS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+WAIT_BUCKETS = (1., 5., 15., 60., 300., 900., 3600., 4. * 3600.,
+                24. * 3600.)
+RUN_TIME_BUCKETS = (.1, 1., 10., 60., 300., 1800., 3600., 4. * 3600.,
+                    24. * 3600.)
+RSS_BUCKETS = tuple(float(2 ** power * 1024 ** 2)  # 1 MiB to 64 GiB
+                    for power in range(0, 17, 2))
+SIZE_BUCKETS = tuple(10. ** power for power in range(3, 11))  # 1 kB to 10 GB
+QUEUE_STATES = ['queued', 'started', 'deferred', 'finished', 'failed']
+#
+# Helper function defs start here.
+#
+
+
+def _format_value(value):
+    """Return a number as written in the Prometheus text format.
+
+    :param value: Number.
+    :return: String.
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    """Return a label set as written in the Prometheus text format.
+
+    :param labels: List of (name, value) pairs.
+    :return: String of comma-separated label="value" pairs.
+    """
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                 .replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels)
+
+
+class Histogram:
+    """Histogram of observations, kept in a Redis hash.
+
+    Fields of the hash are the label set and either a bucket bound (the
+    number of observations above the previous bound), 'sum', or 'count',
+    separated by a tab.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        """Define a histogram.
+
+        :param name: Metric name.
+        :param documentation: Help text.
+        :param labelnames: List of label names.
+        :param buckets: Increasing upper bounds of buckets.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = list(labelnames)
+        self.buckets = list(buckets) + [float('inf')]
+        self.key = HISTOGRAM_KEY_PREFIX + name
+
+    def observe(self, connection, value, **labels):
+        """Add an observation.
+
+        :param connection: Redis connection.
+        :param value: Observed value.
+        :param labels: Value of each label.
+        :return:
+        """
+        label_set = _format_labels((name, labels[name])
+                                   for name in self.labelnames)
+        bound = next(bound for bound in self.buckets if value <= bound)
+        with connection.pipeline(transaction=False) as pipe:
+            pipe.hincrby(self.key, '%s\t%s' % (label_set,
+                                               _format_value(bound)), 1)
+            pipe.hincrbyfloat(self.key, label_set + '\tsum', value)
+            pipe.hincrby(self.key, label_set + '\tcount', 1)
+            pipe.execute()
+
+    def collect(self, connection):
+        """Return the histogram in the Prometheus text format.
+
+        :param connection: Redis connection.
+        :return: List of lines.
+        """
+        series = {}
+        for field, value in connection.hgetall(self.key).items():
+            label_set, _tab, part = field.decode('UTF-8').rpartition('\t')
+            series.setdefault(label_set, {})[part] = float(value)
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s histogram' % self.name]
+        for label_set in sorted(series):
+            values = series[label_set]
+            prefix = label_set + ',' if label_set else ''
+            total = 0
+            for bound in self.buckets:
+                total += int(values.get(_format_value(bound), 0))
+                lines.append('%s_bucket{%sle="%s"} %d' % (
+                    self.name, prefix, _format_value(bound), total))
+            braces = '{%s}' % label_set if label_set else ''
+            lines.append('%s_sum%s %s' % (self.name, braces,
+                                          repr(values.get('sum', 0.))))
+            lines.append('%s_count%s %d' % (self.name, braces,
+                                            int(values.get('count', 0))))
+        return lines
+
+
+REQUEST_DURATION = Histogram('lorax_request_duration_seconds',
+                             'Time to handle HTTP requests, by route.',
+                             ['endpoint', 'method', 'code'],
+                             LATENCY_BUCKETS)
+JOB_WAIT = Histogram('lorax_job_wait_seconds',
+                     'Time jobs waited in queue before a worker took them.',
+                     ['queue'], WAIT_BUCKETS)
+TOOL_WALL_TIME = Histogram('lorax_tool_wall_seconds',
+                           'Elapsed time of aligner and tree-builder runs.',
+                           ['tool'], RUN_TIME_BUCKETS)
+TOOL_CPU_TIME = Histogram('lorax_tool_cpu_seconds',
+                          'User plus system time of aligner and '
+                          'tree-builder runs.',
+                          ['tool'], RUN_TIME_BUCKETS)
+TOOL_MAX_RSS = Histogram('lorax_tool_max_rss_bytes',
+                         'Peak resident memory of aligner and tree-builder '
+                         'runs.',
+                         ['tool'], RSS_BUCKETS)
+FASTA_INGEST_SIZE = Histogram('lorax_fasta_ingest_bytes',
+                              'Size of FASTA files saved.',
+                              ['kind'], SIZE_BUCKETS)
+FASTA_INGEST_TIME = Histogram('lorax_fasta_ingest_seconds',
+                              'Time to parse, check, and save FASTA files.',
+                              ['kind'], LATENCY_BUCKETS)
+HISTOGRAMS = [REQUEST_DURATION, JOB_WAIT, TOOL_WALL_TIME, TOOL_CPU_TIME,
+              TOOL_MAX_RSS, FASTA_INGEST_SIZE, FASTA_INGEST_TIME]
+
+
+def observe_tool_usage(connection, tool, usage):
+    """Add the resource use of a run to the tool histograms.
+
+    :param connection: Redis connection.
+    :param tool: Name of aligner or tree builder.
+    :param usage: Usage record of the run (see accounting.usage_record).
+    :return:
+    """
+    TOOL_WALL_TIME.observe(connection, usage['wall_time'], tool=tool)
+    TOOL_CPU_TIME.observe(connection,
+                          usage['user_time'] + usage['system_time'],
+                          tool=tool)
+    TOOL_MAX_RSS.observe(connection, usage['max_rss'], tool=tool)
+
+
+def queue_metrics(queues):
+    """Return job counts and oldest-job ages of queues.
+
+    :param queues: List of Queue objects.
+    :return: List of lines in the Prometheus text format.
+    """
+    counts = ['# HELP lorax_queue_jobs Jobs in queue and its registries.',
+              '# TYPE lorax_queue_jobs gauge']
+    ages = ['# HELP lorax_queue_oldest_job_age_seconds Time the job at the '
+            'head of the queue has waited.',
+            '# TYPE lorax_queue_oldest_job_age_seconds gauge']
+    now = datetime.utcnow()
+    for q in queues:
+        for state, count in zip(QUEUE_STATES,
+                                [q.count,
+                                 q.started_job_registry.count,
+                                 q.deferred_job_registry.count,
+                                 q.finished_job_registry.count,
+                                 q.failed_job_registry.count]):
+            counts.append('lorax_queue_jobs{%s} %d' % (
+                _format_labels([('queue', q.name), ('state', state)]),
+                count))
+        age = 0.
+        oldest_ids = q.get_job_ids(0, 1)
+        if oldest_ids:
+            oldest = q.fetch_job(oldest_ids[0])
+            if oldest is not None and oldest.enqueued_at is not None:
+                age = max((now - oldest.enqueued_at.replace(tzinfo=None)
+                           ).total_seconds(), 0.)
+        ages.append('lorax_queue_oldest_job_age_seconds{%s} %s' % (
+            _format_labels([('queue', q.name)]), repr(age)))
+    return counts + ages
+
+
+def render_metrics(connection, queues):
+    """Return all metrics in the Prometheus text format.
+
+    :param connection: Redis connection.
+    :param queues: List of Queue objects.
+    :return: Metrics text.
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.collect(connection)
+    lines += queue_metrics(queues)
+    return '\n'.join(lines) + '\n'
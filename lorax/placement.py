@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Place sequences added to an alignment on a tree of the others.
+
+Each added sequence is grafted next to the leaf of the tree whose
+aligned sequence is nearest to it, by the proportion of differing
+residues at consensus positions where both have one (p-distance), with
+a branch as long as that distance.  The result is a starting tree for a
+tree builder, which refines its topology and branch lengths locally
+instead of building the tree from scratch.
+
+Rows of added sequences are held in memory; those of the others are
+compared to them in blocks, so memory is bounded by the number of
+sequences added.
+"""
+#
+# third-party imports
+#
+import numpy as np
+#
+# local imports
+#
+from .fasta import load_fasta_index
+from .stockholm import aligned_fasta_rows
+from .trees import ArrayTree
+#
+# Non-configurable global constants.
+#
+BLOCK_ROWS = 1000  # rows of the tree compared at a time
+#
+# Helper function defs start here.
+#
+
+
+def _consensus_residues(rows):
+    """Return which positions of aligned rows are consensus residues.
+
+    :param rows: Array of row bytes, one row per sequence.
+    :return: Boolean array, True for upper-case letters.
+    """
+    return (rows >= ord('A')) & (rows <= ord('Z'))
+
+
+def nearest_sequences(fasta_path, queries):
+    """Find the nearest of the other sequences to each of some sequences.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :param queries: Set of IDs of sequences.
+    :return: Dictionary by query ID of tuples of title, nearest other ID
+             (None if no other sequence overlaps), and p-distance.
+    """
+    titles = []
+    query_rows = []
+    for title, row in aligned_fasta_rows(fasta_path):
+        if title.split(None, 1)[0] in queries:
+            titles.append(title)
+            query_rows.append(np.frombuffer(row, dtype=np.uint8))
+    if not query_rows:
+        return {}
+    query_rows = np.array(query_rows)
+    query_residues = _consensus_residues(query_rows)
+    best_distances = np.ones(len(titles))
+    best_names = [None] * len(titles)
+
+    def compare(names, rows):
+        rows = np.array(rows)
+        residues = _consensus_residues(rows)
+        for query, (query_row, query_mask) in enumerate(
+                zip(query_rows, query_residues)):
+            shared = residues & query_mask
+            overlaps = shared.sum(axis=1)
+            differences = (shared & (rows != query_row)).sum(axis=1)
+            distances = np.where(overlaps > 0,
+                                 differences / np.maximum(overlaps, 1), 1.)
+            nearest = int(np.argmin(distances))
+            if overlaps[nearest] and \
+                    (best_names[query] is None or
+                     distances[nearest] < best_distances[query]):
+                best_distances[query] = distances[nearest]
+                best_names[query] = names[nearest]
+
+    names = []
+    rows = []
+    for title, row in aligned_fasta_rows(fasta_path):
+        name = title.split(None, 1)[0]
+        if name in queries:
+            continue
+        names.append(name)
+        rows.append(np.frombuffer(row, dtype=np.uint8))
+        if len(rows) == BLOCK_ROWS:
+            compare(names, rows)
+            names = []
+            rows = []
+    if rows:
+        compare(names, rows)
+    return {title.split(None, 1)[0]: (title, name, float(distance))
+            for title, name, distance in zip(titles, best_names,
+                                             best_distances)}
+
+
+def place_sequences(tree_path, fasta_path, out_path):
+    """Write a tree with the sequences of an alignment missing from it.
+
+    Leaves of the tree are matched to sequences by ID (the first word
+    of their names).  Added leaves are named by the IDs of their
+    sequences, or by their titles if names of leaves have spaces (as
+    tree builders that keep whole titles name them).
+
+    :param tree_path: Path to Newick tree.
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :param out_path: Path to which the Newick tree is written.
+    :return: Number of sequences placed, or None if the tree has leaves
+             that are not in the alignment or that share an ID.
+    """
+    with tree_path.open() as tree_fh:
+        tree = ArrayTree.from_newick(tree_fh)
+    leaves = {}
+    for node in tree.terminals():
+        leaves[(tree.name[node] or '').split(None, 1)[0]] = node
+    names = load_fasta_index(fasta_path)
+    if len(leaves) != len(tree.terminals()) or \
+            any(name not in names for name in leaves):
+        return None
+    titled = any(' ' in (tree.name[node] or '') for node in
+                 leaves.values())
+    added = [name for name in names if name not in leaves]
+    nearest = nearest_sequences(fasta_path, set(added))
+    for name in added:
+        title, sibling, distance = nearest[name]
+        # A sequence with no residue in common with any leaf goes at
+        # the root.
+        tree.graft(tree.root if sibling is None else leaves[sibling],
+                   title if titled else name, distance)
+    with out_path.open('wt') as out_fh:
+        tree.write_newick(out_fh)
+    return len(added)
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""Cost-ordered scheduling of queued jobs, with aging and backfill.
+
+Jobs are queued in RQ as usual and are also entered in a sorted set
+per queue, keyed by
+
+    class_offset + predicted_time + aging_rate * enqueue_time
+
+so that short jobs go first, lower priority classes wait longer, and
+every job eventually gets ahead of newer jobs, however short: a job
+that has waited aging_rate times longer than another arrived later
+outranks it, whatever their predicted times.  Workers of class
+BackfillWorker take the job of lowest key that is predicted to finish
+within their max_job_time, so workers that are limited to small jobs
+backfill around large jobs waiting for unlimited workers.  Only jobs
+scheduled with a bounded prediction (one from a fitted cost model) are
+taken by limited workers; any other job may run for hours, whatever
+its predicted time.  Plain RQ workers can run alongside; they take jobs
+in FIFO order.
+
+The simulate function replays a job mix under a scheduling policy, so
+that policies can be compared offline.
+"""
+#
+# standard library imports
+#
+import heapq
+import statistics
+import time
+from datetime import datetime
+#
+# third-party imports
+#
+from rq import Queue, Worker
+from rq.exceptions import DequeueTimeout, NoSuchJobError
+from rq.job import JobStatus
+#
+# local imports
+#
+from . import app
+from .metrics import JOB_WAIT
+#
+# Non-configurable global constants.
+#
+SCHEDULE_KEY_PREFIX = 'lorax:schedule:'
+DEFERRED_KEY = 'lorax:schedule:deferred'  # keys of jobs awaiting others
+ESTIMATES_KEY_PREFIX = 'lorax:estimates:'
+BOUNDS_KEY_PREFIX = 'lorax:bounds:'  # predictions limited workers trust
+JOB_KEY_PREFIX = 'rq:job:'
+SCAN_DEPTH = 100  # scheduled jobs examined per dequeue
+POLL_INTERVAL = 1.  # seconds between polls of empty queues
+#
+# Take the first job, in schedule order, whose bounded time fits; a
+# job without a bound fits only workers with no maximum job time.
+# Entries for jobs that are no longer queued are dropped, except for
+# jobs that are released but not yet queued by RQ.  If no scheduled
+# job fits, unlimited workers take the first queued job that was not
+# scheduled at all (e.g., one queued by another client).
+#
+POP_SCRIPT = '''
+local max_time = tonumber(ARGV[1])
+local ids = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+for _, id in ipairs(ids) do
+    local bound = redis.call('HGET', KEYS[2], id)
+    if max_time < 0 or (bound and tonumber(bound) <= max_time) then
+        if redis.call('LREM', KEYS[3], 1, id) > 0 then
+            redis.call('ZREM', KEYS[1], id)
+            redis.call('HDEL', KEYS[2], id)
+            return id
+        end
+        if redis.call('HGET', ARGV[3] .. id, 'status') ~= 'deferred' then
+            redis.call('ZREM', KEYS[1], id)
+            redis.call('HDEL', KEYS[2], id)
+        end
+    end
+end
+if max_time >= 0 then
+    return false
+end
+for _, id in ipairs(redis.call('LRANGE', KEYS[3], 0,
+                               tonumber(ARGV[2]) - 1)) do
+    if not redis.call('ZSCORE', KEYS[1], id) then
+        redis.call('LREM', KEYS[3], 1, id)
+        return id
+    end
+end
+return false
+'''
+#
+# Helper function defs start here.
+#
+
+
+def schedule_key(predicted_time, enqueue_time, class_offset=0.,
+                 aging_rate=1.):
+    """Return the key by which a job is ordered in the schedule.
+
+    :param predicted_time: Estimated run time in seconds.
+    :param enqueue_time: Time the job was queued, in seconds since epoch.
+    :param class_offset: Penalty in seconds of the job's priority class.
+    :param aging_rate: Seconds of predicted run time forgiven per second
+                       of waiting (0 for pure shortest-job-first).
+    :return: Sort key, lowest first.
+    """
+    return class_offset + predicted_time + aging_rate * enqueue_time
+
+
+def schedule_job(job, predicted_time, priority_class, pipeline=None,
+                 bounded=False):
+    """Enter a job in the schedule of its queue.
+
+    Jobs that are deferred until others finish are held aside, with
+    the key they were given now, until finish_job is called on the job
+    they depend on.
+
+    :param job: Job object, with origin set.
+    :param predicted_time: Estimated run time in seconds.
+    :param priority_class: Name of a class in SCHEDULER_CLASSES.
+    :param pipeline: Redis pipeline to use, if any.
+    :param bounded: Whether predicted_time can be trusted to bound the
+                    run time (e.g., it comes from a fitted cost model),
+                    so that workers with a maximum job time may take
+                    the job.
+    :return:
+    """
+    connection = pipeline if pipeline is not None else job.connection
+    key = schedule_key(predicted_time,
+                       time.time(),
+                       app.config['SCHEDULER_CLASSES'][priority_class],
+                       app.config['SCHEDULER_AGING_RATE'])
+    if bounded:
+        connection.hset(BOUNDS_KEY_PREFIX + job.origin, job.id,
+                        predicted_time)
+        connection.expire(BOUNDS_KEY_PREFIX + job.origin,
+                          app.config['BATCH_TTL'])
+    if job.get_status(refresh=pipeline is None) == JobStatus.DEFERRED:
+        connection.hset(DEFERRED_KEY, job.id, '%s %r' % (job.origin, key))
+        connection.expire(DEFERRED_KEY, app.config['BATCH_TTL'])
+    else:
+        connection.zadd(SCHEDULE_KEY_PREFIX + job.origin, {job.id: key})
+
+
+def finish_job(job):
+    """Update the schedule as a job finishes.
+
+    The job is removed from the schedule, in case a plain RQ worker took
+    it, and jobs that depend on it are moved into the schedule, so that
+    they are there by the time RQ queues them.
+
+    :param job: Job object.
+    :return:
+    """
+    connection = job.connection
+    dependent_ids = job.dependent_ids
+    held = connection.hmget(DEFERRED_KEY, dependent_ids) \
+        if dependent_ids else []
+    with connection.pipeline() as pipe:
+        pipe.zrem(SCHEDULE_KEY_PREFIX + job.origin, job.id)
+        pipe.hdel(BOUNDS_KEY_PREFIX + job.origin, job.id)
+        for dependent_id, entry in zip(dependent_ids, held):
+            if entry is None:
+                continue
+            origin, key = entry.decode('UTF-8').split(' ')
+            pipe.zadd(SCHEDULE_KEY_PREFIX + origin, {dependent_id: key})
+            pipe.hdel(DEFERRED_KEY, dependent_id)
+        pipe.execute()
+
+
+def scheduled_ahead(connection, queue_name, job_id):
+    """Return the jobs ahead of a job in the schedule of its queue.
+
+    :param connection: Redis connection.
+    :param queue_name: Name of queue.
+    :param job_id: ID of job.
+    :return: List of IDs of jobs scheduled before the job, in order, or
+             None if the job is not in the schedule.
+    """
+    rank = connection.zrank(SCHEDULE_KEY_PREFIX + queue_name, job_id)
+    if rank is None:
+        return None
+    if not rank:
+        return []
+    return [job.decode('UTF-8') for job in
+            connection.zrange(SCHEDULE_KEY_PREFIX + queue_name, 0, rank - 1)]
+
+
+def pop_scheduled(connection, queue, max_job_time=None):
+    """Remove the next job that fits from a queue and its schedule.
+
+    :param connection: Redis connection.
+    :param queue: Queue object.
+    :param max_job_time: Longest bounded time of job to take, if any.
+    :return: Job ID, or None if no job fits.
+    """
+    job_id = connection.register_script(POP_SCRIPT)(
+        keys=[SCHEDULE_KEY_PREFIX + queue.name,
+              BOUNDS_KEY_PREFIX + queue.name,
+              queue.key],
+        args=[-1 if max_job_time is None else max_job_time,
+              SCAN_DEPTH,
+              JOB_KEY_PREFIX])
+    if job_id is None:
+        return None
+    return job_id.decode('UTF-8') if isinstance(job_id, bytes) else job_id
+
+
+class ScheduledQueue(Queue):
+    """Queue that is dequeued in schedule order rather than FIFO."""
+
+    @classmethod
+    def dequeue_any(cls, queues, timeout, connection=None, job_class=None,
+                    serializer=None, **kwargs):
+        """Take the next scheduled job from the first queue that has one.
+
+        :param queues: List of Queue objects, in order of preference.
+        :param timeout: Seconds to wait for a job, or None to not wait.
+        :param connection: Redis connection.
+        :param job_class: Job class.
+        :param serializer: Job serializer.
+        :return: Tuple of job and queue, or None.
+        """
+        del kwargs  # other dequeue options are not used
+        max_job_time = app.config['SCHEDULER_MAX_JOB_TIME'] or None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            for queue in queues:
+                job_connection = connection or queue.connection
+                job_id = pop_scheduled(job_connection, queue, max_job_time)
+                if job_id is None:
+                    continue
+                try:
+                    job = (job_class or queue.job_class).fetch(
+                        job_id, connection=job_connection,
+                        serializer=serializer)
+                except NoSuchJobError:  # expired while queued
+                    continue
+                return job, queue
+            if deadline is None:
+                return None
+            if time.monotonic() >= deadline:
+                raise DequeueTimeout(timeout, [queue.key for queue in queues])
+            time.sleep(POLL_INTERVAL)
+
+
+class BackfillWorker(Worker):
+    """Worker that takes jobs in schedule order.
+
+    If SCHEDULER_MAX_JOB_TIME is set (e.g., through the environmental
+    variable LORAX_SCHEDULER_MAX_JOB_TIME), the worker only takes jobs
+    whose bounded predictions are within that many seconds.
+    """
+    queue_class = ScheduledQueue
+
+    def __init__(self, queues, *args, **kwargs):
+        """Make a worker whose queues are dequeued in schedule order.
+
+        The rq command line passes its own queue class (rq.Queue unless
+        --queue-class is given) and queues of that class, which would
+        be dequeued FIFO, so both are replaced.
+
+        :param queues: Queue, queue name, or list of them.
+        :return:
+        """
+        if isinstance(queues, (str, Queue)):
+            queues = [queues]
+        queues = [ScheduledQueue(queue.name,
+                                 connection=queue.connection,
+                                 job_class=queue.job_class,
+                                 serializer=queue.serializer)
+                  if isinstance(queue, Queue) and
+                  not isinstance(queue, ScheduledQueue) else queue
+                  for queue in queues]
+        kwargs['queue_class'] = ScheduledQueue
+        super().__init__(queues, *args, **kwargs)
+
+    def execute_job(self, job, queue):
+        """Record the time a job waited in its queue, then run it.
+
+        :param job: Job object.
+        :param queue: Queue object.
+        :return:
+        """
+        if job.enqueued_at is not None:
+            JOB_WAIT.observe(self.connection,
+                             max((datetime.utcnow() -
+                                  job.enqueued_at.replace(tzinfo=None)
+                                  ).total_seconds(), 0.),
+                             queue=queue.name)
+        return super().execute_job(job, queue)
+
+
+def simulate(jobs, workers, aging_rate=1., class_offsets=None,
+             order='schedule'):
+    """Replay a job mix on a set of workers under a scheduling policy.
+
+    :param jobs: List of dictionaries with 'arrival' time, 'predicted'
+                 and 'actual' run times, and optional 'priority_class'.
+    :param workers: List of max_job_time of each worker (None if not
+                    limited).
+    :param aging_rate: Aging rate of schedule keys.
+    :param class_offsets: Dictionary of offsets of priority classes.
+    :param order: 'schedule' for cost order, or 'fifo'.
+    :return: Dictionary of wait-time and slowdown statistics.
+    """
+    class_offsets = class_offsets or {}
+    jobs = sorted(jobs, key=lambda job: job['arrival'])
+    waiting = []
+    free = list(range(len(workers)))
+    running = []  # heap of (end time, worker)
+    waits = []
+    slowdowns = []
+    busy_time = 0.
+    now = 0.
+    next_job = 0
+    while next_job < len(jobs) or waiting or running:
+        #
+        # Advance to the next arrival or completion.
+        #
+        next_arrival = jobs[next_job]['arrival'] \
+            if next_job < len(jobs) else float('inf')
+        next_end = running[0][0] if running else float('inf')
+        if not waiting or not free:
+            now = min(next_arrival, next_end)
+        while next_job < len(jobs) and jobs[next_job]['arrival'] <= now:
+            job = jobs[next_job]
+            if order == 'fifo':
+                key = job['arrival']
+            else:
+                key = schedule_key(job['predicted'], job['arrival'],
+                                   class_offsets.get(
+                                       job.get('priority_class'), 0.),
+                                   aging_rate)
+            waiting.append((key, next_job, job))
+            next_job += 1
+        while running and running[0][0] <= now:
+            free.append(heapq.heappop(running)[1])
+        #
+        # Start jobs on free workers, each taking the first job that fits.
+        #
+        waiting.sort(key=lambda entry: entry[:2])
+        started = True
+        while free and waiting and started:
+            started = False
+            for worker in sorted(free, key=lambda w: (workers[w] is None,
+                                                      workers[w] or 0)):
+                for index, (key, number, job) in enumerate(waiting):
+                    if workers[worker] is None or \
+                            job['predicted'] <= workers[worker]:
+                        del waiting[index]
+                        free.remove(worker)
+                        heapq.heappush(running,
+                                       (now + job['actual'], worker))
+                        waits.append(now - job['arrival'])
+                        slowdowns.append((now - job['arrival'] +
+                                          job['actual']) /
+                                         max(job['actual'], 1.))
+                        busy_time += job['actual']
+                        started = True
+                        break
+                if started:
+                    break
+        if waiting and free and not started and not running and \
+                next_job >= len(jobs):
+            raise ValueError('Some jobs fit no worker.')
+        if free and waiting and not started:
+            now = min(next_arrival, next_end)
+    makespan = now if not running else max(end for end, w in running)
+    return {'jobs': len(waits),
+            'mean_wait': statistics.mean(waits) if waits else 0.,
+            'median_wait': statistics.median(waits) if waits else 0.,
+            'p95_wait': sorted(waits)[int(0.95 * (len(waits) - 1))]
+            if waits else 0.,
+            'max_wait': max(waits) if waits else 0.,
+            'mean_slowdown': statistics.mean(slowdowns) if slowdowns
+            else 0.,
+            'makespan': makespan,
+            'utilization': busy_time / (makespan * len(workers))
+            if makespan else 0.}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Publish the status of calculations in Redis.
+
+Status codes are written to status files in the data directory, which
+remain the record of each calculation.  Each is also set in a Redis
+hash, keyed by the path of its status file relative to the data
+directory, so that many statuses can be read in one round trip without
+touching the data volume, and announced on a pub/sub channel, so that
+clients can wait for changes instead of polling.  Statuses missing from
+the hash (e.g., after Redis is flushed) are read from their files.
+"""
+#
+# standard library imports
+#
+import time
+#
+# Non-configurable global constants.
+#
+STATUS_KEY = 'lorax:status'  # hash of status codes by status file
+STATUS_CHANNEL = 'lorax:status:changes'  # messages of "field code"
+FORGET_BATCH_SIZE = 1000  # fields removed per HDEL
+#
+# Helper function defs start here.
+#
+
+
+def publish_status(connection, field, code):
+    """Set a status and announce the change.
+
+    :param connection: Redis connection.
+    :param field: Path of status file relative to the data directory.
+    :param code: Status code.
+    :return:
+    """
+    with connection.pipeline() as pipe:
+        pipe.hset(STATUS_KEY, field, code)
+        pipe.publish(STATUS_CHANNEL, '%s %d' % (field, code))
+        pipe.execute()
+
+
+def fetch_statuses(connection, fields):
+    """Return the statuses of many calculations in one round trip.
+
+    :param connection: Redis connection.
+    :param fields: List of paths of status files.
+    :return: List of status codes, None for those not in Redis.
+    """
+    if not fields:
+        return []
+    return [None if code is None else int(code)
+            for code in connection.hmget(STATUS_KEY, fields)]
+
+
+def remember_status(connection, field, code):
+    """Set a status read from its file, unless a newer one was published.
+
+    :param connection: Redis connection.
+    :param field: Path of status file relative to the data directory.
+    :param code: Status code.
+    :return:
+    """
+    connection.hsetnx(STATUS_KEY, field, code)
+
+
+def replace_statuses(connection, statuses):
+    """Replace all statuses, e.g., after a scan of the data directory.
+
+    :param connection: Redis connection.
+    :param statuses: Dictionary of status codes by field.
+    :return:
+    """
+    with connection.pipeline() as pipe:
+        pipe.delete(STATUS_KEY)
+        if statuses:
+            pipe.hset(STATUS_KEY, mapping=statuses)
+        pipe.execute()
+
+
+def forget_statuses(connection, prefix):
+    """Remove the statuses of the calculations in a directory.
+
+    :param connection: Redis connection.
+    :param prefix: Path of directory relative to the data directory.
+    :return: Number of statuses removed.
+    """
+    fields = [field for field, code in
+              connection.hscan_iter(STATUS_KEY, match=prefix + '/*')]
+    for start in range(0, len(fields), FORGET_BATCH_SIZE):
+        connection.hdel(STATUS_KEY, *fields[start:start + FORGET_BATCH_SIZE])
+    return len(fields)
+
+
+def status_changes(connection, fields, timeout, interval=1.):
+    """Wait for changes of statuses.
+
+    The first item is yielded once subscribed, so that statuses read
+    then are current as of the start of the wait and no later change is
+    missed.
+
+    :param connection: Redis connection.
+    :param fields: Collection of fields watched.
+    :param timeout: Seconds until the iterator ends.
+    :param interval: Longest time in seconds between items.
+    :return: Iterator of sets of fields changed since the last item (None
+             for the first item, empty if none changed).
+    """
+    fields = set(fields)
+    deadline = time.monotonic() + timeout
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(STATUS_CHANNEL)
+    try:
+        yield None
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.:
+                return
+            changed = set()
+            message = pubsub.get_message(timeout=min(interval, remaining))
+            while message is not None:
+                if message['type'] == 'message':
+                    field = message['data'].decode('UTF-8').rsplit(' ', 1)[0]
+                    if field in fields:
+                        changed.add(field)
+                message = pubsub.get_message()
+            yield changed
+    finally:
+        pubsub.close()
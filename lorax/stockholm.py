@@ -0,0 +1,639 @@
+# -*- coding: utf-8 -*-
+"""Read, split, and merge Stockholm alignments.
+
+hmmalign aligns each sequence to the HMM independently, so a large
+family can be aligned in chunks that are merged afterward.  Chunks
+differ only in the insert columns between consensus columns, which are
+as wide as the longest insertion in the chunk.  Merging widens each
+insert segment to the widest of any chunk and lays the inserted
+residues out again as hmmalign does: flush right before the first
+consensus column, flush left after the last, and split in half (the
+larger half to the right) between consensus columns.
+
+Chunks are read in Pfam format (Stockholm with one block), one line
+per sequence, so merging streams with memory bounded by line length.
+
+Conversion to FASTA also streams.  Alignments in one block are written
+as they are read; rows of interleaved alignments are gathered block by
+block into fixed-width records of a temporary file, so that memory does
+not grow with the widths of the alignment's rows.  Pfam-format output
+can be converted straight from a pipe, record by record.
+
+Sequences added to a family can be aligned alone and appended to the
+stored FASTA alignment of the others.  Residues in insert columns are
+written in lower case, so the insert segments of a FASTA alignment are
+found from its rows, and the rows of both alignments are laid out again
+as in merging chunks.
+"""
+#
+# standard library imports
+#
+import os
+import tempfile
+#
+# third-party imports
+#
+import numpy as np
+#
+# local imports
+#
+from .fasta import FASTA_LINE_LENGTH
+from .files import open_stored
+#
+# Non-configurable global constants.
+#
+STOCKHOLM_HEADER = '# STOCKHOLM 1.0'
+END_OF_ALIGNMENT = '//'
+INSERT_GAP = '.'
+GAP = '-'
+CONSENSUS_COLUMN = 'x'
+POSTERIOR_NAME = 'PP'
+POSTERIOR_CONSENSUS_NAME = 'PP_cons'
+# Posterior-probability characters and the probabilities they stand for.
+POSTERIOR_VALUES = dict([(str(digit), digit / 10.) for digit in range(10)] +
+                        [('*', 0.975)])
+#
+# Helper function defs start here.
+#
+
+
+def split_fasta(fasta_path, chunk_paths):
+    """Split a FASTA file into chunks of about equal size, in order.
+
+    :param fasta_path: Path to FASTA file.
+    :param chunk_paths: List of paths of chunks to be written.
+    :return: List of numbers of sequences in chunks.
+    """
+    chunk_size = fasta_path.stat().st_size / len(chunk_paths)
+    counts = [0] * len(chunk_paths)
+    chunk = -1
+    out_fh = None
+    written = 0
+    try:
+        with fasta_path.open('rb') as in_fh:
+            for line in in_fh:
+                if line.startswith(b'>') and \
+                        written >= chunk_size * (chunk + 1) and \
+                        chunk + 1 < len(chunk_paths):
+                    if out_fh is not None:
+                        out_fh.close()
+                    chunk += 1
+                    out_fh = chunk_paths[chunk].open('wb')
+                if out_fh is None:
+                    raise ValueError('FASTA file does not start with ">".')
+                if line.startswith(b'>'):
+                    counts[chunk] += 1
+                out_fh.write(line)
+                written += len(line)
+    finally:
+        if out_fh is not None:
+            out_fh.close()
+    for unused_path in chunk_paths[chunk + 1:]:
+        unused_path.touch()
+    return counts
+
+
+def insert_widths(reference):
+    """Return the widths of the insert segments of an RF annotation.
+
+    :param reference: '#=GC RF' string, 'x' for consensus columns.
+    :return: List of widths of the M + 1 insert segments.
+    """
+    return [len(segment) for segment in reference.split(CONSENSUS_COLUMN)]
+
+
+def relayout(row, from_widths, to_widths, gap=INSERT_GAP):
+    """Widen the insert segments of an aligned row.
+
+    :param row: Aligned sequence (or per-residue annotation) string.
+    :param from_widths: Insert widths of the alignment of the row.
+    :param to_widths: Insert widths of the merged alignment.
+    :param gap: Gap character of insert columns.
+    :return: Row laid out for the merged alignment.
+    """
+    last = len(from_widths) - 1
+    pieces = []
+    position = 0
+    for segment, (from_width, to_width) in enumerate(zip(from_widths,
+                                                         to_widths)):
+        inserted = row[position:position + from_width].replace(gap, '')
+        padding = gap * (to_width - len(inserted))
+        if segment == 0:
+            pieces.append(padding + inserted)
+        elif segment == last:
+            pieces.append(inserted + padding)
+        else:
+            half = len(inserted) // 2
+            pieces.append(inserted[:half] + padding + inserted[half:])
+        position += from_width
+        if segment < last:
+            pieces.append(row[position])  # consensus column
+            position += 1
+    return ''.join(pieces)
+
+
+def _scan_chunk(chunk_path):
+    """Return the names, column annotations, and GS lines of a chunk.
+
+    :param chunk_path: Path to Pfam-format Stockholm file.
+    :return: Tuple of longest name length, dictionary of '#=GC' strings,
+             and whether the chunk has any sequences.
+    """
+    name_length = 0
+    column_annotations = {}
+    names = set()
+    with chunk_path.open() as chunk_fh:
+        for line in chunk_fh:
+            if line.startswith('#=GC '):
+                fields = line.split()
+                if len(fields) != 3 or fields[1] in column_annotations:
+                    raise ValueError('Alignment %s is not in Pfam format.' %
+                                     chunk_path.name)
+                column_annotations[fields[1]] = fields[2]
+            elif line.startswith('#=GS ') or line.startswith('#=GR '):
+                name_length = max(name_length, len(line.split()[1]))
+            elif line.strip() and not line.startswith('#') and \
+                    not line.startswith(END_OF_ALIGNMENT):
+                name = line.split()[0]
+                if name in names:
+                    raise ValueError('Alignment %s is not in Pfam format.' %
+                                     chunk_path.name)
+                names.add(name)
+                name_length = max(name_length, len(name))
+    return name_length, column_annotations, bool(names)
+
+
+def merge_stockholm(chunk_paths, out_fh):
+    """Merge Pfam-format Stockholm alignments of chunks of a family.
+
+    Sequences and their annotation lines are written in the order of
+    the chunks, laid out as they would be by aligning all sequences at
+    once.  The consensus posterior probability of each consensus column
+    is the mean over chunks, weighted by residues in the column, of the
+    chunk values, and so is exact only to the precision of the chunk
+    annotations.
+
+    :param chunk_paths: List of paths to alignments of chunks.
+    :param out_fh: Text file handle to which merged alignment is written.
+    :return: Number of sequences written.
+    """
+    scans = [_scan_chunk(chunk_path) for chunk_path in chunk_paths]
+    chunks = [(chunk_path, scan[1]) for chunk_path, scan in
+              zip(chunk_paths, scans) if scan[2]]
+    if not chunks:
+        raise ValueError('No aligned sequences to merge.')
+    chunk_widths = []
+    for chunk_path, column_annotations in chunks:
+        if 'RF' not in column_annotations:
+            raise ValueError('Alignment %s has no RF annotation.' %
+                             chunk_path.name)
+        chunk_widths.append(insert_widths(column_annotations['RF']))
+    if len(set(len(widths) for widths in chunk_widths)) > 1:
+        raise ValueError('Alignments are not to the same HMM.')
+    widths = [max(segment_widths) for segment_widths in zip(*chunk_widths)]
+    reference = CONSENSUS_COLUMN.join(INSERT_GAP * width for width in widths)
+    name_width = max(scan[0] for scan in scans)
+    margin = name_width + len('#=GR  ' + POSTERIOR_NAME)
+    posterior_sums = np.zeros(len(reference))
+    residue_counts = np.zeros(len(reference), dtype=np.int64)
+    out_fh.write(STOCKHOLM_HEADER + '\n\n')
+    for chunk_path, column_annotations in chunks:
+        with chunk_path.open() as chunk_fh:
+            for line in chunk_fh:
+                if line.startswith('#=GF ') and chunk_path == chunks[0][0]:
+                    out_fh.write(line)
+                elif line.startswith('#=GS '):
+                    tag, name, text = line.rstrip('\n').split(' ', 2)
+                    out_fh.write('%s %-*s %s\n' % (tag, name_width, name,
+                                                   text.lstrip(' ')))
+    out_fh.write('\n')
+    sequences = 0
+    for (chunk_path, column_annotations), from_widths in zip(chunks,
+                                                             chunk_widths):
+        chunk_counts = np.zeros(len(reference), dtype=np.int64)
+        with chunk_path.open() as chunk_fh:
+            for line in chunk_fh:
+                if not line.strip() or line.startswith(END_OF_ALIGNMENT) or \
+                        line.startswith('#=GF ') or \
+                        line.startswith('#=GS ') or \
+                        line.startswith('#=GC ') or \
+                        line.startswith(STOCKHOLM_HEADER):
+                    continue
+                fields = line.split()
+                row = relayout(fields[-1], from_widths, widths)
+                if line.startswith('#=GR '):
+                    out_fh.write('%s %-*s %s %s\n' % (
+                        fields[0], name_width, fields[1], fields[2], row))
+                    continue
+                sequences += 1
+                out_fh.write('%-*s %s\n' % (margin, fields[0], row))
+                codes = np.frombuffer(row.encode('ascii'), dtype=np.uint8)
+                chunk_counts += (codes >= ord('A')) & (codes <= ord('Z'))
+        chunk_consensus = column_annotations.get(POSTERIOR_CONSENSUS_NAME)
+        if chunk_consensus is not None:
+            chunk_values = np.array(
+                [POSTERIOR_VALUES.get(value, 0.) for value in
+                 relayout(chunk_consensus, from_widths, widths)])
+            posterior_sums += chunk_counts * chunk_values
+            residue_counts += chunk_counts
+    if any(POSTERIOR_CONSENSUS_NAME in column_annotations
+           for chunk_path, column_annotations in chunks):
+        consensus = ''.join(
+            encode_posterior(total / count) if count and kind ==
+            CONSENSUS_COLUMN else INSERT_GAP
+            for total, count, kind in zip(posterior_sums, residue_counts,
+                                          reference))
+        out_fh.write('%-*s %s\n' % (margin,
+                                    '#=GC ' + POSTERIOR_CONSENSUS_NAME,
+                                    consensus))
+    out_fh.write('%-*s %s\n' % (margin, '#=GC RF', reference))
+    out_fh.write(END_OF_ALIGNMENT + '\n')
+    return sequences
+
+
+def encode_posterior(probability):
+    """Return the character that stands for a posterior probability.
+
+    :param probability: Probability from 0 to 1.
+    :return: '0' to '9', or '*' for 0.95 and above.
+    """
+    if probability + 0.05 >= 1.:
+        return '*'
+    return str(int((probability + 0.05) * 10.))
+
+
+def _stockholm_lines(stockholm_path):
+    """Return the annotation and sequence lines of a Stockholm file.
+
+    :param stockholm_path: Path to (possibly compressed) Stockholm file.
+    :return: Iterator of tuples of line number and fields (see
+             _parse_stockholm_lines).
+    """
+    with open_stored(stockholm_path, 'rb') as stockholm_fh:
+        yield from _parse_stockholm_lines(stockholm_fh, stockholm_path.name)
+
+
+def _parse_stockholm_lines(lines, file_name):
+    """Return the annotation and sequence lines of a Stockholm alignment.
+
+    :param lines: Iterable of lines (as bytes), e.g., a binary file handle.
+    :param file_name: Name of alignment, for error messages.
+    :return: Iterator of tuples of line number and fields: None at the
+             end of a block, the ID, feature, and text of '#=GS' lines,
+             and the name and aligned row (as bytes) of sequence lines.
+    """
+    header_seen = False
+    ended = False
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            if header_seen and not ended:
+                yield line_number, None
+            continue
+        if ended:
+            raise ValueError('%s, line %d: text after "%s".' %
+                             (file_name, line_number, END_OF_ALIGNMENT))
+        if not header_seen:
+            if not line.startswith(STOCKHOLM_HEADER[:11].encode()):
+                raise ValueError('%s is not a Stockholm file.' %
+                                 file_name)
+            header_seen = True
+        elif line.strip() == END_OF_ALIGNMENT.encode():
+            ended = True
+            yield line_number, None
+        elif line.startswith(b'#=GS '):
+            fields = line[5:].decode('UTF-8').strip().split(None, 2)
+            if len(fields) < 2:
+                raise ValueError('%s, line %d: malformed "#=GS" line.' %
+                                 (file_name, line_number))
+            yield line_number, (fields + [''])[:3]
+        elif not line.startswith(b'#'):
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError('%s, line %d: not a name and aligned '
+                                 'sequence.' % (file_name, line_number))
+            yield line_number, (fields[0].decode('UTF-8'), fields[1])
+    if not header_seen:
+        raise ValueError('%s is empty.' % file_name)
+    if not ended:
+        raise ValueError('%s ends without "%s".' % (file_name,
+                                                     END_OF_ALIGNMENT))
+
+
+def _scan_stockholm(stockholm_path):
+    """Return the sequences and block widths of a Stockholm file.
+
+    Every block must have one row of the same width for each sequence
+    of the first block, in the same order, and no others.  A block ends
+    at a blank line, at the end of the alignment, or where a name of the
+    first block recurs.
+
+    :param stockholm_path: Path to (possibly compressed) Stockholm file.
+    :return: Tuple of list of names in order, dictionary of lists of
+             descriptions by ID, and list of widths of blocks.
+    """
+    file_name = stockholm_path.name
+    names = []
+    name_index = {}
+    descriptions = {}
+    block_widths = []
+    position = 0  # index of next row in block
+    width = None
+    for line_number, fields in _stockholm_lines(stockholm_path):
+        if fields is not None and len(fields) == 3:
+            seq_id, feature, text = fields
+            if feature == 'DE':
+                descriptions.setdefault(seq_id, []).append(text)
+            continue
+        if fields is None or \
+                (not block_widths and fields[0] in name_index) or \
+                (block_widths and position == len(names)):
+            if position:
+                if block_widths and position < len(names):
+                    raise ValueError('%s, line %d: block has no row for '
+                                     '%s.' % (file_name, line_number,
+                                              names[position]))
+                block_widths.append(width)
+                position = 0
+            if fields is None:
+                continue
+        name, row = fields
+        if not position:
+            width = len(row)
+        elif len(row) != width:
+            raise ValueError('%s, line %d: row of %s is %d columns wide, '
+                             'not %d as above.' % (file_name, line_number,
+                                                   name, len(row), width))
+        if not block_widths:
+            name_index[name] = len(names)
+            names.append(name)
+        elif name not in name_index:
+            raise ValueError('%s, line %d: %s is not in the first block.' %
+                             (file_name, line_number, name))
+        elif name != names[position]:
+            raise ValueError('%s, line %d: expected a row for %s, not %s.' %
+                             (file_name, line_number, names[position], name))
+        position += 1
+    if not names:
+        raise ValueError('%s has no aligned sequences.' % file_name)
+    return names, descriptions, block_widths
+
+
+def _fasta_record(name, descriptions, row):
+    """Return an aligned sequence as a FASTA record, as Biopython would.
+
+    :param name: Sequence name.
+    :param descriptions: Dictionary of lists of '#=GS DE' texts by ID.
+    :param row: Aligned sequence bytes, with '.' and '-' gaps.
+    :return: FASTA record string.
+    """
+    description = descriptions.get(name)
+    if description is None and '/' in name:  # Pfam name/start-end
+        description = descriptions.get(name.rsplit('/', 1)[0])
+    description = ' '.join(description or [])
+    if description and description.split(None, 1)[0] == name:
+        title = description
+    elif description:
+        title = '%s %s' % (name, description)
+    else:
+        title = name
+    row = row.replace(INSERT_GAP.encode(), GAP.encode()).decode('ascii')
+    return _format_record(title, row)
+
+
+def _format_record(title, row):
+    """Return a FASTA record with lines of the width Biopython writes.
+
+    :param title: Title line, without '>'.
+    :param row: Aligned sequence string.
+    :return: FASTA record string.
+    """
+    return ''.join(['>%s\n' % title] +
+                   [row[start:start + FASTA_LINE_LENGTH] + '\n'
+                    for start in range(0, len(row), FASTA_LINE_LENGTH)])
+
+
+def pfam_to_fasta_records(lines, file_name):
+    """Convert a Pfam-format alignment to FASTA records as it is read.
+
+    Pfam format (Stockholm with one block, as written by hmmalign with
+    "--outformat Pfam") has its '#=GS' lines ahead of the sequences, so
+    each sequence line can be converted as soon as it is read, to the
+    record that stockholm_to_fasta would write for it.
+
+    :param lines: Iterable of lines (as bytes), e.g., a pipe from hmmalign.
+    :param file_name: Name of alignment, for error messages.
+    :return: Iterator of FASTA record strings.
+    """
+    descriptions = {}
+    names = set()
+    width = None
+    block_ended = False
+    for line_number, fields in _parse_stockholm_lines(lines, file_name):
+        if fields is None:
+            block_ended = bool(names)
+            continue
+        if len(fields) == 3:
+            if names:
+                raise ValueError('%s, line %d: "#=GS" line after sequences.'
+                                 % (file_name, line_number))
+            seq_id, feature, text = fields
+            if feature == 'DE':
+                descriptions.setdefault(seq_id, []).append(text)
+            continue
+        name, row = fields
+        if block_ended or name in names:
+            raise ValueError('%s, line %d: alignment is not in Pfam format.'
+                             % (file_name, line_number))
+        if width is None:
+            width = len(row)
+        elif len(row) != width:
+            raise ValueError('%s, line %d: row of %s is %d columns wide, '
+                             'not %d as above.' % (file_name, line_number,
+                                                   name, len(row), width))
+        names.add(name)
+        yield _fasta_record(name, descriptions, row)
+    if not names:
+        raise ValueError('%s has no aligned sequences.' % file_name)
+
+
+def stockholm_to_fasta(stockholm_path, out_fh, buffer_dir=None):
+    """Convert a Stockholm alignment to aligned FASTA.
+
+    The output is that of reading with Bio.AlignIO and writing FASTA:
+    sequences in order of first appearance, described by their '#=GS
+    DE' annotations, with insert gaps written as '-'.  The file is read
+    twice, once to check its layout and once to convert it.
+
+    :param stockholm_path: Path to (possibly compressed) Stockholm file.
+    :param out_fh: Text file handle to which FASTA is written.
+    :param buffer_dir: Directory for rows of interleaved alignments.
+    :return: Number of sequences written.
+    """
+    names, descriptions, block_widths = _scan_stockholm(stockholm_path)
+    if len(block_widths) == 1:
+        for line_number, fields in _stockholm_lines(stockholm_path):
+            if fields is not None and len(fields) == 2:
+                out_fh.write(_fasta_record(fields[0], descriptions,
+                                           fields[1]))
+        return len(names)
+    #
+    # Rows are written to a file with one fixed-width record per
+    # sequence; the file is read and written at offsets, rather than
+    # mapped, so that its pages stay in the page cache rather than in
+    # the resident memory of the process.
+    #
+    row_width = sum(block_widths)
+    with tempfile.TemporaryFile(dir=buffer_dir) as buffer_fh:
+        buffer_fd = buffer_fh.fileno()
+        block = 0
+        start = 0
+        position = 0
+        for line_number, fields in _stockholm_lines(stockholm_path):
+            if fields is not None and len(fields) == 3:
+                continue
+            if fields is None or position == len(names):
+                if position:
+                    start += block_widths[block]
+                    block += 1
+                    position = 0
+                if fields is None:
+                    continue
+            os.pwrite(buffer_fd, fields[1], position * row_width + start)
+            position += 1
+        for index, name in enumerate(names):
+            out_fh.write(_fasta_record(name, descriptions,
+                                       os.pread(buffer_fd, row_width,
+                                                index * row_width)))
+    return len(names)
+
+
+def aligned_fasta_rows(fasta_path):
+    """Return the records of an aligned FASTA file.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :return: Iterator of tuples of title and aligned row (as bytes).
+    """
+    title = None
+    pieces = []
+    with open_stored(fasta_path, 'rb') as fasta_fh:
+        for line in fasta_fh:
+            if line.startswith(b'>'):
+                if title is not None:
+                    yield title, b''.join(pieces)
+                title = line[1:].decode('UTF-8').strip()
+                pieces = []
+            elif title is not None:
+                pieces.append(line.strip())
+    if title is not None:
+        yield title, b''.join(pieces)
+
+
+def _insert_residues(row, inserts, segments, segment_count):
+    """Return the number of residues in each insert segment of a row.
+
+    :param row: Aligned sequence bytes.
+    :param inserts: Boolean array, True for insert columns.
+    :param segments: Array of insert segment of each column.
+    :param segment_count: Number of insert segments (M + 1).
+    :return: Array of counts.
+    """
+    codes = np.frombuffer(row, dtype=np.uint8)
+    residues = inserts & (codes != ord(GAP)) & (codes != ord(INSERT_GAP))
+    return np.bincount(segments[residues], minlength=segment_count)
+
+
+def append_to_fasta_alignment(base_path, delta_path, names, out_fh):
+    """Add the rows of a Pfam-format alignment to an aligned FASTA file.
+
+    Both alignments must be to the same HMM, and the FASTA file written
+    from hmmalign output.  Rows are written in the order of names, laid
+    out as they would be by aligning all of them at once, so that the
+    output is the FASTA conversion of such an alignment.  Rows of the
+    FASTA file that are not named are dropped, and rows of the Pfam
+    alignment take the place of those with the same ID.
+
+    :param base_path: Path to (possibly compressed) aligned FASTA file.
+    :param delta_path: Path to Pfam-format Stockholm alignment.
+    :param names: List of IDs of sequences to be written, in order.
+    :param out_fh: Text file handle to which FASTA is written.
+    :return: Number of sequences written.
+    """
+    column_annotations = _scan_chunk(delta_path)[1]
+    if 'RF' not in column_annotations:
+        raise ValueError('Alignment %s has no RF annotation.' %
+                         delta_path.name)
+    delta_widths = insert_widths(column_annotations['RF'])
+    segment_count = len(delta_widths)
+    descriptions = {}
+    delta_rows = {}
+    with delta_path.open('rb') as delta_fh:
+        for line_number, fields in _parse_stockholm_lines(delta_fh,
+                                                          delta_path.name):
+            if fields is None:
+                continue
+            if len(fields) == 3:
+                seq_id, feature, text = fields
+                if feature == 'DE':
+                    descriptions.setdefault(seq_id, []).append(text)
+                continue
+            delta_rows[fields[0]] = fields[1]
+    #
+    # Insert columns of the FASTA alignment are those with a residue in
+    # lower case in any row.
+    #
+    inserts = None
+    for title, row in aligned_fasta_rows(base_path):
+        codes = np.frombuffer(row, dtype=np.uint8)
+        if inserts is None:
+            inserts = np.zeros(len(codes), dtype=bool)
+        elif len(codes) != len(inserts):
+            raise ValueError('%s: row of %s is %d columns wide, not %d as '
+                             'above.' % (base_path.name, title, len(codes),
+                                         len(inserts)))
+        inserts |= (codes >= ord('a')) & (codes <= ord('z'))
+    if inserts is None:
+        raise ValueError('%s has no aligned sequences.' % base_path.name)
+    if len(inserts) - int(inserts.sum()) + 1 != segment_count:
+        raise ValueError('Alignments are not to the same HMM.')
+    segments = np.cumsum(~inserts)
+    base_widths = np.bincount(segments[inserts], minlength=segment_count)
+    #
+    # Insert segments are as wide as the longest insertion of any row
+    # written.
+    #
+    base_names = set(names) - set(delta_rows)
+    widths = np.zeros(segment_count, dtype=np.int64)
+    for title, row in aligned_fasta_rows(base_path):
+        if title.split(None, 1)[0] in base_names:
+            widths = np.maximum(widths, _insert_residues(row, inserts,
+                                                         segments,
+                                                         segment_count))
+    delta_codes = np.frombuffer(column_annotations['RF'].encode('ascii'),
+                                dtype=np.uint8)
+    delta_inserts = delta_codes != ord(CONSENSUS_COLUMN)
+    delta_segments = np.cumsum(~delta_inserts)
+    for name in names:
+        if name in delta_rows:
+            widths = np.maximum(widths, _insert_residues(delta_rows[name],
+                                                         delta_inserts,
+                                                         delta_segments,
+                                                         segment_count))
+    base_widths = base_widths.tolist()
+    widths = widths.tolist()
+    base_rows = ((title, row) for title, row in aligned_fasta_rows(base_path)
+                 if title.split(None, 1)[0] in base_names)
+    for name in names:
+        if name in delta_rows:
+            row = relayout(delta_rows[name].decode('ascii'), delta_widths,
+                           widths)
+            out_fh.write(_fasta_record(name, descriptions,
+                                       row.encode('ascii')))
+            continue
+        title, row = next(base_rows, (None, None))
+        if title is None or title.split(None, 1)[0] != name:
+            raise ValueError('%s is not in %s in the order given.' %
+                             (name, base_path.name))
+        out_fh.write(_format_record(title, relayout(row.decode('ascii'),
+                                                    base_widths, widths,
+                                                    gap=GAP)))
+    return len(names)
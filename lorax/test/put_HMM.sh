@@ -8,7 +8,7 @@ Usage:
                    HMM    is a hmmer v3 HMM definition file.
 		   FAMILY is the family name (already created).
 		   CODE   is the expected HTTP code for this request
-		          (200 if not specified).
+		          (202 if not specified).
 Example:
        ./put_HMM.sh 59026816.hmm aspartic_peptidases
 "
@@ -55,7 +55,7 @@ if [ -z "$2" ] ; then
 	exit 1
 fi
 if [ -z "${3}" ] ; then
-   code="200"
+   code="202"
 else
    code="${3}"
 fi
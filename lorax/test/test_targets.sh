@@ -38,6 +38,7 @@ test_GET () {
    # Arguments:
    #         $1 - target URL
    #         $2 - expected return code (200 if not supplied)
+   #         $3... - strings the response must contain
    #
    tmpfile=$(mktemp /tmp/lorax-test_all.XXXXX)
    if [ -z "${2:-}" ] ; then
@@ -48,6 +49,7 @@ test_GET () {
    status=$(curl ${LORAX_CURL_ARGS:-} -s -o ${tmpfile} -w '%{http_code}' ${LORAX_CURL_URL}${1})
    if [ "${status}" -eq "${code}" ]; then
       echo "GET ${1} returned HTTP code ${status} as expected."
+      check_response ${tmpfile} "${@:3}"
       if [ "$_V" -eq 1 ]; then
 	 echo "Response is:"
          cat ${tmpfile}
@@ -66,6 +68,79 @@ test_GET () {
    fi
 }
 #
+test_POST () {
+   # Tests HTTP return code of POST, optionally printing results.
+   # The response is kept in RESPONSE.
+   # Arguments:
+   #         $1 - target URL
+   #         $2 - content type of request body
+   #         $3 - request body, or @FILE to send the contents of FILE
+   #         $4 - expected return code
+   #         $5... - strings the response must contain
+   #
+   tmpfile=$(mktemp /tmp/lorax-test_all.XXXXX)
+   code="${4}"
+   status=$(curl ${LORAX_CURL_ARGS:-} -s -o ${tmpfile} -w '%{http_code}' -H "Content-Type: ${2}" --data-binary "${3}" ${LORAX_CURL_URL}${1})
+   if [ "${status}" -eq "${code}" ]; then
+      echo "POST ${1} returned HTTP code ${status} as expected."
+      check_response ${tmpfile} "${@:5}"
+      if [ "$_V" -eq 1 ]; then
+	 echo "Response is:"
+         cat ${tmpfile}
+         echo ""
+	 echo ""
+      fi
+      RESPONSE=$(cat ${tmpfile})
+      rm "$tmpfile"
+   else
+      >&2 echo "ERROR--POST ${LORAX_CURL_URL}${1} returned HTTP code ${status}, expected ${code}."
+      >&2 echo "Full response is:"
+      >&2 cat ${tmpfile}
+      >&2 echo ""
+      rm "$tmpfile"
+      trap - EXIT
+      exit 1
+   fi
+}
+#
+test_events () {
+   # Tests the first events of a Server-Sent Events stream.
+   # Arguments:
+   #         $1 - target URL
+   #         $2 - seconds to read the stream
+   #         $3... - strings the events must contain
+   #
+   tmpfile=$(mktemp /tmp/lorax-test_all.XXXXX)
+   curl ${LORAX_CURL_ARGS:-} -s -N --max-time ${2} -o ${tmpfile} ${LORAX_CURL_URL}${1} || true
+   echo "GET ${1} streamed events for ${2} s."
+   check_response ${tmpfile} "${@:3}"
+   if [ "$_V" -eq 1 ]; then
+      echo "Events are:"
+      cat ${tmpfile}
+      echo ""
+   fi
+   rm "$tmpfile"
+}
+#
+check_response() {
+   # Checks that a response contains strings, exiting if one is missing.
+   # Arguments:
+   #         $1 - file holding response
+   #         $2... - strings the response must contain
+   #
+   for text in "${@:2}"; do
+      if ! grep -qF -- "${text}" ${1}; then
+         >&2 echo "ERROR--response does not contain '${text}'."
+         >&2 echo "Full response is:"
+         >&2 cat ${1}
+         >&2 echo ""
+         rm "${1}"
+         trap - EXIT
+         exit 1
+      fi
+   done
+}
+#
 test_DELETE() {
    # Tests HTTP return code of DELETE, optionally printing results.
    # Arguments:
@@ -108,6 +183,30 @@ poll_until_positive() {
    echo " done."
 }
 #
+poll_until_true() {
+   # Polls a JSON target until a Python expression of its items is true.
+   # Arguments:
+   #         $1 - target URL
+   #         $2 - expression, in names of items of the JSON dictionary
+   #
+   echo -n "Polling ${1} "
+   until curl ${LORAX_CURL_ARGS:-} -s ${LORAX_CURL_URL}${1} | \
+         python3 -c 'import json, sys; sys.exit(not eval(sys.argv[1], {}, json.load(sys.stdin)))' "${2}"; do
+     echo -n "."
+     sleep ${SLEEPTIME}
+   done
+   echo " done."
+}
+#
+json_item() {
+   # Prints an item of a JSON dictionary.
+   # Arguments:
+   #         $1 - JSON text
+   #         $2 - key of item
+   #
+   python3 -c 'import json, sys; print(json.loads(sys.argv[1])[sys.argv[2]])' "${1}" "${2}"
+}
+#
 # Start testing.
 #
 echo "Testing lorax server on ${LORAX_CURL_URL}."
@@ -117,9 +216,15 @@ echo "Testing lorax server on ${LORAX_CURL_URL}."
 test_GET /status
 test_GET /badtarget 404
 test_GET /trees/families.json
+test_GET "/trees/catalog.json?prefix=a&limit=10"
+test_GET "/trees/catalog.json?limit=not_a_number" 400
 
 # Post sequences.
 ./post_FASTA.sh ${verbose_flag}  peptide aspartic_peptidases.faa aspartic_peptidases sequences
+# Look up sequences by ID.
+test_GET /trees/aspartic_peptidases/sequences/aradu.Aradu.K38DA
+test_GET "/trees/aspartic_peptidases/sequences?id=aradu.Aradu.K38DA&id=cicar.Ca_07762"
+test_GET /trees/aspartic_peptidases/sequences/not_a_sequence 404
 # Post non-FASTA file throws a 406.
  ./post_FASTA.sh ${verbose_flag}  peptide 59026816.hmm bad_seqs sequences 406
 # Post alignment.
@@ -131,6 +236,20 @@ test_GET /trees/families.json
 test_GET /trees/aspartic_peptidases/hmmalign
 poll_until_positive /trees/aspartic_peptidases/hmmalign/status
 test_GET /trees/aspartic_peptidases/alignment
+test_GET /trees/aspartic_peptidases/alignment/aradu.Aradu.K38DA
+# Windows of columns and rows of the alignment, and their statistics.
+test_GET "/trees/aspartic_peptidases/alignment?start=1&end=20" 200 \
+   '>aradu.Aradu.K38DA' '>cicar.Ca_07762'
+test_GET "/trees/aspartic_peptidases/alignment?start=10&end=19&id=aradu.Aradu.K38DA&id=cicar.Ca_07762" 200 \
+   '>aradu.Aradu.K38DA' '>cicar.Ca_07762'
+test_GET "/trees/aspartic_peptidases/alignment_stats.json?start=1&end=5" 200 \
+   '"sequences": 18' '"start": 1, "end": 5' '"occupancy": [' '"consensus": "'
+test_GET "/trees/aspartic_peptidases/alignment_stats.json?id=aradu.Aradu.K38DA&id=cicar.Ca_07762" 200 \
+   '"sequences": 2'
+test_GET "/trees/aspartic_peptidases/alignment?start=0&end=5" 400
+test_GET "/trees/aspartic_peptidases/alignment?start=5&end=1" 400
+test_GET "/trees/aspartic_peptidases/alignment_stats.json?start=0" 400
+test_GET "/trees/aspartic_peptidases/alignment?start=1&end=5&id=not_a_sequence" 404
 test_GET /trees/aspartic_peptidases/hmmalign/run_log.txt
 # Calculate a tree.
 test_GET /trees/aspartic_peptidases/FastTree
@@ -138,6 +257,57 @@ poll_until_positive /trees/aspartic_peptidases/FastTree/status
 test_GET /trees/aspartic_peptidases/FastTree/tree.nwk
 test_GET /trees/aspartic_peptidases/FastTree/tree.xml
 test_GET /trees/aspartic_peptidases/FastTree/run_log.txt
+test_GET "/trees/catalog.json?finished=FastTree"
+# Statuses of calculations, one at a time and in bulk.
+test_GET /trees/aspartic_peptidases/FastTree/status 200 0
+test_GET /trees/not_a_family/FastTree/status 404
+test_GET /trees/aspartic_peptidases/not_a_method/status 428
+test_POST /trees/bulk/status application/json \
+   '{"calculations": ["aspartic_peptidases/hmmalign", "aspartic_peptidases/FastTree", "not_a_family/FastTree"]}' 200 \
+   '"aspartic_peptidases/hmmalign": 0' '"aspartic_peptidases/FastTree": 0' '"not_a_family/FastTree": null'
+test_POST "/trees/bulk/status?wait=10" application/json \
+   '{"calculations": ["aspartic_peptidases/FastTree"], "known": {"aspartic_peptidases/FastTree": -1}}' 200 \
+   '"aspartic_peptidases/FastTree": 0'
+test_POST "/trees/bulk/status?wait=1" application/json \
+   '{"calculations": ["aspartic_peptidases/FastTree"], "known": {"aspartic_peptidases/FastTree": 0}}' 200 \
+   '"aspartic_peptidases/FastTree": 0'
+test_POST /trees/bulk/status application/json '{"calculations": ["aspartic_peptidases"]}' 400
+test_POST /trees/bulk/status application/json '{"calculations": ["aspartic_peptidases/not_a_method"]}' 400
+test_POST /trees/bulk/status application/json '{"calculations": [".hidden/FastTree"]}' 400
+test_POST /trees/bulk/status application/json '{"calculations": "aspartic_peptidases/FastTree"}' 400
+test_events "/trees/bulk/status/events?calculation=aspartic_peptidases/FastTree&calculation=not_a_family/FastTree" 3 \
+   'data: {"calculation": "aspartic_peptidases/FastTree", "status": 0}' \
+   'data: {"calculation": "not_a_family/FastTree", "status": null}'
+test_GET "/trees/bulk/status/events?calculation=aspartic_peptidases" 400
+# Calculate trees of a batch of families, of which one tree is cached.
+test_POST /trees/bulk/calculations/FastTree application/json \
+   '{"families": ["aspartic_peptidases", "prealigned", "prealigned", "not_a_family"]}' 202 \
+   '"families": 4' '"cached": 1' '"coalesced": 1' '"errors": {"not_a_family": 428}' '"jobs": 1'
+batch_url=$(json_item "${RESPONSE}" status_url)
+poll_until_true ${batch_url} 'queued + running == 0'
+test_GET ${batch_url} 200 '"finished": 1' '"failed": 0'
+test_GET /trees/prealigned/FastTree/status 200 0
+test_POST /trees/bulk/calculations/not_a_calculation application/json '{"families": ["prealigned"]}' 404
+test_POST /trees/bulk/calculations/FastTree application/json '{"families": "prealigned"}' 400
+test_GET /trees/bulk/batches/not_a_batch 404
+# Load families from an archive, whose member names have a prefix.
+archive_dir=$(mktemp -d /tmp/lorax-test_archive.XXXXX)
+cp aspartic_peptidases.faa ${archive_dir}/lorax_bulkfam.faa
+cp 59026816.hmm ${archive_dir}/lorax_bulkfam.hmm
+cp 59026816.hmm ${archive_dir}/lorax_badfam.faa  # not FASTA
+echo "not a family" > ${archive_dir}/README
+tar -C ${archive_dir} -czf ${archive_dir}.tar.gz .
+test_POST "/trees/bulk/families?strip_prefix=lorax_" application/x-tar @${archive_dir}.tar.gz 202 \
+   '"tasktype": "load"'
+rm -r ${archive_dir} ${archive_dir}.tar.gz
+load_url=$(json_item "${RESPONSE}" status_url)
+poll_until_true ${load_url} 'is_finished or is_failed'
+test_GET ${load_url} 200 '"is_finished": true' '"families": 1' '"hmms": 1' '"hmmstats": 1' \
+   '"skipped": 1' '"error_count": 1' 'badfam'
+test_GET /trees/bulkfam/sequences/aradu.Aradu.K38DA
+test_GET "/trees/catalog.json?prefix=bulkfam" 200 '"sequences": 18' '"hmm_name": "59026816"'
+test_POST /trees/bulk/families application/x-tar '' 400
+test_GET /trees/bulk/families/not_a_job 404
 # Post sof uperfamily to forbidden name throws a 403.
 ./post_FASTA.sh ${verbose_flag}  peptide zeama.faa prealigned.FastTree sequences 403
 # Superfamily tests.
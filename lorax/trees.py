@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+"""Read, root, ladderize, and write trees held in arrays.
+
+Trees are held as parallel lists indexed by node number (parent,
+children, branch length, name, confidence, and comment), rather than as
+a tree of objects, so that trees of many thousands of leaves are read,
+rooted, and written in time and memory linear in their size.
+
+Output is the same as that of Bio.Phylo (as pinned in requirements.txt):
+Newick is read with the rules of Bio.Phylo.NewickIO, and the tree is
+rooted at the midpoint and ladderized as by Bio.Phylo.BaseTree, with the
+same order of children and the same floating-point branch lengths.
+Bio.Phylo finds the midpoint by rerooting at each leaf in turn and
+measuring all depths from it, which is quadratic; here the rerooting at
+each leaf is replayed (its order of children shows in the output), which
+takes time linear in the size of the tree because successive leaves are
+near each other, while the most distant leaves are found from the
+longest paths up and down from each node.
+"""
+#
+# standard library imports
+#
+import re
+#
+# Non-configurable global constants.
+#
+NEWICK_TOKENS = [
+    (r'\(', 'open parens'),
+    (r'\)', 'close parens'),
+    (r"[^\s\(\)\[\]\'\:\;\,]+", 'unquoted node label'),
+    (r'\:\ ?[+-]?[0-9]*\.?[0-9]+([eE][+-]?[0-9]+)?', 'edge length'),
+    (r'\,', 'comma'),
+    (r'\[(\\.|[^\]])*\]', 'comment'),
+    (r"\'(\\.|[^\'])*\'", 'quoted node label'),
+    (r'\;', 'semicolon'),
+    (r'\n', 'newline')]
+NEWICK_TOKENIZER = re.compile('(%s)' % '|'.join(token for token, name in
+                                                NEWICK_TOKENS))
+UNQUOTED_LABEL = re.compile(NEWICK_TOKENS[2][0])
+BRANCH_LENGTH_FORMAT = '%1.5f'
+CONFIDENCE_FORMAT = '%1.2f'
+PHYLOXML_HEADER = ('<phyloxml '
+                   'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                   'xmlns="http://www.phyloxml.org" '
+                   'xsi:schemaLocation="http://www.phyloxml.org '
+                   'http://www.phyloxml.org/1.10/phyloxml.xsd">')
+PHYLOXML_INDENT = '  '
+WRITE_PIECES = 10000  # pieces of output joined per write
+NO_NODE = -1
+# Relative error allowed in comparing path lengths summed in other orders.
+DISTANCE_TOLERANCE = 1e-9
+#
+# Helper function defs start here.
+#
+
+
+def _parse_confidence(text):
+    """Return the support value that an internal node label stands for.
+
+    :param text: Label string.
+    :return: Integer, float, or None if not a number.
+    """
+    if text.isdigit():
+        return int(text)
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _format_comment(comment):
+    """Return a Newick comment, escaped.
+
+    :param comment: Comment string, or None.
+    :return: Bracketed comment, or empty string.
+    """
+    if not comment:
+        return ''
+    return '[%s]' % str(comment).replace('[', '\\[').replace(']', '\\]')
+
+
+def _newick_label(name):
+    """Return a node name as a Newick label, quoted if need be.
+
+    :param name: Node name, or None.
+    :return: Label string.
+    """
+    label = name or ''
+    if label:
+        unquoted = UNQUOTED_LABEL.match(label)
+        if not unquoted or unquoted.end() < len(label):
+            label = "'%s'" % label.replace('\\', '\\\\').replace("'", "\\'")
+    return label
+
+
+def _serialize(value):
+    """Return a value as text of a PhyloXML element.
+
+    :param value: Number, boolean, or string.
+    :return: String.
+    """
+    if isinstance(value, float):
+        return str(value).upper()
+    elif isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def _escape_xml(text):
+    """Escape text of an XML element.
+
+    :param text: String.
+    :return: Escaped string.
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>',
+                                                                   '&gt;')
+
+
+def _simple_element(tag, text, attributes=''):
+    """Return an XML element without children.
+
+    :param tag: Tag name.
+    :param text: Text of element.
+    :param attributes: Attribute string, with leading space.
+    :return: Element string.
+    """
+    if not text:
+        return '<%s%s />' % (tag, attributes)
+    return '<%s%s>%s</%s>' % (tag, attributes, _escape_xml(text), tag)
+
+
+class ArrayTree:
+    """Tree held in lists indexed by node number."""
+
+    def __init__(self):
+        """Make an empty tree.
+
+        :return:
+        """
+        self.parent = []
+        self.children = []
+        self.length = []
+        self.name = []
+        self.confidence = []
+        self.comment = []
+        self.root = NO_NODE
+        self.rooted = False
+
+    def add_node(self, parent=NO_NODE, length=None):
+        """Add a node, not yet a child of its parent.
+
+        :param parent: Number of parent node.
+        :param length: Length of branch to parent.
+        :return: Number of node.
+        """
+        self.parent.append(parent)
+        self.children.append([])
+        self.length.append(length)
+        self.name.append(None)
+        self.confidence.append(None)
+        self.comment.append(None)
+        return len(self.parent) - 1
+
+    def _attach(self, node, parent, position=None):
+        """Make a node a child of another.
+
+        :param node: Number of child node.
+        :param parent: Number of parent node.
+        :param position: Index in children, default last.
+        :return:
+        """
+        if position is None:
+            self.children[parent].append(node)
+        else:
+            self.children[parent].insert(position, node)
+        self.parent[node] = parent
+
+    def graft(self, sibling, name, length):
+        """Add a leaf as the sibling of a node.
+
+        The branch above the node is split in half by a new node that
+        takes its place among the children of its parent and has the
+        node and the leaf as children.  A leaf grafted next to the root
+        becomes a child of the root.
+
+        :param sibling: Number of node.
+        :param name: Name of leaf.
+        :param length: Length of branch to leaf.
+        :return: Number of leaf.
+        """
+        if sibling == self.root:
+            node = self.root
+        else:
+            parent = self.parent[sibling]
+            half = (self.length[sibling] or 0.) / 2.
+            node = self.add_node(parent, half)
+            self.children[parent][self.children[parent].index(sibling)] = \
+                node
+            self.length[sibling] = half
+            self._attach(sibling, node)
+        leaf = self.add_node(length=length)
+        self.name[leaf] = name
+        self._attach(leaf, node)
+        return leaf
+
+    @classmethod
+    def from_newick(cls, tree_fh):
+        """Read a file of one Newick tree, as Bio.Phylo.read would.
+
+        :param tree_fh: Text file handle.
+        :return: ArrayTree object.
+        """
+        texts = []
+        buf = ''
+        for line in tree_fh:
+            buf += line.rstrip()
+            if buf.endswith(';'):
+                texts.append(buf)
+                buf = ''
+                if len(texts) > 1:
+                    break
+        if buf:
+            texts.append(buf)
+        if not texts:
+            raise ValueError('There are no trees in this file.')
+        if len(texts) > 1:
+            raise ValueError('There are multiple trees in this file.')
+        tree = cls()
+        tree._parse_newick(texts[0])
+        return tree
+
+    def _process_node(self, node, open_nodes):
+        """Finish a parsed node and attach it to its parent.
+
+        :param node: Number of node.
+        :param open_nodes: Set of nodes not yet attached.
+        :return: Number of parent, or NO_NODE if already attached.
+        """
+        if self.name[node] and self.confidence[node] is None and \
+                self.children[node]:
+            self.confidence[node] = _parse_confidence(self.name[node])
+            if self.confidence[node] is not None:
+                self.name[node] = None
+        if node not in open_nodes:
+            return NO_NODE
+        open_nodes.discard(node)
+        parent = self.parent[node]
+        self.children[parent].append(node)
+        return parent
+
+    def _parse_newick(self, text):
+        """Parse the text of a Newick tree.
+
+        :param text: Tree string.
+        :return:
+        """
+        open_nodes = set()  # nodes with a parent that are not yet attached
+        root = self.add_node()
+        current = root
+        open_parens = 0
+        close_parens = 0
+        tokens = NEWICK_TOKENIZER.finditer(text.strip())
+        for match in tokens:
+            token = match.group()
+            if token.startswith("'"):
+                self.name[current] = token[1:-1]
+            elif token.startswith('['):
+                self.comment[current] = token[1:-1]
+            elif token == '(':
+                current = self.add_node(current)
+                open_nodes.add(current)
+                open_parens += 1
+            elif token == ',':
+                if current == root:  # outer parentheses are missing
+                    root = self.add_node()
+                    self.parent[current] = root
+                    open_nodes.add(current)
+                parent = self._process_node(current, open_nodes)
+                current = self.add_node(parent)
+                open_nodes.add(current)
+            elif token == ')':
+                parent = self._process_node(current, open_nodes)
+                if parent == NO_NODE:
+                    raise ValueError('Parenthesis mismatch.')
+                current = parent
+                close_parens += 1
+            elif token == ';':
+                break
+            elif token.startswith(':'):
+                self.length[current] = float(token[1:])
+            elif token != '\n':
+                self.name[current] = token
+        if open_parens != close_parens:
+            raise ValueError('Number of open/close parentheses do not match.')
+        for match in tokens:
+            raise ValueError('Text after semicolon in Newick tree: %s' %
+                             match.group())
+        self._process_node(current, open_nodes)
+        self._process_node(root, open_nodes)
+        self.parent[root] = NO_NODE
+        self.root = root
+
+    def preorder(self, node=None):
+        """Return the nodes under a node, parents before children.
+
+        :param node: Number of node, default the root.
+        :return: List of node numbers.
+        """
+        order = []
+        stack = [self.root if node is None else node]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(reversed(self.children[node]))
+        return order
+
+    def terminals(self):
+        """Return the leaves of the tree, in preorder.
+
+        :return: List of node numbers.
+        """
+        return [node for node in self.preorder() if not self.children[node]]
+
+    def path(self, node):
+        """Return the nodes from below the root down to a node.
+
+        :param node: Number of node.
+        :return: List of node numbers, ending with node.
+        """
+        path = []
+        while node != self.root:
+            path.append(node)
+            node = self.parent[node]
+        path.reverse()
+        return path
+
+    def reroot(self, outgroup, outgroup_length=None):
+        """Reroot on the branch to a node, as Bio.Phylo root_with_outgroup.
+
+        :param outgroup: Number of node.
+        :param outgroup_length: Length of branch to the outgroup from the
+                                new root, default 0 for a leaf, or the
+                                node itself as root.
+        :return:
+        """
+        length = self.length
+        children = self.children
+        path = self.path(outgroup)
+        if not path:
+            return
+        previous_length = length[outgroup] or 0.
+        if not children[outgroup] or outgroup_length is not None:
+            length[outgroup] = outgroup_length or 0.
+            new_root = self.add_node(length=length[self.root])
+            self._attach(outgroup, new_root)
+            if len(path) == 1:
+                new_parent = new_root
+            else:
+                parent = path.pop(-2)
+                children[parent].remove(outgroup)
+                previous_length, length[parent] = \
+                    length[parent], previous_length - length[outgroup]
+                self._attach(parent, new_root, 0)
+                new_parent = parent
+        else:
+            new_root = outgroup
+            length[new_root] = length[self.root]
+            new_parent = new_root
+        for parent in path[-2::-1]:
+            children[parent].remove(new_parent)
+            previous_length, length[parent] = length[parent], previous_length
+            self._attach(parent, new_parent, 0)
+            new_parent = parent
+        old_root = self.root
+        if outgroup in children[old_root]:
+            children[old_root].remove(outgroup)
+        else:
+            children[old_root].remove(new_parent)
+        if len(children[old_root]) == 1:
+            ingroup = children[old_root].pop()
+            if length[ingroup]:
+                length[ingroup] += previous_length
+            else:
+                length[ingroup] = previous_length
+            self._attach(ingroup, new_parent, 0)
+        else:
+            length[old_root] = previous_length
+            self._attach(old_root, new_parent, 0)
+        self.parent[new_root] = NO_NODE
+        self.root = new_root
+        self.rooted = True
+
+    def _longest_paths(self):
+        """Return the longest paths down from and up from each node.
+
+        :return: Tuple of lists: longest path down, child it starts to
+                 (NO_NODE if none), longest path down through any other
+                 child, and longest path up through the parent.
+        """
+        order = self.preorder()
+        length = [branch_length or 0 for branch_length in self.length]
+        down = [0.] * len(length)
+        down_child = [NO_NODE] * len(length)
+        down_other = [0.] * len(length)
+        for node in reversed(order):
+            for child in self.children[node]:
+                through = length[child] + down[child]
+                if through > down[node]:
+                    down_other[node] = down[node]
+                    down[node] = through
+                    down_child[node] = child
+                elif through > down_other[node]:
+                    down_other[node] = through
+        up = [0.] * len(length)
+        for node in order:
+            for child in self.children[node]:
+                sideways = down_other[node] if down_child[node] == child \
+                    else down[node]
+                up[child] = length[child] + max(up[node], sideways)
+        return down, down_child, down_other, up
+
+    def _eccentricities(self, leaves):
+        """Return the greatest depth of the tree rooted at each leaf.
+
+        Depths are summed from the root down, as Bio.Phylo does, for the
+        leaves that may be the most distant from any other; others are
+        returned as None.
+
+        :param leaves: List of leaf numbers.
+        :return: List of greatest depths.
+        """
+        down, down_child, down_other, up = self._longest_paths()
+        length = [branch_length or 0 for branch_length in self.length]
+        start = self.length[self.root] or 0
+        longest = max(up[leaf] for leaf in leaves)
+        tolerance = DISTANCE_TOLERANCE * (sum(abs(branch_length) for
+                                              branch_length in length) +
+                                          abs(start))
+        threshold = start + longest - tolerance
+
+        def farther(node, previous):
+            """Return the longest path from node not back to previous."""
+            if previous == self.parent[node]:
+                return down[node]
+            sideways = down_other[node] if down_child[node] == previous \
+                else down[node]
+            return max(up[node], sideways)
+
+        depths = []
+        for leaf in leaves:
+            if up[leaf] < longest - tolerance:
+                depths.append(None)
+                continue
+            greatest = max(start, start + 0.)
+            stack = [(self.parent[leaf], leaf, start + length[leaf])]
+            while stack:
+                node, previous, depth = stack.pop()
+                greatest = max(greatest, depth)
+                if depth + farther(node, previous) < threshold:
+                    continue
+                neighbors = list(self.children[node])
+                if self.parent[node] != NO_NODE:
+                    neighbors.append(self.parent[node])
+                for neighbor in neighbors:
+                    if neighbor == previous:
+                        continue
+                    edge = length[node] if neighbor == self.parent[node] \
+                        else length[neighbor]
+                    stack.append((neighbor, node, depth + edge))
+            depths.append(greatest)
+        return depths
+
+    def _deepest(self):
+        """Return the first node, in preorder, of greatest depth.
+
+        :return: Tuple of node number and depth.
+        """
+        depth = [0] * len(self.parent)
+        depth[self.root] = self.length[self.root] or 0
+        deepest = self.root
+        for node in self.preorder():
+            if node != self.root:
+                depth[node] = depth[self.parent[node]] + \
+                    (self.length[node] or 0)
+                if depth[node] > depth[deepest]:
+                    deepest = node
+        return deepest, depth[deepest]
+
+    def root_at_midpoint(self):
+        """Root at the midpoint of the two most distant leaves.
+
+        :return:
+        """
+        leaves = self.terminals()
+        if leaves == [self.root]:
+            raise ValueError('Tree has no branches to root on.')
+        self.reroot(leaves[0])
+        depths = self._eccentricities(leaves)
+        max_distance = max(depth for depth in depths if depth is not None)
+        if not max_distance > 0.:
+            raise ValueError('Tree has no branch lengths to root on.')
+        tip1 = leaves[depths.index(max_distance)]
+        tip2 = None
+        for leaf in leaves:
+            if leaf != leaves[0]:
+                self.reroot(leaf)
+            if leaf == tip1:
+                tip2, max_distance = self._deepest()
+        self.reroot(tip1)
+        root_remainder = 0.5 * (max_distance - (self.length[self.root] or 0))
+        for node in self.path(tip2):
+            if self.length[node] is None:
+                raise ValueError('Tree has branches without lengths.')
+            root_remainder -= self.length[node]
+            if root_remainder < 0:
+                self.reroot(node, -root_remainder)
+                return
+        raise ValueError('Failed to find the midpoint.')
+
+    def ladderize(self):
+        """Sort children by number of leaves under them, fewest first.
+
+        :return:
+        """
+        order = self.preorder()
+        leaf_counts = [1] * len(self.parent)
+        for node in reversed(order):
+            if self.children[node]:
+                leaf_counts[node] = sum(leaf_counts[child] for child in
+                                        self.children[node])
+        for node in order:
+            self.children[node].sort(key=leaf_counts.__getitem__)
+
+    def _newick_info(self, node):
+        """Return the support, branch length, and comment of a node.
+
+        :param node: Number of node.
+        :return: String.
+        """
+        branch_length = BRANCH_LENGTH_FORMAT % (self.length[node] or 0.)
+        if self.children[node] and self.confidence[node] is not None:
+            info = CONFIDENCE_FORMAT % self.confidence[node] + ':' + \
+                branch_length
+        else:
+            info = ':' + branch_length
+        return info + _format_comment(self.comment[node])
+
+    def write_newick(self, out_fh):
+        """Write the tree in Newick format, as Bio.Phylo.write would.
+
+        :param out_fh: Text file handle.
+        :return:
+        """
+        pieces = []
+        stack = [(self.root, False)]
+        while stack:
+            node, closing = stack.pop()
+            if node == NO_NODE:
+                pieces.append(',')
+            elif closing or not self.children[node]:
+                pieces.append((')' if closing else '') +
+                              _newick_label(self.name[node]) +
+                              self._newick_info(node))
+            else:
+                pieces.append('(')
+                stack.append((node, True))
+                for index, child in enumerate(reversed(self.children[node])):
+                    if index:
+                        stack.append((NO_NODE, False))  # comma
+                    stack.append((child, False))
+            if len(pieces) >= WRITE_PIECES:
+                out_fh.write(''.join(pieces))
+                pieces = []
+        pieces.append(';\n')
+        out_fh.write(''.join(pieces))
+
+    def write_phyloxml(self, out_fh):
+        """Write the tree in PhyloXML format, as Bio.Phylo.write would.
+
+        :param out_fh: Text file handle.
+        :return:
+        """
+        pieces = [PHYLOXML_HEADER, '\n', PHYLOXML_INDENT,
+                  '<phylogeny rooted="%s">' % _serialize(self.rooted)]
+        stack = [(self.root, 2, False)]
+        while stack:
+            node, level, closing = stack.pop()
+            indent = '\n' + PHYLOXML_INDENT * level
+            if closing:
+                pieces.append(indent + '</clade>')
+                continue
+            elements = []
+            if self.name[node] is not None:
+                elements.append(_simple_element('name', self.name[node]))
+            if self.length[node] is not None:
+                elements.append(_simple_element(
+                    'branch_length', _serialize(self.length[node])))
+            if self.confidence[node] is not None:
+                elements.append(_simple_element(
+                    'confidence', _serialize(self.confidence[node]),
+                    ' type="unknown"'))
+            if not elements and not self.children[node]:
+                pieces.append(indent + '<clade />')
+                continue
+            pieces.append(indent + '<clade>')
+            for element in elements:
+                pieces.append(indent + PHYLOXML_INDENT + element)
+            stack.append((node, level, True))
+            for child in reversed(self.children[node]):
+                stack.append((child, level + 1, False))
+            if len(pieces) >= WRITE_PIECES:
+                out_fh.write(''.join(pieces))
+                pieces = []
+        pieces.append('\n' + PHYLOXML_INDENT + '</phylogeny>\n</phyloxml>')
+        out_fh.write(''.join(pieces))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Trim gappy columns and sparse sequences from alignments.
+
+Columns in which most sequences have gaps (such as the insert columns
+of long insertions in a few sequences) carry little signal for tree
+building but add to its time, which grows with the width of the
+alignment.  An alignment is trimmed by dropping the columns whose
+fraction of gaps is above a threshold, and then the sequences with
+residues in fewer than a fraction of the columns kept.  Counts are
+taken from the byte matrix of the alignment (see the matrix module),
+a block of rows at a time.
+
+The columns kept are recorded, as ranges of columns of the alignment,
+so that positions in the trimmed alignment can be mapped back to it.
+"""
+#
+# third-party imports
+#
+import numpy as np
+#
+# local imports
+#
+from .fasta import load_fasta_index
+from .matrix import (column_residues, load_alignment_matrix, row_residues,
+                     window_records)
+#
+# Helper function defs start here.
+#
+
+
+def column_ranges(columns):
+    """Return runs of consecutive columns.
+
+    :param columns: Sorted array of column numbers (0-based).
+    :return: List of [first, last] column numbers (1-based) of runs.
+    """
+    if not len(columns):
+        return []
+    breaks = np.flatnonzero(np.diff(columns) != 1)
+    firsts = columns[np.concatenate(([0], breaks + 1))] + 1
+    lasts = columns[np.concatenate((breaks, [len(columns) - 1]))] + 1
+    return [[int(first), int(last)] for first, last in zip(firsts, lasts)]
+
+
+def trim_alignment(fasta_path, out_path, max_gap_fraction, min_coverage=0.):
+    """Write an alignment with its gappy columns and sparse rows dropped.
+
+    :param fasta_path: Path to (possibly compressed) aligned FASTA file.
+    :param out_path: Path to which trimmed FASTA is written, with
+                     sequence IDs as titles.
+    :param max_gap_fraction: Largest fraction of rows with a gap in a
+                             column kept.
+    :param min_coverage: Smallest fraction of the columns kept in which
+                         a row kept has residues.
+    :return: Dictionary of the thresholds, the width and number of
+             sequences of the alignment, the ranges of 'columns' kept
+             (see column_ranges), the numbers of columns and sequences
+             kept, and the IDs of the sequences dropped.
+    :raises ValueError: If no columns or no rows are kept.
+    """
+    matrix = load_alignment_matrix(fasta_path)
+    names = list(load_fasta_index(fasta_path))
+    rows, width = matrix.shape
+    gaps = rows - column_residues(matrix)
+    columns = np.flatnonzero(gaps <= max_gap_fraction * rows)
+    if not len(columns):
+        raise ValueError('Every column of %s is more than %g gaps.' %
+                         (fasta_path, max_gap_fraction))
+    covered = row_residues(matrix, columns)
+    kept_rows = np.flatnonzero(covered >= min_coverage * len(columns))
+    if not len(kept_rows):
+        raise ValueError('No row of %s has residues in %g of %d columns.' %
+                         (fasta_path, min_coverage, len(columns)))
+    with out_path.open('wb') as out_fh:
+        for records in window_records(matrix, names,
+                                      None if len(kept_rows) == rows
+                                      else kept_rows.tolist(),
+                                      0, width, columns=columns):
+            out_fh.write(records)
+    kept = set(kept_rows.tolist())
+    return {'max_gap_fraction': max_gap_fraction,
+            'min_coverage': min_coverage,
+            'width': width,
+            'sequences': rows,
+            'columns': column_ranges(columns),
+            'kept_columns': len(columns),
+            'kept_sequences': len(kept_rows),
+            'dropped_sequences': [name for row, name in enumerate(names)
+                                  if row not in kept]}